@@ -0,0 +1,148 @@
+"""
+Control de admisión para las llamadas a Ollama.
+
+Limita cuántas generaciones hay en curso a la vez y encola el resto en una
+cola acotada con prioridad (FIFO dentro de la misma prioridad). Rechaza de
+inmediato cuando la cola está llena o cuando, con los tiempos de servicio
+observados, la petición no puede terminar antes de su deadline.
+
+max_inflight=0 no limita las generaciones en curso y max_queue=0 no limita
+la cola; con ambos en 0 solo actúan los deadlines.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from typing import Optional
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionScheduler:
+    def __init__(self, max_inflight: int, max_queue: int, ewma_alpha: float = 0.2):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.ewma_alpha = ewma_alpha
+
+        self.inflight = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._service_time = {}
+        self.rejected = {"queue_full": 0, "deadline": 0}
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for entry in self._queue if not entry[2].done())
+
+    def service_time(self, phase: str) -> Optional[float]:
+        """Media móvil exponencial del tiempo de servicio de una fase"""
+        return self._service_time.get(phase)
+
+    def _saturated(self) -> bool:
+        return 0 < self.max_inflight <= self.inflight
+
+    def _mean_service_time(self) -> Optional[float]:
+        if not self._service_time:
+            return None
+        return sum(self._service_time.values()) / len(self._service_time)
+
+    def estimate_completion(self, phases: tuple) -> Optional[float]:
+        """
+        Segundos estimados hasta terminar `phases` si se encolara ahora.
+        None mientras no haya tiempos observados para todas las fases.
+        """
+        services = [self._service_time.get(p) for p in phases]
+        if any(s is None for s in services):
+            return None
+        wait = 0.0
+        if self._saturated():
+            wait = (self.queued + 1) / self.max_inflight * self._mean_service_time()
+        return wait + sum(services)
+
+    def retry_after(self) -> float:
+        mean = self._mean_service_time() or 1.0
+        return max(1, math.ceil((self.queued + 1) / max(1, self.max_inflight) * mean))
+
+    def check(self, phases: tuple, deadline: Optional[float] = None) -> Optional[AdmissionRejected]:
+        """Rechazo que se produciría ahora mismo sin encolar, o None"""
+        if deadline is not None:
+            estimate = self.estimate_completion(phases)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (estimate is not None and estimate > remaining):
+                return AdmissionRejected("deadline cannot be met", self.retry_after())
+        if self._saturated() and 0 < self.max_queue <= self.queued:
+            return AdmissionRejected("admission queue is full", self.retry_after())
+        return None
+
+    async def acquire(self, phases: tuple, priority: int = 0, deadline: Optional[float] = None):
+        """
+        Espera un hueco para ejecutar phases[0].
+
+        Args:
+            phases: fase actual seguida de las que aún quedan (para estimar el deadline)
+            priority: mayor valor = se atiende antes
+            deadline: instante time.monotonic() límite, o None
+        """
+        rejection = self.check(phases, deadline)
+        if rejection is not None:
+            self.rejected["queue_full" if "full" in rejection.reason else "deadline"] += 1
+            raise rejection
+
+        if not self._saturated() and not self.queued:
+            self.inflight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (-priority, next(self._seq), future))
+        try:
+            if deadline is None:
+                await future
+            else:
+                await asyncio.wait_for(asyncio.shield(future), timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            self.rejected["deadline"] += 1
+            raise AdmissionRejected("deadline expired while queued", self.retry_after())
+        except BaseException:
+            self._abandon(future)
+            raise
+
+    def _abandon(self, future: asyncio.Future):
+        if future.done() and not future.cancelled():
+            # El hueco ya se había cedido a esta entrada: devolverlo
+            self.release()
+        else:
+            future.cancel()
+
+    def release(self, phase: Optional[str] = None, service_time: Optional[float] = None):
+        if phase is not None and service_time is not None:
+            previous = self._service_time.get(phase)
+            self._service_time[phase] = (
+                service_time if previous is None
+                else self.ewma_alpha * service_time + (1 - self.ewma_alpha) * previous
+            )
+
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                # Se cede el hueco directamente: inflight no cambia
+                future.set_result(None)
+                return
+        self.inflight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "service_time_s": {k: round(v, 3) for k, v in self._service_time.items()},
+            "rejected": dict(self.rejected),
+        }
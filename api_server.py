@@ -1,171 +1,2145 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import aclosing, asynccontextmanager
+from contextvars import ContextVar
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import requests
+import aiohttp
+import asyncio
 import json
+import os
+import re
+import time
 from typing import Optional
 
+from admission import AdmissionRejected, AdmissionScheduler
+from backends import Backend, BackendPool
+from config_validation import NetworkInventory, validate_block, validate_config
+from device_blocks import DeviceBlockParser, devices_in_steps, known_devices, parse_device_blocks
+from disconnect import CancelOnDisconnectMiddleware, ClientDisconnected, raise_if_client_gone
+from fast_classifier import FastClassifier
+from health import HealthProber
+from hedging import HedgePolicy, hedged_call
+from jobs import JOB_STATUSES, JobQueue
+from model_ladder import ModelLadder
+from metrics import REGISTRY, TOKENS_PER_SECOND_BUCKETS, Counter, Gauge, Histogram
+from response_cache import ResponseCache, make_key, normalize_requirement, text_hash
+from semantic_cache import SemanticCache
+from sessions import SessionStore, TopologySession
+from tracing import Tracer, TracingMiddleware, current_span, span
+
 # Configuración de Ollama
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 MODEL_ID = "llama3.1:8b-instruct-q8_0"
 
-app = FastAPI(title="Network Config Generator API")
+# Escalera de modelos del preferido al más barato, separados por comas (por
+# defecto solo MODEL_ID). Bajo carga se baja un peldaño cuando el p95 de la
+# espera en cola (admisión o scheduler de Ollama) o de la latencia supera su
+# umbral (0 = señal desactivada).
+MODEL_LADDER = [m.strip() for m in os.getenv("MODEL_LADDER", "").split(",") if m.strip()] or [MODEL_ID]
+MODEL_ID = MODEL_LADDER[0]
+MODEL_DOWNGRADE_QUEUE_WAIT_S = float(os.getenv("MODEL_DOWNGRADE_QUEUE_WAIT_S", "2"))
+MODEL_DOWNGRADE_P95_S = float(os.getenv("MODEL_DOWNGRADE_P95_S", "0"))
+MODEL_LADDER_WINDOW_S = float(os.getenv("MODEL_LADDER_WINDOW_S", "60"))
+MODEL_LADDER_COOLDOWN_S = float(os.getenv("MODEL_LADDER_COOLDOWN_S", "30"))
+MODEL_LADDER_RECOVER_RATIO = float(os.getenv("MODEL_LADDER_RECOVER_RATIO", "0.5"))
+MODEL_LADDER_MIN_SAMPLES = int(os.getenv("MODEL_LADDER_MIN_SAMPLES", "20"))
+
+# Varias instancias de Ollama separadas por comas (por defecto solo OLLAMA_BASE_URL).
+# Cada llamada va a la de menos requests pendientes; las caídas se expulsan con backoff.
+OLLAMA_BACKENDS = [u.strip() for u in os.getenv("OLLAMA_BACKENDS", OLLAMA_BASE_URL).split(",") if u.strip()]
+BACKEND_HEALTH_INTERVAL = float(os.getenv("BACKEND_HEALTH_INTERVAL", "10"))
+# Sondeo de salud en segundo plano (cada BACKEND_HEALTH_INTERVAL): /api/tags, /api/ps y,
+# si HEALTH_CANARY_INTERVAL > 0, una generación de 1 token para medir la latencia real
+HEALTH_CANARY_INTERVAL = float(os.getenv("HEALTH_CANARY_INTERVAL", "0"))
+HEALTH_CANARY_PROMPT = os.getenv("HEALTH_CANARY_PROMPT", "ping")
+BACKEND_BASE_BACKOFF = float(os.getenv("BACKEND_BASE_BACKOFF", "5"))
+BACKEND_MAX_BACKOFF = float(os.getenv("BACKEND_MAX_BACKOFF", "300"))
+
+# Requests cubiertos: si la llamada de fase no dio su primer token dentro del p95
+# reciente del TTFT, se duplica en otro backend (requiere 2+ backends) y gana la
+# primera en terminar. HEDGE_BUDGET limita los duplicados a esa fracción de llamadas
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "50"))
+HEDGE_MIN_DELAY_S = float(os.getenv("HEDGE_MIN_DELAY_S", "0.05"))
+
+# Pool de conexiones keep-alive compartido hacia Ollama
+OLLAMA_TIMEOUT = 300
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "64"))
+
+# Caché de respuestas (LRU en memoria + SQLite en disco)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "1024"))
+RESPONSE_CACHE_DISK_ENTRIES = int(os.getenv("RESPONSE_CACHE_DISK_ENTRIES", "100000"))
+
+# Caché semántica de la fase 1: embeddings del requerimiento (/api/embed de Ollama)
+# y similitud coseno contra las clasificaciones ya generadas. El modelo de embeddings
+# convive en memoria con el principal (ver OLLAMA_MAX_LOADED_MODELS en Ollama)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "semantic_cache.npz")
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "nomic-embed-text")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+SEMANTIC_CACHE_EMBED_TIMEOUT = float(os.getenv("SEMANTIC_CACHE_EMBED_TIMEOUT", "10"))
+
+# Residencia del modelo: precarga al arrancar, keep_alive en cada request
+# y chequeo periódico de /api/ps para recargarlo si Ollama lo descargó
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+MODEL_WARMUP_ON_STARTUP = os.getenv("MODEL_WARMUP_ON_STARTUP", "1") == "1"
+MODEL_RESIDENCY_CHECK_INTERVAL = float(os.getenv("MODEL_RESIDENCY_CHECK_INTERVAL", "30"))
+
+# Un load_duration por encima de este umbral cuenta como carga real del modelo
+MODEL_LOAD_THRESHOLD_S = float(os.getenv("MODEL_LOAD_THRESHOLD_S", "0.5"))
+
+# Control de admisión: generaciones simultáneas en Ollama y cola acotada.
+# 0 = sin límite (por defecto): solo se rechaza por deadline hasta que se configure
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "0"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "0"))
+
+# Modo de pipeline por defecto: "two_phase" (clasificación + config) o
+# "fused" (una sola generación estructurada con type, steps y config por equipo)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "two_phase")
+PIPELINE_MODES = ("two_phase", "fused")
+
+# Fase 1 con salida restringida por JSON schema (campo "format" de Ollama,
+# requiere Ollama >= 0.5) consumida en streaming: la generación se corta en
+# cuanto se cierra el objeto JSON de nivel superior
+CLASSIFICATION_SCHEMA_MODE = os.getenv("CLASSIFICATION_SCHEMA_MODE", "0") == "1"
+
+# Clasificador local de la fase 1: predice el tipo (CP/RP/ACL/TN) en el proceso y,
+# si es confiable, la llamada a Ollama solo genera los pasos. Aprende de las etiquetas
+# del LLM y solo ataja requests mientras su precisión en sombra supere el mínimo
+FAST_CLASSIFIER_ENABLED = os.getenv("FAST_CLASSIFIER_ENABLED", "0") == "1"
+FAST_CLASSIFIER_PATH = os.getenv("FAST_CLASSIFIER_PATH", "fast_classifier.json")
+FAST_CLASSIFIER_SEED_PATH = os.getenv("FAST_CLASSIFIER_SEED_PATH", "")
+FAST_CLASSIFIER_THRESHOLD = float(os.getenv("FAST_CLASSIFIER_THRESHOLD", "0.8"))
+FAST_CLASSIFIER_MIN_ACCURACY = float(os.getenv("FAST_CLASSIFIER_MIN_ACCURACY", "0.95"))
+FAST_CLASSIFIER_MIN_EXAMPLES = int(os.getenv("FAST_CLASSIFIER_MIN_EXAMPLES", "50"))
+FAST_CLASSIFIER_MIN_SHADOW = int(os.getenv("FAST_CLASSIFIER_MIN_SHADOW", "50"))
+FAST_CLASSIFIER_AUDIT_RATE = float(os.getenv("FAST_CLASSIFIER_AUDIT_RATE", "0.05"))
+
+# Fase 2 por dispositivo: si los pasos nombran 2..CONFIG_PARALLEL_MAX_DEVICES equipos,
+# una llamada por equipo en paralelo y los bloques se unen en el formato ~~~Device~~~
+CONFIG_PARALLEL_DEVICES = os.getenv("CONFIG_PARALLEL_DEVICES", "0") == "1"
+CONFIG_PARALLEL_MAX_DEVICES = int(os.getenv("CONFIG_PARALLEL_MAX_DEVICES", "8"))
+
+# Validación estática de cada bloque ~~~Device~~~ de la fase 2 (equipo e interfaces
+# presentes en network_state, configure terminal/end, show fuera del modo config).
+# Solo los bloques inválidos se regeneran, con un prompt que incluye los problemas
+CONFIG_REPAIR_ENABLED = os.getenv("CONFIG_REPAIR_ENABLED", "0") == "1"
+
+# Sesiones de topología (POST /sessions): context de Ollama reutilizado por la fase 2
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "256"))
+
+# Trabajos asíncronos (/jobs): cola persistente en SQLite y workers en el proceso
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "1") == "1"
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# Las concesiones se renuevan cada JOB_HEARTBEAT_INTERVAL mientras el proceso vive:
+# el lease solo acota cuánto tarda en retomarse el trabajo de un proceso caído
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", str(JOB_LEASE_SECONDS / 3)))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(7 * 86400)))
+# Prioridad de admisión por defecto: por debajo de los requests interactivos
+JOB_PRIORITY = int(os.getenv("JOB_PRIORITY", "-1"))
+
+# Trazas por request (JSONL con rotación); trace_report.py resume los spans más lentos
+TRACE_PATH = os.getenv("TRACE_PATH", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_THRESHOLD_S = float(os.getenv("TRACE_SLOW_THRESHOLD_S", "0"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+
+# Endpoint /generate-config/batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+
+http_client: Optional[aiohttp.ClientSession] = None
+response_cache: Optional[ResponseCache] = None
+semantic_cache: Optional[SemanticCache] = None
+fast_classifier: Optional[FastClassifier] = None
+job_queue: Optional[JobQueue] = None
+job_wakeup: Optional[asyncio.Event] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Crea un único cliente HTTP asíncrono para toda la vida del servidor,
+    precarga el modelo y arranca el chequeo de residencia
+    """
+    global http_client, response_cache, semantic_cache, fast_classifier, job_queue, job_wakeup
+    if RESPONSE_CACHE_ENABLED:
+        response_cache = ResponseCache(
+            RESPONSE_CACHE_PATH,
+            ttl_seconds=RESPONSE_CACHE_TTL,
+            max_memory_entries=RESPONSE_CACHE_MEMORY_ENTRIES,
+            max_disk_entries=RESPONSE_CACHE_DISK_ENTRIES,
+        )
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache = SemanticCache(
+            SEMANTIC_CACHE_PATH,
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+            ttl_seconds=RESPONSE_CACHE_TTL,
+        )
+    if FAST_CLASSIFIER_ENABLED:
+        fast_classifier = FastClassifier(
+            FAST_CLASSIFIER_PATH,
+            labels=tuple(CLASSIFICATION_SCHEMA["properties"]["type"]["enum"]),
+            threshold=FAST_CLASSIFIER_THRESHOLD,
+            min_examples=FAST_CLASSIFIER_MIN_EXAMPLES,
+            min_accuracy=FAST_CLASSIFIER_MIN_ACCURACY,
+            min_shadow=FAST_CLASSIFIER_MIN_SHADOW,
+            audit_rate=FAST_CLASSIFIER_AUDIT_RATE,
+        )
+        if FAST_CLASSIFIER_SEED_PATH and not len(fast_classifier):
+            seeded = fast_classifier.seed_csv(FAST_CLASSIFIER_SEED_PATH)
+            print(f"🏷️  Clasificador local: {seeded} ejemplos iniciales de {FAST_CLASSIFIER_SEED_PATH}")
+    http_client = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=OLLAMA_TIMEOUT, sock_connect=10),
+        connector=aiohttp.TCPConnector(limit=OLLAMA_MAX_CONNECTIONS),
+    )
+    if MODEL_WARMUP_ON_STARTUP:
+        # uvicorn no acepta conexiones hasta que termina el startup
+        await warm_up_model()
+    background_tasks = []
+    if MODEL_RESIDENCY_CHECK_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(model_residency_loop()))
+    if BACKEND_HEALTH_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(
+            health_prober.run(http_client, model_ladder.current, on_probe=record_health_probe)
+        ))
+    if JOBS_ENABLED:
+        job_queue = JobQueue(
+            JOBS_DB_PATH,
+            lease_seconds=JOB_LEASE_SECONDS,
+            max_attempts=JOB_MAX_ATTEMPTS,
+            dedup_ttl_seconds=RESPONSE_CACHE_TTL,
+            retention_seconds=JOB_RETENTION,
+        )
+        recovered = job_queue.recover()
+        if recovered:
+            print(f"♻️  {recovered} trabajos interrumpidos vuelven a la cola")
+        job_wakeup = asyncio.Event()
+        for worker_id in range(JOB_WORKERS):
+            background_tasks.append(asyncio.create_task(job_worker(worker_id)))
+        background_tasks.append(asyncio.create_task(job_heartbeat_loop()))
+    try:
+        yield
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await http_client.close()
+        http_client = None
+        if job_queue is not None:
+            # Los trabajos cancelados a mitad vuelven a la cola para el próximo arranque
+            job_queue.close()
+            job_queue = None
+        if response_cache is not None:
+            response_cache.close()
+            response_cache = None
+        if semantic_cache is not None:
+            semantic_cache.close()
+            semantic_cache = None
+        if fast_classifier is not None:
+            fast_classifier.close()
+            fast_classifier = None
+
+
+app = FastAPI(title="Network Config Generator API", lifespan=lifespan)
+
+tracer = Tracer(
+    TRACE_PATH,
+    sample_rate=TRACE_SAMPLE_RATE,
+    slow_threshold_s=TRACE_SLOW_THRESHOLD_S,
+    max_bytes=TRACE_MAX_BYTES,
+    backup_count=TRACE_BACKUP_COUNT,
+)
+CLIENT_DISCONNECTS = Counter(
+    "api_client_disconnects_total",
+    "Clientes que se fueron antes de terminar la respuesta (before_response = pipeline cancelado)",
+    ["path", "stage"]
+)
+
+
+def record_client_disconnect(path: str, stage: str):
+    CLIENT_DISCONNECTS.inc(path=path, stage=stage)
+    current_span().set(client_disconnected=stage)
+
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request, exc):
+    # 499 (convención de nginx): nadie lo va a leer, pero queda en logs y trazas
+    return PlainTextResponse("Client closed request", status_code=499)
+
+
+# El último middleware agregado es el más externo: la traza envuelve también la cancelación
+app.add_middleware(CancelOnDisconnectMiddleware, on_disconnect=record_client_disconnect)
+app.add_middleware(TracingMiddleware, tracer=tracer)
+
+
+class ConfigRequest(BaseModel):
+    requirement: str
+    network_state: Optional[str] = ""
+    session_id: Optional[str] = None
+
+
+class SessionRequest(BaseModel):
+    network_state: str
+
+
+class ConfigResponse(BaseModel):
+    classification_type: str
+    steps: list[str]
+    cisco_config: str
+    success: bool
+    error_message: Optional[str] = None
+    model: Optional[str] = None
+
+
+# ---------------------------------------------------------------------------
+# Prompts
+# ---------------------------------------------------------------------------
+
+CLASSIFICATION_SYSTEM_PROMPT = (
+    "You are a network configuration assistant.\n\n"
+
+    "TASK 1 - CLASSIFY the requirement as one of:\n"
+    "- CP: monitoring, performance, NetFlow, IP settings, application layer configuration\n"
+    "- RP: routing protocols (OSPF, BGP, RIP), routing tables\n"
+    "- ACL: access control lists, firewall rules\n"
+    "- TN: tunnels and VPNs (IPSec, GRE, site-to-site)\n\n"
+
+    "TASK 2 - GENERATE detailed implementation steps:\n"
+    "- Break down the requirement into specific, actionable steps\n"
+    "- Each step must be clear and technical\n"
+    "- Include what needs to be configured/verified on which device\n"
+    "- Be specific about protocols, interfaces, and actions\n"
+    "- Generate at least 3-5 steps depending on complexity\n\n"
+
+    "EXAMPLE for 'Configure OSPF between R1 and R2':\n"
+    "{\n"
+    '  "type": "RP",\n'
+    '  "steps": [\n'
+    '    "Enable OSPF process on R1 with appropriate process ID",\n'
+    '    "Configure OSPF network statements on R1 for connected interfaces",\n'
+    '    "Enable OSPF process on R2 with matching process ID",\n'
+    '    "Configure OSPF network statements on R2 for connected interfaces",\n'
+    '    "Verify OSPF neighbor adjacency between R1 and R2"\n'
+    '  ]\n'
+    "}\n\n"
+
+    "OUTPUT FORMAT - Return ONLY valid JSON:\n"
+    "{\n"
+    '  "type": "CP | RP | ACL | TN",\n'
+    '  "steps": ["detailed step 1", "detailed step 2", "..."]\n'
+    "}\n\n"
+
+    "RULES:\n"
+    "- Output ONLY JSON, no markdown, no explanations\n"
+    "- Steps must be detailed and actionable\n"
+    "- Minimum 3 steps, more if needed"
+)
+
+
+# Fase 1 cuando el clasificador local ya resolvió el tipo: solo los pasos
+STEPS_SYSTEM_PROMPT = (
+    "You are a network configuration assistant.\n\n"
+
+    "The requirement has already been classified as {type} ({description}).\n\n"
+
+    "GENERATE detailed implementation steps:\n"
+    "- Break down the requirement into specific, actionable steps\n"
+    "- Each step must be clear and technical\n"
+    "- Include what needs to be configured/verified on which device\n"
+    "- Be specific about protocols, interfaces, and actions\n"
+    "- Generate at least 3-5 steps depending on complexity\n\n"
+
+    "EXAMPLE for 'Configure OSPF between R1 and R2':\n"
+    "{{\n"
+    '  "steps": [\n'
+    '    "Enable OSPF process on R1 with appropriate process ID",\n'
+    '    "Configure OSPF network statements on R1 for connected interfaces",\n'
+    '    "Enable OSPF process on R2 with matching process ID",\n'
+    '    "Configure OSPF network statements on R2 for connected interfaces",\n'
+    '    "Verify OSPF neighbor adjacency between R1 and R2"\n'
+    '  ]\n'
+    "}}\n\n"
+
+    "OUTPUT FORMAT - Return ONLY valid JSON:\n"
+    "{{\n"
+    '  "steps": ["detailed step 1", "detailed step 2", "..."]\n'
+    "}}\n\n"
+
+    "RULES:\n"
+    "- Output ONLY JSON, no markdown, no explanations\n"
+    "- Steps must be detailed and actionable\n"
+    "- Minimum 3 steps, more if needed"
+)
+
+CLASSIFICATION_TYPES = {
+    "CP": "monitoring, performance, NetFlow, IP settings, application layer configuration",
+    "RP": "routing protocols (OSPF, BGP, RIP), routing tables",
+    "ACL": "access control lists, firewall rules",
+    "TN": "tunnels and VPNs (IPSec, GRE, site-to-site)",
+}
+
+
+CONFIG_SYSTEM_PROMPT = (
+    "You are an expert network administrator that generates Cisco IOS commands.\n\n"
+
+    "CISCO IOS COMMAND MODES:\n"
+    "- TROUBLESHOOTING/VERIFICATION: Use only show/debug commands in privileged EXEC mode\n"
+    "- CONFIGURATION: Use 'configure terminal' to enter config mode, add config commands, then 'end'\n"
+    "- NEVER mix show/debug commands with configuration mode commands\n\n"
+
+    "CRITICAL RULES:\n"
+    "1. If the requirement is for VERIFICATION or TROUBLESHOOTING, use ONLY show/debug commands\n"
+    "2. If the requirement is for CONFIGURATION, use config commands\n"
+    "3. Configure ONLY what is EXPLICITLY requested - DO NOT add extra commands, features, or configurations not mentioned\n"
+    "4. DO NOT invent or assume ANY values: IPs, interfaces, hostnames, process IDs, subnet masks, VLANs, authentication, etc.\n"
+    "5. DO NOT add authentication, costs, timers, priorities, or any feature NOT specifically requested\n"
+    "6. If information is missing and you cannot complete the task, respond ONLY: <INSUFFICIENT_DATA: specify what is needed>\n"
+    "7. Group ALL commands for each device under ONE separator: ~~~<device_name>~~~\n"
+    "8. NO explanations, NO comments, NO markdown, ONLY commands\n"
+    "9. If not applicable to configuration, respond ONLY: <No Configuration Requirements>\n"
+    "10. DO NOT mix show/debug commands with configuration mode commands\n"
+    "11. For troubleshooting, list show/debug commands directly without 'configure terminal'\n"
+    "12. For configuration, start with 'configure terminal', add config commands, end with 'end'\n\n"
+
+    "OUTPUT FORMAT (one command per line, executable in sequence):\n"
+    "~~~Device1~~~\n"
+    "command1\n"
+    "command2\n"
+    "~~~Device2~~~\n"
+    "command1\n"
+    "command2\n"
+)
+
+
+FUSED_SYSTEM_PROMPT = (
+    "You are a network configuration assistant and expert network administrator.\n"
+    "Solve the three tasks below in ONE JSON object.\n\n"
+
+    "TASK 1 - CLASSIFY the requirement as one of:\n"
+    "- CP: monitoring, performance, NetFlow, IP settings, application layer configuration\n"
+    "- RP: routing protocols (OSPF, BGP, RIP), routing tables\n"
+    "- ACL: access control lists, firewall rules\n"
+    "- TN: tunnels and VPNs (IPSec, GRE, site-to-site)\n\n"
+
+    "TASK 2 - GENERATE detailed implementation steps:\n"
+    "- Break down the requirement into specific, actionable steps\n"
+    "- Include what needs to be configured/verified on which device\n"
+    "- Generate at least 3-5 steps depending on complexity\n\n"
+
+    "TASK 3 - GENERATE the Cisco IOS commands for each device, following the steps:\n"
+    "- For VERIFICATION or TROUBLESHOOTING use ONLY show/debug commands, without 'configure terminal'\n"
+    "- For CONFIGURATION start with 'configure terminal', add config commands, end with 'end'\n"
+    "- NEVER mix show/debug commands with configuration mode commands\n"
+    "- Configure ONLY what is EXPLICITLY requested - DO NOT add extra commands or features\n"
+    "- DO NOT invent or assume ANY values: IPs, interfaces, hostnames, process IDs, subnet masks, VLANs, etc.\n"
+    "- If information is missing, leave \"config\" empty and set \"note\" to: <INSUFFICIENT_DATA: specify what is needed>\n"
+    "- If not applicable to configuration, leave \"config\" empty and set \"note\" to: <No Configuration Requirements>\n"
+    "- One command per string, executable in sequence, no comments\n\n"
+
+    "OUTPUT FORMAT - Return ONLY valid JSON:\n"
+    "{\n"
+    '  "type": "CP | RP | ACL | TN",\n'
+    '  "steps": ["detailed step 1", "detailed step 2", "..."],\n'
+    '  "config": [\n'
+    '    {"device": "R1", "commands": ["configure terminal", "command", "end"]}\n'
+    '  ],\n'
+    '  "note": ""\n'
+    "}\n\n"
+
+    "RULES:\n"
+    "- Output ONLY JSON, no markdown, no explanations\n"
+    "- Group ALL commands for each device under ONE entry of \"config\""
+)
+
+
+CLASSIFICATION_TEMPERATURE = 0.1
+CONFIG_TEMPERATURE = 0.01
+FUSED_TEMPERATURE = CONFIG_TEMPERATURE
+
+# Esquema de la salida de la fase 1 para el modo CLASSIFICATION_SCHEMA_MODE
+CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string", "enum": ["CP", "RP", "ACL", "TN"]},
+        "steps": {"type": "array", "items": {"type": "string"}, "minItems": 1},
+    },
+    "required": ["type", "steps"],
+}
+STEPS_SCHEMA = {
+    "type": "object",
+    "properties": {"steps": CLASSIFICATION_SCHEMA["properties"]["steps"]},
+    "required": ["steps"],
+}
+
+CLASSIFICATION_PROMPT_HASH = text_hash(CLASSIFICATION_SYSTEM_PROMPT)
+CONFIG_PROMPT_HASH = text_hash(CONFIG_SYSTEM_PROMPT)
+FUSED_PROMPT_HASH = text_hash(FUSED_SYSTEM_PROMPT)
+STEPS_PROMPT_HASH = text_hash(STEPS_SYSTEM_PROMPT)
+
+
+def build_classification_prompt(requirement: str) -> str:
+    return f"{CLASSIFICATION_SYSTEM_PROMPT}\n\nUser requirement: {requirement}"
+
+
+def build_steps_prompt(requirement: str, classification_type: str) -> str:
+    system = STEPS_SYSTEM_PROMPT.format(type=classification_type, description=CLASSIFICATION_TYPES[classification_type])
+    return f"{system}\n\nUser requirement: {requirement}"
+
+
+def build_config_prompt(requirement: str, low_level_steps: list, topology_info: str = "") -> str:
+    steps_text = "\n".join([f"{i+1}. {step}" for i, step in enumerate(low_level_steps)])
+
+    user_prompt = f"Original requirement: {requirement}\n\nSteps to implement:\n{steps_text}"
+    if topology_info:
+        user_prompt += f"\n\nNetwork state/topology:\n{topology_info}"
+
+    return f"{CONFIG_SYSTEM_PROMPT}\n\n{user_prompt}"
+
+
+def build_session_prompt(topology_info: str) -> str:
+    """Prefijo que se evalúa una sola vez por sesión: instrucciones de la fase 2 + topología"""
+    return (
+        f"{CONFIG_SYSTEM_PROMPT}\n\nNetwork state/topology:\n{topology_info}\n\n"
+        "Reply only OK. The requirement and steps to implement follow in the next message."
+    )
+
+
+def build_session_config_prompt(requirement: str, low_level_steps: list) -> str:
+    """Prompt de la fase 2 cuando la topología ya está en el context de la sesión"""
+    steps_text = "\n".join([f"{i+1}. {step}" for i, step in enumerate(low_level_steps)])
+    return (
+        f"Original requirement: {requirement}\n\nSteps to implement:\n{steps_text}\n\n"
+        "Use the network state/topology given above."
+    )
+
+
+def build_device_config_prompt(config_prompt: str, device: str) -> str:
+    """Prompt de la fase 2 restringido a un solo equipo (modo CONFIG_PARALLEL_DEVICES)"""
+    return (
+        f"{config_prompt}\n\nTARGET DEVICE: {device}\n"
+        f"Generate ONLY the commands for {device}, under the single separator ~~~{device}~~~. "
+        "The other devices are configured separately; do not include them."
+    )
+
+
+def build_repair_prompt(config_prompt: str, block: dict, issues: list) -> str:
+    """Prompt de la fase 2 para rehacer un bloque que no pasó la validación (se restringe al equipo después)"""
+    device = block["device"]
+    commands = "\n".join(block["commands"])
+    problems = "\n".join(f"- {issue}" for issue in issues)
+    return (
+        f"{config_prompt}\n\nThe previous commands for {device} were rejected:\n"
+        f"~~~{device}~~~\n{commands}\n\nProblems found:\n{problems}\n"
+        "Fix these problems and keep every command that was correct."
+    )
+
+
+def build_fused_prompt(requirement: str, topology_info: str = "") -> str:
+    user_prompt = f"User requirement: {requirement}"
+    if topology_info:
+        user_prompt += f"\n\nNetwork state/topology:\n{topology_info}"
+    return f"{FUSED_SYSTEM_PROMPT}\n\n{user_prompt}"
+
+
+def format_device_blocks(devices: list) -> str:
+    """[{"device": "R1", "commands": [...]}, ...] -> formato ~~~R1~~~ de generate_cisco_config"""
+    lines = []
+    for block in devices:
+        lines.append(f"~~~{block['device']}~~~")
+        lines.extend(block["commands"])
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# Caché
+# ---------------------------------------------------------------------------
+
+def classification_response_format(steps_only: bool = False) -> Optional[dict]:
+    if not CLASSIFICATION_SCHEMA_MODE:
+        return None
+    return STEPS_SCHEMA if steps_only else CLASSIFICATION_SCHEMA
+
+
+def classification_scope() -> str:
+    """Todo lo que define la salida de la fase 1 salvo el requerimiento (caché semántica)"""
+    schema = (CLASSIFICATION_SCHEMA,) if CLASSIFICATION_SCHEMA_MODE else ()
+    return make_key(
+        "classification", current_model(), CLASSIFICATION_PROMPT_HASH, CLASSIFICATION_TEMPERATURE, *schema
+    )
+
+
+def classification_cache_key(requirement: str, fast_type: Optional[str] = None) -> str:
+    # El esquema solo entra en la clave cuando está activo: las entradas del modo libre siguen valiendo
+    schema = (CLASSIFICATION_SCHEMA,) if CLASSIFICATION_SCHEMA_MODE else ()
+    if fast_type is not None:
+        # Tipo del clasificador local + pasos del prompt corto: nunca se sirve como clasificación del LLM
+        schema = (STEPS_SCHEMA,) if CLASSIFICATION_SCHEMA_MODE else ()
+        return make_key(
+            "classification", current_model(), STEPS_PROMPT_HASH, CLASSIFICATION_TEMPERATURE,
+            *schema, "fast", fast_type, normalize_requirement(requirement)
+        )
+    return make_key(
+        "classification", current_model(), CLASSIFICATION_PROMPT_HASH, CLASSIFICATION_TEMPERATURE,
+        *schema, normalize_requirement(requirement)
+    )
+
+
+def config_cache_key(requirement: str, low_level_steps: list, topology_info: str = "",
+                     via_session: bool = False, devices: tuple = ()) -> str:
+    # Con sesión el prompt tiene otra forma (topología en el context): entradas separadas
+    session = ("session",) if via_session else ()
+    per_device = ("per_device", list(devices)) if devices else ()
+    # Con reparación los bloques inválidos ya vienen corregidos: no mezclar con las entradas sin ella
+    repair = ("repair",) if CONFIG_REPAIR_ENABLED else ()
+    return make_key(
+        "config", current_model(), CONFIG_PROMPT_HASH, CONFIG_TEMPERATURE,
+        *session, *per_device, *repair, normalize_requirement(requirement), low_level_steps,
+        text_hash(topology_info)
+    )
+
+
+def config_devices(low_level_steps: list, topology_info: str = "") -> tuple:
+    """
+    Equipos para la fase 2 en paralelo; vacío si el modo está apagado o no aplica.
+    Si la topología trae hostnames, solo cuentan los equipos que existen en ella.
+    """
+    if not CONFIG_PARALLEL_DEVICES:
+        return ()
+    devices = devices_in_steps(low_level_steps, frozenset(known_devices(topology_info)))
+    if not 2 <= len(devices) <= CONFIG_PARALLEL_MAX_DEVICES:
+        return ()
+    return tuple(devices)
+
+
+def fused_cache_key(requirement: str, topology_info: str = "") -> str:
+    return make_key(
+        "fused", current_model(), FUSED_PROMPT_HASH, FUSED_TEMPERATURE,
+        normalize_requirement(requirement), text_hash(topology_info)
+    )
+
+
+def cache_get(namespace: str, key: str):
+    if response_cache is None:
+        return None
+    with span("cache.get", namespace=namespace) as s:
+        value = response_cache.get(namespace, key)
+        s.set(hit=value is not None)
+        return value
+
+
+def cache_set(namespace: str, key: str, value):
+    if response_cache is not None:
+        response_cache.set(namespace, key, value)
+
+
+class SingleFlight:
+    """
+    Coalescing de llamadas idénticas en curso: el primer llamador lanza la
+    tarea y los siguientes con la misma clave esperan ese mismo resultado
+    (o excepción) en lugar de repetir la generación en Ollama.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._waiters = {}
+        self._stats = {}
+
+    def _count(self, namespace: str, field: str):
+        counters = self._stats.setdefault(namespace, {"leaders": 0, "coalesced": 0, "abandoned": 0})
+        counters[field] += 1
+
+    async def run(self, namespace: str, key: str, coro_factory):
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count(namespace, "coalesced")
+            current_span().set(coalesced=True)
+        else:
+            self._count(namespace, "leaders")
+            task = asyncio.ensure_future(coro_factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # shield: si un llamador se cancela, la tarea sigue para los demás...
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # ...salvo que fuera el último: nadie leerá el resultado, se corta la generación.
+            # Se quita de _inflight antes de cancelar: un request idéntico que llegue mientras
+            # la tarea se cancela lanza otra en lugar de heredar el CancelledError
+            if self._waiters[key] == 1 and not task.done():
+                self._forget(key, task)
+                task.cancel()
+                self._count(namespace, "abandoned")
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _forget(self, key: str, task: asyncio.Future):
+        # Solo si sigue siendo la tarea de la clave (no una posterior con la misma clave)
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {"inflight": len(self._inflight), "namespaces": self._stats}
+
+
+single_flight = SingleFlight()
+
+
+def is_valid_classification(result) -> bool:
+    return isinstance(result, dict) and "type" in result and "steps" in result
+
+
+def is_valid_fused(result) -> bool:
+    if not is_valid_classification(result) or not isinstance(result.get("config"), list):
+        return False
+    return all(
+        isinstance(block, dict) and isinstance(block.get("device"), str)
+        and isinstance(block.get("commands"), list)
+        for block in result["config"]
+    )
+
+
+# ---------------------------------------------------------------------------
+# Métricas (/metrics)
+# ---------------------------------------------------------------------------
+
+PHASE_LATENCY = Histogram(
+    "api_phase_latency_seconds", "Latencia de cada fase contra Ollama (sin hits de caché)", ["phase"]
+)
+REQUEST_LATENCY = Histogram(
+    "api_request_latency_seconds", "Latencia del pipeline completo por modo", ["mode"]
+)
+QUEUE_WAIT = Histogram(
+    "api_queue_wait_seconds", "Tiempo esperando turno antes de generar, por etapa", ["stage"]
+)
+PROMPT_TOKENS_PER_SECOND = Histogram(
+    "ollama_prompt_eval_tokens_per_second", "Velocidad de evaluación del prompt",
+    ["model"], buckets=TOKENS_PER_SECOND_BUCKETS
+)
+DECODE_TOKENS_PER_SECOND = Histogram(
+    "ollama_decode_tokens_per_second", "Velocidad de decodificación",
+    ["model"], buckets=TOKENS_PER_SECOND_BUCKETS
+)
+PROMPT_TOKENS = Counter("ollama_prompt_tokens_total", "Tokens de prompt evaluados", ["model"])
+DECODE_TOKENS = Counter("ollama_decode_tokens_total", "Tokens generados", ["model"])
+LOAD_DURATION = Histogram("ollama_load_duration_seconds", "load_duration reportado por Ollama", ["model"])
+MODEL_LOADS = Counter(
+    "ollama_model_loads_total", "Llamadas que pagaron una carga del modelo (load_duration > umbral)", ["model"]
+)
+JSON_PARSE_FAILURES = Counter(
+    "classification_json_parse_failures_total", "Respuestas de la fase 1 que no eran JSON válido"
+)
+
+# Tokens consumidos por el request actual (lo usan los benchmarks); None = no se registra
+request_usage: ContextVar[Optional[dict]] = ContextVar("request_usage", default=None)
+
+
+def start_usage_tracking() -> dict:
+    """Empieza a acumular tokens y llamadas a Ollama del request (y tareas hijas) actual"""
+    usage = {"calls": 0, "prompt_tokens": 0, "eval_tokens": 0}
+    request_usage.set(usage)
+    return usage
+
+
+def record_ollama_stats(result: dict):
+    """Extrae los tiempos de Ollama (en ns) de una respuesta final de /api/generate"""
+    model = result.get("model") or current_model()
+    prompt_count = result.get("prompt_eval_count") or 0
+    prompt_ns = result.get("prompt_eval_duration") or 0
+    eval_count = result.get("eval_count") or 0
+    eval_ns = result.get("eval_duration") or 0
+    load_ns = result.get("load_duration") or 0
+    total_ns = result.get("total_duration") or 0
+
+    PROMPT_TOKENS.inc(prompt_count, model=model)
+    DECODE_TOKENS.inc(eval_count, model=model)
+    usage = request_usage.get()
+    if usage is not None:
+        usage["calls"] += 1
+        usage["prompt_tokens"] += prompt_count
+        usage["eval_tokens"] += eval_count
+    if prompt_count and prompt_ns:
+        PROMPT_TOKENS_PER_SECOND.observe(prompt_count / (prompt_ns / 1e9), model=model)
+    if eval_count and eval_ns:
+        DECODE_TOKENS_PER_SECOND.observe(eval_count / (eval_ns / 1e9), model=model)
+    if "load_duration" in result:
+        LOAD_DURATION.observe(load_ns / 1e9, model=model)
+        if load_ns / 1e9 >= MODEL_LOAD_THRESHOLD_S:
+            MODEL_LOADS.inc(model=model)
+    current_span().set(
+        prompt_eval_count=prompt_count, prompt_eval_ms=round(prompt_ns / 1e6, 3),
+        eval_count=eval_count, eval_ms=round(eval_ns / 1e6, 3), load_ms=round(load_ns / 1e6, 3)
+    )
+    if total_ns:
+        # Lo que no es carga, prompt ni decode es espera en el scheduler de Ollama
+        ollama_wait = max(0.0, (total_ns - load_ns - prompt_ns - eval_ns) / 1e9)
+        if ollama_wait > 0:
+            QUEUE_WAIT.observe(ollama_wait, stage="ollama")
+        # Sin límites de admisión la cola está en Ollama: también cuenta para la escalera
+        record_ladder_switch(model_ladder.observe_queue_wait(ollama_wait))
+
+
+def record_partial_stats(eval_count: int):
+    """Generación cortada antes de "done": solo se conocen los tokens recibidos (un chunk por token)"""
+    DECODE_TOKENS.inc(eval_count, model=current_model())
+    current_span().set(eval_count=eval_count, early_stop=True)
+    usage = request_usage.get()
+    if usage is not None:
+        usage["calls"] += 1
+        usage["eval_tokens"] += eval_count
+
+
+# ---------------------------------------------------------------------------
+# Escalera de modelos
+# ---------------------------------------------------------------------------
+
+MODEL_LADDER_LEVEL = Gauge("model_ladder_level", "Peldaño actual de la escalera de modelos (0 = preferido)")
+MODEL_SWITCHES = Counter(
+    "model_ladder_switches_total", "Cambios de modelo por carga", ["from_model", "to_model"]
+)
+
+model_ladder = ModelLadder(
+    MODEL_LADDER,
+    queue_wait_threshold_s=MODEL_DOWNGRADE_QUEUE_WAIT_S,
+    p95_threshold_s=MODEL_DOWNGRADE_P95_S,
+    window_s=MODEL_LADDER_WINDOW_S,
+    cooldown_s=MODEL_LADDER_COOLDOWN_S,
+    recover_ratio=MODEL_LADDER_RECOVER_RATIO,
+    min_samples=MODEL_LADDER_MIN_SAMPLES,
+)
+
+# Modelo fijado al empezar el request: todas sus fases usan el mismo aunque la escalera cambie
+request_model: ContextVar[Optional[str]] = ContextVar("request_model", default=None)
+
+
+def pin_request_model() -> str:
+    model = model_ladder.current()
+    request_model.set(model)
+    return model
+
+
+def current_model() -> str:
+    return request_model.get() or model_ladder.current()
+
+
+def record_ladder_switch(switch: Optional[tuple]):
+    if switch is None:
+        return
+    previous, model = switch
+    MODEL_SWITCHES.inc(from_model=previous, to_model=model)
+    print(f"🪜 Escalera de modelos: {previous} -> {model}")
+
+
+# ---------------------------------------------------------------------------
+# Admisión, prioridad y deadlines
+# ---------------------------------------------------------------------------
+
+ADMISSION_REJECTIONS = Counter("api_admission_rejections_total", "Requests rechazados con 429", ["reason"])
+ADMISSION_INFLIGHT = Gauge("api_admission_inflight", "Generaciones en curso contra Ollama")
+ADMISSION_QUEUED = Gauge("api_admission_queued", "Generaciones esperando turno")
+
+admission = AdmissionScheduler(ADMISSION_MAX_INFLIGHT, ADMISSION_MAX_QUEUE)
+
+# Deadline (time.monotonic()) y prioridad del request actual; viajan a ambas fases
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+request_priority: ContextVar[int] = ContextVar("request_priority", default=0)
+
+
+def set_request_budget(deadline_ms: Optional[float], priority: Optional[int]):
+    """Fija el deadline relativo (X-Request-Deadline-Ms) y la prioridad del request actual"""
+    request_deadline.set(time.monotonic() + deadline_ms / 1000 if deadline_ms else None)
+    request_priority.set(priority or 0)
+
+
+def rejection_to_http(e: AdmissionRejected) -> HTTPException:
+    reason = "queue_full" if "full" in e.reason else "deadline"
+    ADMISSION_REJECTIONS.inc(reason=reason)
+    return HTTPException(
+        status_code=429,
+        detail=f"Server overloaded: {e.reason}",
+        headers={"Retry-After": str(int(e.retry_after))}
+    )
+
+
+@asynccontextmanager
+async def admitted(phases: tuple):
+    """
+    Ocupa un hueco del scheduler para phases[0]. Lanza HTTPException 429
+    si la cola está llena o el deadline no se puede cumplir.
+    """
+    queued = time.perf_counter()
+    try:
+        with span("admission.wait", phase=phases[0]):
+            await admission.acquire(phases, request_priority.get(), request_deadline.get())
+    except AdmissionRejected as e:
+        raise rejection_to_http(e)
+    waited = time.perf_counter() - queued
+    QUEUE_WAIT.observe(waited, stage="admission")
+    record_ladder_switch(model_ladder.observe_queue_wait(waited))
+    started = time.monotonic()
+    completed = False
+    try:
+        yield
+        completed = True
+    finally:
+        admission.release(phases[0], time.monotonic() - started if completed else None)
+
+
+def precheck_admission(phases: tuple):
+    """Para endpoints streaming: rechaza antes de enviar cabeceras 200"""
+    rejection = admission.check(phases, request_deadline.get())
+    if rejection is not None:
+        admission.rejected["queue_full" if "full" in rejection.reason else "deadline"] += 1
+        raise rejection_to_http(rejection)
+
+
+def request_timeout() -> Optional[aiohttp.ClientTimeout]:
+    """Timeout de la llamada a Ollama acotado por el deadline del request"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    return aiohttp.ClientTimeout(total=min(OLLAMA_TIMEOUT, remaining), sock_connect=10)
+
+
+# ---------------------------------------------------------------------------
+# Cliente Ollama
+# ---------------------------------------------------------------------------
+
+def keep_alive_value():
+    """Ollama acepta duraciones ("30m") o segundos como número (-1 = indefinido)"""
+    try:
+        return int(OLLAMA_KEEP_ALIVE)
+    except ValueError:
+        return OLLAMA_KEEP_ALIVE
+
+
+def build_generate_payload(prompt: str, temperature: float, stream: bool, response_format=None,
+                           context: Optional[list] = None, options: Optional[dict] = None) -> dict:
+    payload = {
+        "model": current_model(),
+        "prompt": prompt,
+        "stream": stream,
+        "temperature": temperature,
+        "keep_alive": keep_alive_value()
+    }
+    if response_format is not None:
+        payload["format"] = response_format
+    if context is not None:
+        payload["context"] = context
+    if options is not None:
+        payload["options"] = options
+    return payload
+
+
+BACKEND_OUTSTANDING = Gauge("ollama_backend_outstanding", "Requests pendientes por backend", ["backend"])
+BACKEND_HEALTHY = Gauge("ollama_backend_healthy", "1 si el backend está admitido", ["backend"])
+
+GENERATIONS_CANCELLED = Counter(
+    "ollama_generations_cancelled_total", "Generaciones abortadas a mitad cerrando la conexión", ["backend"]
+)
+
+backend_pool = BackendPool(OLLAMA_BACKENDS, base_backoff=BACKEND_BASE_BACKOFF, max_backoff=BACKEND_MAX_BACKOFF)
+
+HEALTH_CANARY_LATENCY = Gauge(
+    "ollama_canary_latency_seconds", "Latencia del último canary de 1 token por backend", ["backend"]
+)
+HEALTH_PROBE_AGE = Gauge("health_last_probe_age_seconds", "Antigüedad del último sondeo de salud")
+
+health_prober = HealthProber(
+    backend_pool,
+    interval=BACKEND_HEALTH_INTERVAL,
+    canary_interval=HEALTH_CANARY_INTERVAL,
+    canary_prompt=HEALTH_CANARY_PROMPT,
+    keep_alive=keep_alive_value(),
+)
+
+
+def record_health_probe(prober: HealthProber):
+    for state in prober.states.values():
+        if state.canary_ok and state.canary_latency_s is not None:
+            HEALTH_CANARY_LATENCY.set(state.canary_latency_s, backend=state.url)
+        if state.model_loaded is not None:
+            MODEL_RESIDENT.set(1 if state.model_loaded else 0, model=state.model, backend=state.url)
+
+
+@asynccontextmanager
+async def ollama_post(payload: dict, prefer: Optional[Backend] = None, exclude: tuple = ()):
+    """
+    POST a /api/generate en el backend con menos requests pendientes
+    (o en `prefer` si está disponible), sin usar los de `exclude`.
+    Si la conexión no se puede establecer, expulsa ese backend y reintenta
+    en otro (el request no llegó a Ollama, así que es seguro repetirlo).
+    """
+    tried = []
+    while True:
+        backend = backend_pool.pick(exclude=exclude + tuple(tried), prefer=prefer)
+        with backend_pool.track(backend), span("ollama.http", backend=backend.url, stream=payload["stream"]) as s:
+            try:
+                response = await http_client.post(
+                    backend.generate_url, json=payload, timeout=request_timeout()
+                )
+            except asyncio.CancelledError:
+                s.set(cancelled=True)
+                GENERATIONS_CANCELLED.inc(backend=backend.url)
+                raise
+            except aiohttp.ClientConnectorError:
+                s.set(connect_error=True)
+                backend_pool.mark_failure(backend)
+                tried.append(backend)
+                if len(exclude) + len(tried) >= len(backend_pool.backends):
+                    raise
+                continue
+            s.set(status=response.status)
+            try:
+                yield response
+            except asyncio.CancelledError:
+                # Cliente desconectado o duplicado perdedor: la conexión se cierra abajo
+                s.set(cancelled=True)
+                GENERATIONS_CANCELLED.inc(backend=backend.url)
+                raise
+            finally:
+                if response.content.at_eof():
+                    response.release()
+                else:
+                    # Respuesta sin consumir (corte anticipado o error): cerrar la
+                    # conexión para que Ollama detecte la desconexión y deje de generar
+                    response.close()
+            return
+
+
+async def ollama_generate(prompt: str, temperature: float, response_format=None,
+                          context: Optional[list] = None, options: Optional[dict] = None,
+                          prefer: Optional[Backend] = None) -> Optional[dict]:
+    """
+    Llamada no bloqueante a /api/generate usando el pool compartido.
+    Retorna el JSON completo de Ollama o None si el status no es 200.
+    """
+    payload = build_generate_payload(prompt, temperature, stream=False, response_format=response_format,
+                                     context=context, options=options)
+    try:
+        async with ollama_post(payload, prefer) as response:
+            if response.status != 200:
+                return None
+            result = await response.json()
+            record_ollama_stats(result)
+            return result
+    except asyncio.TimeoutError:
+        if request_deadline.get() is not None:
+            raise HTTPException(status_code=504, detail="Request deadline exceeded while waiting for Ollama")
+        raise
+
+
+HEDGES = Counter("ollama_hedges_total", "Llamadas de fase duplicadas en otro backend", ["phase", "winner"])
+HEDGES_SKIPPED = Counter("ollama_hedges_skipped_total", "Duplicados descartados por el presupuesto", ["phase"])
+
+hedge_policy = HedgePolicy(budget=HEDGE_BUDGET, min_samples=HEDGE_MIN_SAMPLES, min_delay_s=HEDGE_MIN_DELAY_S)
+
+
+async def ollama_generate_timed(prompt: str, temperature: float, phase: str,
+                                first_token: Optional[asyncio.Event] = None,
+                                context: Optional[list] = None, prefer: Optional[Backend] = None,
+                                exclude: tuple = ()) -> Optional[dict]:
+    """
+    Como ollama_generate (mismo dict de retorno, None si el status no es 200)
+    pero en streaming, para medir el TTFT y marcar `first_token` al llegar.
+    """
+    payload = build_generate_payload(prompt, temperature, stream=True, context=context)
+    started = time.perf_counter()
+    parts = []
+    try:
+        async with ollama_post(payload, prefer, exclude) as response:
+            if response.status != 200:
+                return None
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if not parts:
+                    hedge_policy.observe_ttft(phase, time.perf_counter() - started)
+                    if first_token is not None:
+                        first_token.set()
+                parts.append(chunk.get("response", ""))
+                if chunk.get("done"):
+                    record_ollama_stats(chunk)
+                    return {**chunk, "response": "".join(parts)}
+            return None
+    except asyncio.TimeoutError:
+        if request_deadline.get() is not None:
+            raise HTTPException(status_code=504, detail="Request deadline exceeded while waiting for Ollama")
+        raise
+
+
+async def ollama_generate_hedged(prompt: str, temperature: float, phase: str,
+                                 context: Optional[list] = None,
+                                 prefer: Optional[Backend] = None) -> Optional[dict]:
+    """
+    ollama_generate con cobertura (HEDGE_ENABLED): si la primaria no dio su
+    primer token dentro del p95 del TTFT de la fase, se duplica en otro
+    backend y se cancela la que pierda.
+    """
+    if not HEDGE_ENABLED or len(backend_pool.backends) < 2:
+        return await ollama_generate(prompt, temperature, context=context, prefer=prefer)
+
+    primary_backend = backend_pool.pick(prefer=prefer)
+    first_token = asyncio.Event()
+    hedge_policy.start_call()
+
+    def allow_hedge() -> bool:
+        now = time.monotonic()
+        if not any(b.available(now) for b in backend_pool.backends if b is not primary_backend):
+            return False
+        if not hedge_policy.acquire():
+            HEDGES_SKIPPED.inc(phase=phase)
+            return False
+        return True
+
+    result, winner, hedged = await hedged_call(
+        lambda: ollama_generate_timed(prompt, temperature, phase, first_token, context, prefer=primary_backend),
+        lambda: ollama_generate_timed(prompt, temperature, phase, context=context, exclude=(primary_backend,)),
+        first_token, hedge_policy.delay(phase), allow_hedge
+    )
+    if hedged:
+        HEDGES.inc(phase=phase, winner=winner)
+        if winner == "hedge":
+            hedge_policy.hedge_wins += 1
+        current_span().set(hedged=True, hedge_winner=winner)
+    return result
+
+
+async def ollama_stream(prompt: str, temperature: float, response_format=None,
+                        context: Optional[list] = None, prefer: Optional[Backend] = None):
+    """
+    Igual que ollama_generate pero con "stream": True.
+    Genera cada chunk NDJSON de Ollama a medida que llega. Quien corte antes
+    de "done" debe cerrar el generador (aclosing) para liberar la conexión.
+    """
+    payload = build_generate_payload(prompt, temperature, stream=True, response_format=response_format,
+                                     context=context)
+    try:
+        async with ollama_post(payload, prefer) as response:
+            if response.status != 200:
+                raise HTTPException(status_code=502, detail=f"Ollama returned status {response.status}")
+            async for line in response.content:
+                if line.strip():
+                    chunk = json.loads(line)
+                    if chunk.get("done"):
+                        record_ollama_stats(chunk)
+                    yield chunk
+    except asyncio.TimeoutError:
+        if request_deadline.get() is not None:
+            raise HTTPException(status_code=504, detail="Request deadline exceeded while waiting for Ollama")
+        raise
+
+
+# ---------------------------------------------------------------------------
+# Caché semántica (fase 1)
+# ---------------------------------------------------------------------------
+
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 0.99, 1.0)
+
+SEMANTIC_LOOKUPS = Counter("semantic_cache_lookups_total", "Consultas a la caché semántica", ["result"])
+SEMANTIC_SIMILARITY = Histogram(
+    "semantic_cache_best_similarity", "Similitud coseno de la entrada más parecida por consulta",
+    buckets=SIMILARITY_BUCKETS
+)
+
+
+async def embed_requirement(requirement: str) -> Optional[list]:
+    """Embedding del requerimiento normalizado vía /api/embed; None si Ollama falla"""
+    backend = backend_pool.pick()
+    with backend_pool.track(backend), span("ollama.embed", backend=backend.url) as s:
+        try:
+            async with http_client.post(
+                f"{backend.url}/api/embed",
+                json={"model": SEMANTIC_CACHE_MODEL, "input": normalize_requirement(requirement)},
+                timeout=aiohttp.ClientTimeout(total=SEMANTIC_CACHE_EMBED_TIMEOUT)
+            ) as response:
+                s.set(status=response.status)
+                if response.status != 200:
+                    return None
+                data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            s.set(error=type(e).__name__)
+            return None
+    embeddings = data.get("embeddings") or []
+    return embeddings[0] if embeddings else None
+
+
+async def semantic_lookup(requirement: str) -> tuple:
+    """
+    (clasificación cacheada o None, embedding o None). El embedding se
+    reutiliza para guardar el resultado si hay que generarlo.
+    """
+    if semantic_cache is None:
+        return None, None
+    with span("cache.semantic") as s:
+        vector = await embed_requirement(requirement)
+        if vector is None:
+            SEMANTIC_LOOKUPS.inc(result="error")
+            return None, None
+        entry, similarity = semantic_cache.lookup(requirement, vector, classification_scope())
+        if similarity is not None:
+            SEMANTIC_SIMILARITY.observe(similarity)
+        SEMANTIC_LOOKUPS.inc(result="hit" if entry is not None else "miss")
+        s.set(hit=entry is not None, similarity=similarity)
+        if entry is None:
+            return None, vector
+        return entry["value"], vector
+
+
+semantic_save_task: Optional[asyncio.Future] = None
+
+
+def semantic_store(requirement: str, vector: Optional[list], value):
+    global semantic_save_task
+    if semantic_cache is not None and vector is not None and is_valid_classification(value):
+        semantic_cache.add(requirement, vector, value, classification_scope())
+        if semantic_cache.save_due() and (semantic_save_task is None or semantic_save_task.done()):
+            # Reescribir el .npz tarda cientos de ms con muchas entradas: fuera del event loop
+            semantic_save_task = asyncio.ensure_future(asyncio.to_thread(semantic_cache.save))
+
+
+# ---------------------------------------------------------------------------
+# Clasificador local de la fase 1
+# ---------------------------------------------------------------------------
+
+FAST_CLASSIFIER_DECISIONS = Counter(
+    "fast_classifier_decisions_total",
+    "Decisiones del clasificador local (used = el LLM solo generó los pasos)", ["result"]
+)
+FAST_CLASSIFIER_SHADOW = Counter(
+    "fast_classifier_shadow_total",
+    "Predicciones en sombra sobre el umbral comparadas con la etiqueta del LLM", ["correct"]
+)
+
+
+def plan_classification(requirement: str) -> tuple:
+    """
+    (prompt de la fase 1, tipo resuelto por el clasificador local o None).
+    Con tipo resuelto el prompt pide solo los pasos.
+    """
+    if fast_classifier is None:
+        return build_classification_prompt(requirement), None
+    with span("classifier.fast") as s:
+        label, confidence = fast_classifier.predict(requirement)
+        if label is None:
+            result = "cold"
+        elif not fast_classifier.trusted(confidence):
+            result = "fallback"
+        elif fast_classifier.should_audit():
+            result = "audit"
+        else:
+            result = "used"
+        FAST_CLASSIFIER_DECISIONS.inc(result=result)
+        s.set(type=label, confidence=round(confidence, 4), result=result)
+    if result != "used":
+        return build_classification_prompt(requirement), None
+    fast_classifier.record_used()
+    return build_steps_prompt(requirement, label), label
+
+
+def finish_classification(requirement: str, response_json, fast_type: Optional[str]):
+    """Une el tipo local con los pasos del LLM o, sin tipo local, aprende la etiqueta del LLM"""
+    if not isinstance(response_json, dict):
+        return response_json
+    if fast_type is not None:
+        if "steps" not in response_json:
+            return response_json
+        return {"type": fast_type, "steps": response_json["steps"]}
+    if fast_classifier is not None and is_valid_classification(response_json):
+        correct = fast_classifier.learn(requirement, response_json["type"])
+        if correct is not None:
+            FAST_CLASSIFIER_SHADOW.inc(correct="true" if correct else "false")
+    return response_json
+
+
+# ---------------------------------------------------------------------------
+# Residencia del modelo
+# ---------------------------------------------------------------------------
+
+MODEL_RESIDENT = Gauge("ollama_model_resident", "1 si el modelo aparece en /api/ps", ["model", "backend"])
+MODEL_RELOADS = Counter(
+    "ollama_model_reloads_total", "Recargas disparadas por el chequeo de residencia", ["model", "backend"]
+)
+
+
+async def warm_up_backend(backend: Backend, model: Optional[str] = None) -> bool:
+    """
+    Carga el modelo (por defecto el peldaño actual de la escalera) en memoria
+    con un request sin prompt (Ollama solo lo carga).
+    Retorna False si Ollama no respondió; el servidor arranca igual.
+    """
+    model = model or model_ladder.current()
+    try:
+        async with http_client.post(
+            backend.generate_url,
+            json={"model": model, "keep_alive": keep_alive_value(), "stream": False}
+        ) as response:
+            if response.status != 200:
+                print(f"⚠️  Warm-up de {model} en {backend.url} falló: status {response.status}")
+                return False
+            record_ollama_stats(await response.json())
+    except aiohttp.ClientError as e:
+        print(f"⚠️  Warm-up de {model} en {backend.url} falló: {e}")
+        return False
+    MODEL_RESIDENT.set(1, model=model, backend=backend.url)
+    return True
+
+
+async def warm_up_model() -> bool:
+    """Precarga el modelo en todos los backends en paralelo"""
+    results = await asyncio.gather(*(warm_up_backend(b) for b in backend_pool.backends))
+    return all(results)
+
+
+async def is_model_resident(backend: Backend, model: str) -> Optional[bool]:
+    """Consulta /api/ps. None si Ollama no responde."""
+    try:
+        async with http_client.get(
+            f"{backend.url}/api/ps", timeout=aiohttp.ClientTimeout(total=5)
+        ) as response:
+            if response.status != 200:
+                return None
+            data = await response.json()
+    except aiohttp.ClientError:
+        return None
+    names = {m.get("name") for m in data.get("models", [])} | {m.get("model") for m in data.get("models", [])}
+    return model in names
+
+
+async def check_backend_residency(backend: Backend):
+    model = model_ladder.current()
+    resident = await is_model_resident(backend, model)
+    if resident is None:
+        return
+    MODEL_RESIDENT.set(1 if resident else 0, model=model, backend=backend.url)
+    if not resident:
+        MODEL_RELOADS.inc(model=model, backend=backend.url)
+        await warm_up_backend(backend, model)
+
+
+async def model_residency_loop():
+    """Tarea de fondo: recarga el modelo en cada backend donde Ollama lo desalojó"""
+    while True:
+        await asyncio.sleep(MODEL_RESIDENCY_CHECK_INTERVAL)
+        try:
+            await asyncio.gather(*(check_backend_residency(b) for b in backend_pool.backends))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️  Chequeo de residencia falló: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Sesiones de topología
+# ---------------------------------------------------------------------------
+
+TOPOLOGY_SESSIONS = Gauge("topology_sessions", "Sesiones de topología vigentes")
+
+session_store = SessionStore(ttl_seconds=SESSION_TTL, max_sessions=SESSION_MAX_ENTRIES)
+
+
+async def create_topology_session(topology_info: str) -> TopologySession:
+    """
+    Evalúa la topología una vez (num_predict=1) y guarda el context que
+    devuelve Ollama. Una topología ya subida reutiliza su sesión vigente.
+    """
+    topology_hash = text_hash(topology_info)
+    existing = session_store.find_by_topology(topology_hash)
+    if existing is not None and existing.model == model_ladder.current():
+        return existing
+    return await single_flight.run(
+        "session", topology_hash, lambda: _create_topology_session(topology_info, topology_hash)
+    )
+
+
+async def _create_topology_session(topology_info: str, topology_hash: str) -> TopologySession:
+    model = pin_request_model()
+    backend = backend_pool.pick()
+    async with admitted(("session",)):
+        try:
+            result = await ollama_generate(
+                build_session_prompt(topology_info), CONFIG_TEMPERATURE,
+                options={"num_predict": 1}, prefer=backend
+            )
+        except HTTPException:
+            raise
+        except aiohttp.ClientConnectionError:
+            raise HTTPException(status_code=503, detail="Cannot connect to Ollama. Make sure Ollama is running.")
+    if result is None or not result.get("context"):
+        raise HTTPException(status_code=502, detail="Ollama did not return a context for the topology")
+    return session_store.add(TopologySession(
+        topology_info, topology_hash, result["context"], backend, result.get("prompt_eval_count") or 0, model
+    ))
+
+
+def resolve_session(request: ConfigRequest) -> Optional[TopologySession]:
+    if request.session_id is None:
+        return None
+    session = session_store.get(request.session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session_id")
+    return session
+
+
+# ---------------------------------------------------------------------------
+# Trabajos asíncronos
+# ---------------------------------------------------------------------------
+
+JOBS = Gauge("jobs", "Trabajos en la cola persistente por estado", ["status"])
+JOBS_FINISHED = Counter("jobs_finished_total", "Ejecuciones de trabajos por resultado", ["outcome"])
 
+# Estados de error transitorios: el trabajo se reintenta mientras queden intentos
+JOB_RETRYABLE_STATUS = (429, 502, 503, 504)
 
-class ConfigRequest(BaseModel):
-    requirement: str
-    network_state: Optional[str] = ""
 
+def job_request(request: ConfigRequest) -> ConfigRequest:
+    """
+    Request que se persiste. Las sesiones viven solo en memoria: la topología
+    de la sesión se guarda completa para que el trabajo sobreviva a un
+    reinicio, y session_id queda solo como atajo mientras la sesión exista.
+    """
+    session = resolve_session(request)
+    if session is None:
+        return request
+    return request.model_copy(update={"network_state": session.topology})
 
-class ConfigResponse(BaseModel):
-    classification_type: str
-    steps: list[str]
-    cisco_config: str
-    success: bool
-    error_message: Optional[str] = None
+
+def job_dedup_key(request: ConfigRequest, mode: str) -> str:
+    # La topología ya está en network_state: el mismo trabajo con o sin sesión es el mismo
+    return make_key(
+        "job", MODEL_ID, mode, normalize_requirement(request.requirement), text_hash(request.network_state)
+    )
+
+
+async def run_job(job: dict):
+    """Ejecuta el pipeline de un trabajo reclamado y guarda el resultado o el error"""
+    set_request_budget(None, job["priority"])
+    request = ConfigRequest(**job["request"])
+    if request.session_id is not None and request.network_state and session_store.get(request.session_id) is None:
+        # La sesión expiró o el servidor se reinició: se usa la topología guardada con el trabajo
+        request = request.model_copy(update={"session_id": None})
+    with tracer.trace(job["id"], "job.run", attempt=job["attempts"]) as root:
+        try:
+            response = await run_pipeline(request, job["mode"])
+        except HTTPException as e:
+            retry_after = None
+            if e.status_code in JOB_RETRYABLE_STATUS:
+                retry_after = float((e.headers or {}).get("Retry-After", JOB_RETRY_DELAY))
+            outcome = await asyncio.to_thread(job_queue.fail, job["id"], str(e.detail), e.status_code, retry_after)
+            outcome = "retried" if outcome == "queued" else "failed"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await asyncio.to_thread(job_queue.fail, job["id"], f"Error running job: {str(e)}", 500)
+            outcome = "failed"
+        else:
+            await asyncio.to_thread(job_queue.complete, job["id"], response.model_dump())
+            outcome = "succeeded"
+        root.set(outcome=outcome)
+        JOBS_FINISHED.inc(outcome=outcome)
 
 
-def run_inference(requirement: str):
+async def job_heartbeat_loop():
+    """Tarea de fondo: renueva las concesiones de los trabajos en curso de este proceso"""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            await asyncio.to_thread(job_queue.heartbeat)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️  No se pudieron renovar las concesiones de los trabajos: {e}")
+
+
+async def job_worker(worker_id: int):
+    """Tarea de fondo: reclama trabajos de la cola y los ejecuta de uno en uno"""
+    while True:
+        try:
+            job = await asyncio.to_thread(job_queue.claim)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️  Worker {worker_id} no pudo leer la cola de trabajos: {e}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            job_wakeup.clear()
+            continue
+        try:
+            await run_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Fallo fuera del pipeline (request guardado inválido, SQLite ocupado al guardar el
+            # resultado): el worker sigue y el trabajo se reintenta mientras le queden intentos
+            print(f"⚠️  Worker {worker_id} falló con el trabajo {job['id']}: {e}")
+            try:
+                await asyncio.to_thread(
+                    job_queue.fail, job["id"], f"Error running job: {str(e)}", 500, JOB_RETRY_DELAY
+                )
+            except Exception as e:
+                print(f"⚠️  Worker {worker_id} no pudo registrar el fallo de {job['id']}: {e}")
+
+
+async def run_inference(requirement: str):
     """
     Envía una solicitud a Ollama con Llama 3.1 8B para clasificar el requerimiento
     """
     
-    system_prompt = (
-        "You are a network configuration assistant.\n\n"
-        
-        "TASK 1 - CLASSIFY the requirement as one of:\n"
-        "- CP: monitoring, performance, NetFlow, IP settings, application layer configuration\n"
-        "- RP: routing protocols (OSPF, BGP, RIP), routing tables\n"
-        "- ACL: access control lists, firewall rules\n"
-        "- TN: tunnels and VPNs (IPSec, GRE, site-to-site)\n\n"
-        
-        "TASK 2 - GENERATE detailed implementation steps:\n"
-        "- Break down the requirement into specific, actionable steps\n"
-        "- Each step must be clear and technical\n"
-        "- Include what needs to be configured/verified on which device\n"
-        "- Be specific about protocols, interfaces, and actions\n"
-        "- Generate at least 3-5 steps depending on complexity\n\n"
-        
-        "EXAMPLE for 'Configure OSPF between R1 and R2':\n"
-        "{\n"
-        '  "type": "RP",\n'
-        '  "steps": [\n'
-        '    "Enable OSPF process on R1 with appropriate process ID",\n'
-        '    "Configure OSPF network statements on R1 for connected interfaces",\n'
-        '    "Enable OSPF process on R2 with matching process ID",\n'
-        '    "Configure OSPF network statements on R2 for connected interfaces",\n'
-        '    "Verify OSPF neighbor adjacency between R1 and R2"\n'
-        '  ]\n'
-        "}\n\n"
-        
-        "OUTPUT FORMAT - Return ONLY valid JSON:\n"
-        "{\n"
-        '  "type": "CP | RP | ACL | TN",\n'
-        '  "steps": ["detailed step 1", "detailed step 2", "..."]\n'
-        "}\n\n"
-        
-        "RULES:\n"
-        "- Output ONLY JSON, no markdown, no explanations\n"
-        "- Steps must be detailed and actionable\n"
-        "- Minimum 3 steps, more if needed"
-    )
-    
-    prompt = f"{system_prompt}\n\nUser requirement: {requirement}"
-    
-    try:
-        response = requests.post(
-            OLLAMA_API_URL,
-            json={
-                "model": MODEL_ID,
-                "prompt": prompt,
-                "stream": False,
-                "temperature": 0.1
-            },
-            timeout=300
+    with span("phase.classification"):
+        cache_key = classification_cache_key(requirement)
+        cached = cache_get("classification", cache_key)
+        if cached is not None:
+            return cached
+
+        # Embedding, clasificador local y guardado semántico una sola vez por grupo de requests iguales
+        return await single_flight.run(
+            "classification", cache_key, lambda: _resolve_classification(requirement, cache_key)
         )
+
+
+async def _resolve_classification(requirement: str, cache_key: str):
+    # Los aciertos semánticos no se copian a la caché exacta: así DELETE
+    # /cache/semantic/{id} basta para retirar una coincidencia incorrecta
+    similar, vector = await semantic_lookup(requirement)
+    if similar is not None:
+        return similar
+
+    prompt, fast_type = plan_classification(requirement)
+    if fast_type is not None:
+        # Atajo del clasificador local: clave propia y fuera de la caché semántica
+        cache_key = classification_cache_key(requirement, fast_type)
+        cached = cache_get("classification", cache_key)
+        if cached is not None:
+            return cached
+
+    result = await _run_inference_uncached(requirement, cache_key, prompt, fast_type)
+    if fast_type is None:
+        semantic_store(requirement, vector, result)
+    return result
+
+
+async def _run_inference_uncached(requirement: str, cache_key: str, prompt: str, fast_type: Optional[str]):
+    async with admitted(("classification", "config")):
+        started = time.perf_counter()
+        try:
+            if CLASSIFICATION_SCHEMA_MODE:
+                parser = ClassificationStreamParser()
+                async for _ in stream_classification(prompt, parser, steps_only=fast_type is not None):
+                    pass
+                with span("json.parse", chars=len(parser.buffer)):
+                    response_json = finish_classification(requirement, parser.result(), fast_type)
+                if response_json is None:
+                    JSON_PARSE_FAILURES.inc()
+                elif is_valid_classification(response_json):
+                    cache_set("classification", cache_key, response_json)
+                return response_json
+
+            result = await ollama_generate_hedged(prompt, CLASSIFICATION_TEMPERATURE, "classification")
         
-        if response.status_code == 200:
-            result = response.json()
-            response_text = result.get("response", "")
+            if result is not None:
+                response_text = result.get("response", "")
             
-            try:
-                response_json = json.loads(response_text)
-                return response_json
-            except json.JSONDecodeError:
+                try:
+                    with span("json.parse", chars=len(response_text)):
+                        response_json = finish_classification(requirement, json.loads(response_text), fast_type)
+                    if is_valid_classification(response_json):
+                        cache_set("classification", cache_key, response_json)
+                    return response_json
+                except json.JSONDecodeError:
+                    JSON_PARSE_FAILURES.inc()
+                    return None
+            else:
                 return None
-        else:
-            return None
             
-    except requests.exceptions.ConnectionError:
-        raise HTTPException(status_code=503, detail="Cannot connect to Ollama. Make sure Ollama is running.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error during inference: {str(e)}")
+        except HTTPException:
+            raise
+        except aiohttp.ClientConnectionError:
+            raise HTTPException(status_code=503, detail="Cannot connect to Ollama. Make sure Ollama is running.")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error during inference: {str(e)}")
+        finally:
+            PHASE_LATENCY.observe(time.perf_counter() - started, phase="classification")
 
 
-def generate_cisco_config(requirement: str, low_level_steps: list, topology_info: str = ""):
+async def generate_cisco_config(requirement: str, low_level_steps: list, topology_info: str = "",
+                                session: Optional[TopologySession] = None):
     """
-    Segunda fase: genera las configuraciones de Cisco IOS basadas en los pasos de bajo nivel
+    Segunda fase: genera las configuraciones de Cisco IOS basadas en los pasos de bajo nivel.
+    Con `session` la topología viaja como context de Ollama en lugar de en el prompt.
     """
     
-    steps_text = "\n".join([f"{i+1}. {step}" for i, step in enumerate(low_level_steps)])
+    if session is not None and session.model != current_model():
+        # El context de la sesión es de otro modelo de la escalera: se envía la topología completa
+        topology_info, session = session.topology, None
+    if session is not None:
+        topology_info = session.topology
+    devices = config_devices(low_level_steps, topology_info)
+    with span("phase.config", session=session is not None, devices=len(devices)):
+        cache_key = config_cache_key(
+            requirement, low_level_steps, topology_info, via_session=session is not None, devices=devices
+        )
+        cached = cache_get("config", cache_key)
+        if cached is not None:
+            return cached
+
+        if devices:
+            return await single_flight.run(
+                "config", cache_key,
+                lambda: _generate_cisco_config_per_device(
+                    requirement, low_level_steps, topology_info, cache_key, session, devices
+                )
+            )
+        return await single_flight.run(
+            "config", cache_key,
+            lambda: _generate_cisco_config_uncached(requirement, low_level_steps, topology_info, cache_key, session)
+        )
+
+
+async def _generate_device_block(prompt: str, device: str,
+                                 session: Optional[TopologySession] = None) -> Optional[dict]:
+    """Una llamada de la fase 2 para un equipo; None si Ollama no respondió 200"""
+    async with admitted(("config",)):
+        with span("phase.config.device", device=device):
+            result = await ollama_generate_hedged(
+                build_device_config_prompt(prompt, device), CONFIG_TEMPERATURE, "config",
+                context=session.context if session is not None else None,
+                prefer=session.backend if session is not None else None
+            )
+    if result is None:
+        return None
+    if session is not None:
+        session.record_use(result.get("prompt_eval_count") or 0)
+    text = result.get("response", "")
+    # Si el modelo agregó bloques de otros equipos se descartan: esos tienen su propia llamada
+    commands = [
+        c for block in parse_device_blocks(text) if block["device"].casefold() == device.casefold()
+        for c in block["commands"]
+    ]
+    return {"device": device, "commands": commands, "text": text}
+
+
+CONFIG_BLOCKS_INVALID = Counter(
+    "config_blocks_invalid_total", "Bloques ~~~Device~~~ que no pasaron la validación estática", ["check"]
+)
+CONFIG_BLOCK_REPAIRS = Counter(
+    "config_block_repairs_total",
+    "Regeneraciones de un bloque inválido (partial = menos problemas, failed = se queda el original)", ["result"]
+)
+
+
+def count_invalid_block(issues: list):
+    for issue in issues:
+        if issue.startswith("device "):
+            check = "device"
+        elif issue.startswith("interface "):
+            check = "interface"
+        elif "inside configuration mode" in issue:
+            check = "show_in_config"
+        else:
+            check = "configure_end"
+        CONFIG_BLOCKS_INVALID.inc(check=check)
+
+
+async def repair_device_block(prompt: str, block: dict, issues: list, inventory: NetworkInventory,
+                              session: Optional[TopologySession] = None) -> tuple:
+    """
+    Regenera solo el bloque inválido con un prompt que incluye sus problemas.
+    Retorna (bloque, "repaired" | "partial" | "failed"); si la reparación no
+    mejora el bloque se queda el original.
+    """
+    count_invalid_block(issues)
+    with span("config.repair", device=block["device"], issues=len(issues)) as s:
+        try:
+            repaired = await _generate_device_block(build_repair_prompt(prompt, block, issues), block["device"], session)
+        except Exception as e:
+            # Una reparación fallida no tumba el request: queda el bloque original
+            s.set(error=type(e).__name__)
+            repaired = None
+        result = "failed"
+        if repaired is not None and repaired["commands"]:
+            candidate = {"index": block["index"], "device": block["device"], "commands": repaired["commands"]}
+            remaining = validate_block(candidate, inventory)
+            if len(remaining) < len(issues):
+                block, result = candidate, "partial" if remaining else "repaired"
+        s.set(result=result)
+    CONFIG_BLOCK_REPAIRS.inc(result=result)
+    return block, result
+
+
+async def repair_config(config_text: str, prompt: str, topology_info: str,
+                        session: Optional[TopologySession] = None) -> str:
+    """Valida cada bloque de la config y regenera en paralelo solo los inválidos"""
+    if not CONFIG_REPAIR_ENABLED or not config_text:
+        return config_text
+    parser = DeviceBlockParser()
+    blocks = parser.feed(config_text) + parser.finish()
+    if not blocks:
+        return config_text
+    inventory = NetworkInventory(topology_info)
+    with span("config.validate", blocks=len(blocks)) as s:
+        invalid = validate_config(blocks, inventory)
+        s.set(invalid=len(invalid))
+    if not invalid:
+        return config_text
+    repaired = await asyncio.gather(*(
+        repair_device_block(prompt, blocks[index], issues, inventory, session)
+        for index, issues in invalid.items()
+    ))
+    for block, _ in repaired:
+        blocks[block["index"]] = block
+    # El texto fuera de los bloques (<INSUFFICIENT_DATA ...>, notas) se conserva
+    return "\n".join(parser.preamble + [format_device_blocks(blocks)])
+
+
+async def _generate_cisco_config_per_device(requirement: str, low_level_steps: list,
+                                            topology_info: str, cache_key: str,
+                                            session: Optional[TopologySession], devices: tuple):
+    """
+    Fase 2 con una generación por equipo en paralelo: la latencia queda
+    dominada por el bloque más largo y no por la suma de todos.
+    """
+    if session is not None:
+        prompt = build_session_config_prompt(requirement, low_level_steps)
+    else:
+        prompt = build_config_prompt(requirement, low_level_steps, topology_info)
+
+    started = time.perf_counter()
+    tasks = [asyncio.ensure_future(_generate_device_block(prompt, device, session)) for device in devices]
+    try:
+        blocks = await asyncio.gather(*tasks)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating config: {str(e)}")
+    finally:
+        # Si un equipo falla, los demás no siguen generando para nadie
+        for task in tasks:
+            task.cancel()
+        PHASE_LATENCY.observe(time.perf_counter() - started, phase="config")
+
+    if any(block is None for block in blocks):
+        return None
+    config_text = format_device_blocks([b for b in blocks if b["commands"]])
+    if not config_text:
+        # Ningún equipo tenía comandos: se devuelve la nota del modelo (<No Configuration Requirements>, ...)
+        config_text = blocks[0]["text"].strip()
+    config_text = await repair_config(config_text, prompt, topology_info, session)
+    if config_text:
+        cache_set("config", cache_key, config_text)
+    return config_text
+
+
+async def _generate_cisco_config_uncached(requirement: str, low_level_steps: list,
+                                          topology_info: str, cache_key: str,
+                                          session: Optional[TopologySession] = None):
+    if session is not None:
+        prompt = build_session_config_prompt(requirement, low_level_steps)
+    else:
+        prompt = build_config_prompt(requirement, low_level_steps, topology_info)
     
-    system_prompt = (
-        "You are an expert network administrator that generates Cisco IOS commands.\n\n"
-        
-        "CISCO IOS COMMAND MODES:\n"
-        "- TROUBLESHOOTING/VERIFICATION: Use only show/debug commands in privileged EXEC mode\n"
-        "- CONFIGURATION: Use 'configure terminal' to enter config mode, add config commands, then 'end'\n"
-        "- NEVER mix show/debug commands with configuration mode commands\n\n"
-        
-        "CRITICAL RULES:\n"
-        "1. If the requirement is for VERIFICATION or TROUBLESHOOTING, use ONLY show/debug commands\n"
-        "2. If the requirement is for CONFIGURATION, use config commands\n"
-        "3. Configure ONLY what is EXPLICITLY requested - DO NOT add extra commands, features, or configurations not mentioned\n"
-        "4. DO NOT invent or assume ANY values: IPs, interfaces, hostnames, process IDs, subnet masks, VLANs, authentication, etc.\n"
-        "5. DO NOT add authentication, costs, timers, priorities, or any feature NOT specifically requested\n"
-        "6. If information is missing and you cannot complete the task, respond ONLY: <INSUFFICIENT_DATA: specify what is needed>\n"
-        "7. Group ALL commands for each device under ONE separator: ~~~<device_name>~~~\n"
-        "8. NO explanations, NO comments, NO markdown, ONLY commands\n"
-        "9. If not applicable to configuration, respond ONLY: <No Configuration Requirements>\n"
-        "10. DO NOT mix show/debug commands with configuration mode commands\n"
-        "11. For troubleshooting, list show/debug commands directly without 'configure terminal'\n"
-        "12. For configuration, start with 'configure terminal', add config commands, end with 'end'\n\n"
+    async with admitted(("config",)):
+        started = time.perf_counter()
+        try:
+            if session is not None:
+                result = await ollama_generate_hedged(
+                    prompt, CONFIG_TEMPERATURE, "config", context=session.context, prefer=session.backend
+                )
+                if result is not None:
+                    session.record_use(result.get("prompt_eval_count") or 0)
+            else:
+                result = await ollama_generate_hedged(prompt, CONFIG_TEMPERATURE, "config")
         
-        "OUTPUT FORMAT (one command per line, executable in sequence):\n"
-        "~~~Device1~~~\n"
-        "command1\n"
-        "command2\n"
-        "~~~Device2~~~\n"
-        "command1\n"
-        "command2\n"
-    )
-    
-    user_prompt = f"Original requirement: {requirement}\n\nSteps to implement:\n{steps_text}"
-    if topology_info:
-        user_prompt += f"\n\nNetwork state/topology:\n{topology_info}"
+            if result is None:
+                return None
+            config_text = result.get("response", "")
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error generating config: {str(e)}")
+        finally:
+            PHASE_LATENCY.observe(time.perf_counter() - started, phase="config")
+
+    # Fuera de la admisión: cada reparación pide su propio turno
+    config_text = await repair_config(config_text, prompt, topology_info, session)
+    if config_text:
+        cache_set("config", cache_key, config_text)
+    return config_text
+
+
+async def run_fused_inference(requirement: str, topology_info: str = ""):
+    """
+    Modo fusionado: type, steps y config por equipo en una sola generación
+    estructurada (format="json"), evaluando el prompt una única vez.
+    """
     
-    prompt = f"{system_prompt}\n\n{user_prompt}"
+    with span("phase.fused"):
+        cache_key = fused_cache_key(requirement, topology_info)
+        cached = cache_get("fused", cache_key)
+        if cached is not None:
+            return cached
+        
+        return await single_flight.run(
+            "fused", cache_key, lambda: _run_fused_inference_uncached(requirement, topology_info, cache_key)
+        )
+
+
+async def _run_fused_inference_uncached(requirement: str, topology_info: str, cache_key: str):
+    prompt = build_fused_prompt(requirement, topology_info)
     
+    async with admitted(("fused",)):
+        started = time.perf_counter()
+        try:
+            result = await ollama_generate(prompt, FUSED_TEMPERATURE, response_format="json")
+            if result is None:
+                return None
+            try:
+                with span("json.parse", chars=len(result.get("response", ""))):
+                    response_json = json.loads(result.get("response", ""))
+            except json.JSONDecodeError:
+                JSON_PARSE_FAILURES.inc()
+                return None
+            if is_valid_fused(response_json):
+                cache_set("fused", cache_key, response_json)
+            return response_json
+        
+        except HTTPException:
+            raise
+        except aiohttp.ClientConnectionError:
+            raise HTTPException(status_code=503, detail="Cannot connect to Ollama. Make sure Ollama is running.")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error during fused inference: {str(e)}")
+        finally:
+            PHASE_LATENCY.observe(time.perf_counter() - started, phase="fused")
+
+
+# ---------------------------------------------------------------------------
+# Streaming (SSE)
+# ---------------------------------------------------------------------------
+
+class ClassificationStreamParser:
+    """
+    Parser incremental de la salida JSON de la fase 1.
+    Detecta "type" y cada string completo de "steps" sin esperar a que
+    el modelo cierre el objeto.
+    """
+
+    TYPE_RE = re.compile(r'"type"\s*:\s*"([^"]*)"')
+    STEPS_RE = re.compile(r'"steps"\s*:\s*\[')
+
+    def __init__(self):
+        self.buffer = ""
+        # Seguimiento de llaves del objeto de nivel superior (fuera de strings)
+        self.scan_pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+        self.object_end = None
+        self.type_emitted = False
+        self.steps_pos = None
+        self.steps_closed = False
+        self.step_count = 0
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, text: str) -> list:
+        """Añade texto y retorna la lista de eventos (nombre, datos) nuevos"""
+        self.buffer += text
+        self._scan_object()
+        events = []
+
+        if not self.type_emitted:
+            match = self.TYPE_RE.search(self.buffer)
+            if match:
+                self.type_emitted = True
+                events.append(("classification", {"type": match.group(1)}))
+
+        if self.steps_pos is None:
+            match = self.STEPS_RE.search(self.buffer)
+            if match:
+                self.steps_pos = match.end()
+
+        while self.steps_pos is not None and not self.steps_closed:
+            pos = self.steps_pos
+            while pos < len(self.buffer) and self.buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(self.buffer):
+                break
+            if self.buffer[pos] == "]":
+                self.steps_closed = True
+                break
+            try:
+                step, end = self.decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                # String aún incompleto: esperar más tokens
+                break
+            self.steps_pos = end
+            events.append(("step", {"index": self.step_count, "step": step}))
+            self.step_count += 1
+
+        return events
+
+    def _scan_object(self):
+        if self.object_end is not None:
+            return
+        for pos in range(self.scan_pos, len(self.buffer)):
+            char = self.buffer[pos]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = self.object_start is not None
+            elif char == "{":
+                if self.object_start is None:
+                    self.object_start = pos
+                self.depth += 1
+            elif char == "}" and self.object_start is not None:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.object_end = pos + 1
+                    break
+        self.scan_pos = len(self.buffer)
+
+    @property
+    def complete(self) -> bool:
+        """True en cuanto se cierra el objeto de nivel superior: el resto sobra"""
+        return self.object_end is not None
+
+    def result(self) -> Optional[dict]:
+        """JSON final de la fase 1 (solo el objeto de nivel superior, si ya cerró)"""
+        text = self.buffer[self.object_start:self.object_end] if self.complete else self.buffer
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+
+CLASSIFICATION_EARLY_STOPS = Counter(
+    "classification_early_stops_total",
+    "Generaciones de la fase 1 cortadas al cerrarse el objeto JSON antes de que Ollama terminara"
+)
+
+
+async def stream_classification(prompt: str, parser: ClassificationStreamParser, steps_only: bool = False):
+    """
+    Genera la fase 1 en streaming y la pasa por el parser, emitiendo sus
+    eventos. Corta la generación en cuanto se cierra el objeto JSON: los
+    tokens que vendrían después (espacios, texto suelto) no se pagan.
+    """
+    async with aclosing(ollama_stream(
+        prompt, CLASSIFICATION_TEMPERATURE, classification_response_format(steps_only)
+    )) as chunks:
+        streamed = 0
+        async for chunk in chunks:
+            streamed += 1
+            for event in parser.feed(chunk.get("response", "")):
+                yield event
+            if chunk.get("done"):
+                return
+            if parser.complete:
+                # Sin chunk final no hay estadísticas de Ollama: contar lo generado
+                CLASSIFICATION_EARLY_STOPS.inc()
+                record_partial_stats(streamed)
+                return
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_config_events(request: ConfigRequest, deadline_ms: Optional[float] = None,
+                               priority: Optional[int] = None):
+    """
+    Pipeline de dos fases en modo streaming: emite el tipo, cada paso y
+    luego los tokens de configuración a medida que Ollama los produce.
+    """
+    set_request_budget(deadline_ms, priority)
+    request_started = time.perf_counter()
     try:
-        response = requests.post(
-            OLLAMA_API_URL,
-            json={
-                "model": MODEL_ID,
-                "prompt": prompt,
-                "stream": False,
-                "temperature": 0.01
-            }, 
-            timeout=300
+        session = resolve_session(request)
+        current_span().set(model=pin_request_model())
+        if session is not None and session.model != current_model():
+            # El context de la sesión es de otro modelo de la escalera: se envía la topología completa
+            request = request.model_copy(update={"network_state": session.topology, "session_id": None})
+            session = None
+
+        # Fase 1: Clasificación y generación de pasos
+        classification_key = classification_cache_key(request.requirement)
+        classification_result = cache_get("classification", classification_key)
+        vector = None
+        fast_type = None
+        if classification_result is None:
+            classification_result, vector = await semantic_lookup(request.requirement)
+        if classification_result is None:
+            prompt, fast_type = plan_classification(request.requirement)
+            if fast_type is not None:
+                classification_key = classification_cache_key(request.requirement, fast_type)
+                classification_result = cache_get("classification", classification_key)
+        if classification_result is not None:
+            yield sse_event("classification", {"type": classification_result["type"]})
+            for i, step in enumerate(classification_result["steps"]):
+                yield sse_event("step", {"index": i, "step": step})
+        else:
+            parser = ClassificationStreamParser()
+            if fast_type is not None:
+                yield sse_event("classification", {"type": fast_type})
+            with span("phase.classification", stream=True, fast=fast_type is not None):
+                async with admitted(("classification", "config")):
+                    started = time.perf_counter()
+                    async for event, data in stream_classification(prompt, parser, steps_only=fast_type is not None):
+                        yield sse_event(event, data)
+                    PHASE_LATENCY.observe(time.perf_counter() - started, phase="classification")
+                with span("json.parse", chars=len(parser.buffer)):
+                    classification_result = finish_classification(request.requirement, parser.result(), fast_type)
+            if classification_result is None:
+                JSON_PARSE_FAILURES.inc()
+            if is_valid_classification(classification_result):
+                cache_set("classification", classification_key, classification_result)
+                if fast_type is None:
+                    semantic_store(request.requirement, vector, classification_result)
+
+        if not classification_result:
+            yield sse_event("error", {"detail": "Failed to classify requirement. Model did not return valid JSON."})
+            return
+        if "type" not in classification_result or "steps" not in classification_result:
+            yield sse_event("error", {"detail": "Invalid classification result format"})
+            return
+
+        # Fase 2: Generación de configuración Cisco, token a token
+        raise_if_client_gone()
+        config_key = config_cache_key(
+            request.requirement,
+            classification_result["steps"],
+            session.topology if session is not None else request.network_state,
+            via_session=session is not None
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            config_text = result.get("response", "")
-            return config_text
+        cisco_config = cache_get("config", config_key)
+        if cisco_config is not None:
+            yield sse_event("config", {"token": cisco_config})
+            for block in parse_device_blocks(cisco_config):
+                yield sse_event("device", block)
         else:
-            return None
-            
+            if session is not None:
+                prompt = build_session_config_prompt(request.requirement, classification_result["steps"])
+            else:
+                prompt = build_config_prompt(
+                    request.requirement,
+                    classification_result["steps"],
+                    request.network_state
+                )
+            config_parts = []
+            blocks = DeviceBlockParser()
+            # Con CONFIG_REPAIR_ENABLED cada bloque se valida al cerrarse: un bloque inválido
+            # no sale como evento "device" hasta repararlo, y su reparación arranca sin
+            # esperar al resto del stream (los tokens "config" ya enviados quedan como estaban)
+            inventory = NetworkInventory(
+                session.topology if session is not None else request.network_state
+            ) if CONFIG_REPAIR_ENABLED else None
+            closed_blocks, repairs = [], []
+
+            def route_block(block: dict) -> bool:
+                closed_blocks.append(block)
+                issues = validate_block(block, inventory) if inventory is not None else []
+                if issues:
+                    repairs.append(asyncio.ensure_future(
+                        repair_device_block(prompt, block, issues, inventory, session)
+                    ))
+                return not issues
+
+            try:
+                with span("phase.config", stream=True, session=session is not None) as config_span:
+                    async with admitted(("config",)):
+                        started = time.perf_counter()
+                        async with aclosing(ollama_stream(
+                            prompt, CONFIG_TEMPERATURE,
+                            context=session.context if session is not None else None,
+                            prefer=session.backend if session is not None else None
+                        )) as chunks:
+                            async for chunk in chunks:
+                                token = chunk.get("response", "")
+                                if token:
+                                    config_parts.append(token)
+                                    yield sse_event("config", {"token": token})
+                                    # Cada dispositivo sale en cuanto aparece el separador del siguiente
+                                    for block in blocks.feed(token):
+                                        if route_block(block):
+                                            yield sse_event("device", block)
+                                if chunk.get("done"):
+                                    if session is not None:
+                                        session.record_use(chunk.get("prompt_eval_count") or 0)
+                                    break
+                        for block in blocks.finish():
+                            if route_block(block):
+                                yield sse_event("device", block)
+                        PHASE_LATENCY.observe(time.perf_counter() - started, phase="config")
+                    config_span.set(devices=blocks.blocks_emitted, repairs=len(repairs))
+                for block, result in await asyncio.gather(*repairs):
+                    closed_blocks[block["index"]] = block
+                    yield sse_event("device", {**block, "repair": result})
+            finally:
+                for task in repairs:
+                    task.cancel()
+            if repairs:
+                cisco_config = "\n".join(blocks.preamble + [format_device_blocks(closed_blocks)])
+            else:
+                cisco_config = "".join(config_parts)
+            if cisco_config:
+                cache_set("config", config_key, cisco_config)
+
+        if not cisco_config:
+            yield sse_event("error", {"detail": "Failed to generate Cisco configuration"})
+            return
+
+        response = ConfigResponse(
+            classification_type=classification_result["type"],
+            steps=classification_result["steps"],
+            cisco_config=cisco_config,
+            success=True,
+            error_message=None,
+            model=current_model()
+        )
+        elapsed = time.perf_counter() - request_started
+        REQUEST_LATENCY.observe(elapsed, mode="stream")
+        record_ladder_switch(model_ladder.observe_latency(elapsed))
+        yield sse_event("done", response.model_dump())
+
+    except ClientDisconnected:
+        return
+    except aiohttp.ClientConnectionError:
+        yield sse_event("error", {"detail": "Cannot connect to Ollama. Make sure Ollama is running."})
+    except HTTPException as e:
+        yield sse_event("error", {"detail": e.detail, "status_code": e.status_code})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating config: {str(e)}")
+        yield sse_event("error", {"detail": f"Error during streaming: {str(e)}"})
 
 
 @app.get("/")
@@ -174,39 +2148,175 @@ def read_root():
         "message": "Network Config Generator API",
         "endpoints": {
             "/generate-config": "POST - Generate Cisco IOS configuration",
-            "/health": "GET - Check API health"
+            "/generate-config/stream": "POST - Same pipeline streamed as Server-Sent Events",
+            "/generate-config/batch": "POST - List of requests, NDJSON results in completion order",
+            "/health": "GET - Check API health",
+            "/cache/stats": "GET - Response cache hit/miss counters",
+            "/cache/semantic": "GET - Semantic cache hit quality (recent matches and similarities)",
+            "/classifier/fast": "GET - Local phase-1 classifier examples and shadow accuracy",
+            "/metrics": "GET - Prometheus metrics (latency, Ollama token timings)",
+            "/admission/stats": "GET - Scheduler in-flight, queue depth and rejections",
+            "/models/ladder": "GET - Current model of the load-driven downgrade ladder",
+            "/sessions": "POST - Upload network_state once, pass session_id to later requests",
+            "/jobs": "POST - Queue a durable generation job; GET /jobs/{id} or /jobs?status= to poll"
         }
     }
 
 
 @app.get("/health")
-def health_check():
-    """Check if Ollama is accessible"""
-    try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
-        if response.status_code == 200:
-            return {"status": "healthy", "ollama": "connected"}
-        else:
-            return {"status": "degraded", "ollama": "unreachable"}
-    except:
-        return {"status": "unhealthy", "ollama": "disconnected"}
+async def health_check():
+    """
+    Estado de los backends de Ollama según el último sondeo en segundo plano.
+    Solo sondea en línea si no hay sondeo vigente (p. ej. BACKEND_HEALTH_INTERVAL=0).
+    """
+    if health_prober.stale():
+        await health_prober.probe_all(http_client, model_ladder.current())
+        record_health_probe(health_prober)
+    return {**health_prober.snapshot(), "backends": backend_pool.stats()}
 
 
-@app.post("/generate-config", response_model=ConfigResponse)
-def generate_config(request: ConfigRequest):
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    ADMISSION_INFLIGHT.set(admission.inflight)
+    ADMISSION_QUEUED.set(admission.queued)
+    TOPOLOGY_SESSIONS.set(session_store.stats()["sessions"])
+    MODEL_LADDER_LEVEL.set(model_ladder.level)
+    if health_prober.last_probe:
+        HEALTH_PROBE_AGE.set(time.monotonic() - health_prober.last_probe)
+    if job_queue is not None:
+        for status, count in job_queue.counts().items():
+            JOBS.set(count, status=status)
+    for backend in backend_pool.backends:
+        BACKEND_OUTSTANDING.set(backend.outstanding, backend=backend.url)
+        BACKEND_HEALTHY.set(1 if backend.healthy else 0, backend=backend.url)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/models/ladder")
+def model_ladder_stats():
+    """Escalera de modelos: peldaño actual, p95 observados, umbrales y cambios recientes"""
+    return model_ladder.stats()
+
+
+@app.get("/admission/stats")
+def admission_stats():
+    """Estado del scheduler de admisión"""
+    return admission.stats()
+
+
+@app.get("/cache/semantic")
+def semantic_cache_stats(limit: int = Query(50, ge=1, le=500)):
     """
-    Generate Cisco IOS configuration based on requirement and network state
+    Calidad de la caché semántica: contadores, coincidencias recientes
+    (requerimiento consultado, el que coincidió y su similitud) y entradas más usadas
+    """
+    if semantic_cache is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "model": SEMANTIC_CACHE_MODEL,
+        **semantic_cache.stats(),
+        "recent_hits": list(semantic_cache.recent_hits)[-limit:],
+        "top_entries": semantic_cache.entries(limit),
+    }
+
+
+@app.get("/classifier/fast")
+def fast_classifier_stats():
+    """Clasificador local: ejemplos por tipo, precisión en sombra y requests atajados"""
+    if fast_classifier is None:
+        return {"enabled": False}
+    return {"enabled": True, **fast_classifier.stats()}
+
+
+@app.delete("/cache/semantic/{entry_id}")
+def delete_semantic_entry(entry_id: str):
+    """Elimina una entrada que produjo coincidencias incorrectas"""
+    if semantic_cache is None or not semantic_cache.remove(entry_id):
+        raise HTTPException(status_code=404, detail="Semantic cache entry not found")
+    return {"deleted": entry_id}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Contadores de hits/misses de la caché de respuestas y de coalescing por fase"""
+    if response_cache is None:
+        return {"enabled": False, "single_flight": single_flight.stats()}
+    return {"enabled": True, **response_cache.stats(), "single_flight": single_flight.stats()}
+
+
+def resolve_pipeline_mode(mode: Optional[str]) -> str:
+    mode = mode or PIPELINE_MODE
+    if mode not in PIPELINE_MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of {list(PIPELINE_MODES)}")
+    return mode
+
+
+async def run_pipeline(request: ConfigRequest, mode: Optional[str] = None) -> ConfigResponse:
+    """
+    Ejecuta el pipeline en el modo pedido. Lanza HTTPException si algo falla.
+    """
+    session = resolve_session(request)
+    mode = resolve_pipeline_mode(mode)
+    current_span().set(mode=mode, model=pin_request_model())
+    if mode == "fused":
+        if session is not None:
+            # El prompt fusionado no comparte prefijo con la sesión: se envía la topología completa
+            request = request.model_copy(update={"network_state": session.topology, "session_id": None})
+        return await run_fused_pipeline(request)
+    return await run_two_phase_pipeline(request, session)
+
+
+async def run_fused_pipeline(request: ConfigRequest) -> ConfigResponse:
+    started = time.perf_counter()
     
-    Args:
-        requirement: The user's network requirement in natural language
-        network_state: Optional topology/network state information (IPs, interfaces, hostnames, etc.)
+    result = await run_fused_inference(request.requirement, request.network_state)
     
-    Returns:
-        ConfigResponse with classification, steps, and generated Cisco commands
+    if not result:
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to generate configuration. Model did not return valid JSON."
+        )
+    
+    if not is_valid_fused(result):
+        raise HTTPException(
+            status_code=500,
+            detail="Invalid fused result format"
+        )
+    
+    with span("response.format_blocks"):
+        cisco_config = format_device_blocks(result["config"]) or result.get("note", "")
+    if not cisco_config:
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to generate Cisco configuration"
+        )
+    
+    elapsed = time.perf_counter() - started
+    REQUEST_LATENCY.observe(elapsed, mode="fused")
+    record_ladder_switch(model_ladder.observe_latency(elapsed))
+    with span("response.build"):
+        return ConfigResponse(
+            classification_type=result["type"],
+            steps=result["steps"],
+            cisco_config=cisco_config,
+            success=True,
+            error_message=None,
+            model=current_model()
+        )
+
+
+async def run_two_phase_pipeline(request: ConfigRequest,
+                                 session: Optional[TopologySession] = None) -> ConfigResponse:
+    """
+    Pipeline completo de dos fases. Lanza HTTPException si alguna fase falla.
     """
     
+    started = time.perf_counter()
+    
     # Fase 1: Clasificación y generación de pasos
-    classification_result = run_inference(request.requirement)
+    classification_result = await run_inference(request.requirement)
     
     if not classification_result:
         raise HTTPException(
@@ -220,11 +2330,13 @@ def generate_config(request: ConfigRequest):
             detail="Invalid classification result format"
         )
     
-    # Fase 2: Generación de configuración Cisco
-    cisco_config = generate_cisco_config(
+    # Fase 2: Generación de configuración Cisco, salvo que el cliente ya se haya ido
+    raise_if_client_gone()
+    cisco_config = await generate_cisco_config(
         request.requirement, 
         classification_result["steps"],
-        request.network_state
+        request.network_state,
+        session
     )
     
     if not cisco_config:
@@ -233,12 +2345,228 @@ def generate_config(request: ConfigRequest):
             detail="Failed to generate Cisco configuration"
         )
     
-    return ConfigResponse(
-        classification_type=classification_result["type"],
-        steps=classification_result["steps"],
-        cisco_config=cisco_config,
-        success=True,
-        error_message=None
+    elapsed = time.perf_counter() - started
+    REQUEST_LATENCY.observe(elapsed, mode="two_phase")
+    record_ladder_switch(model_ladder.observe_latency(elapsed))
+    with span("response.build"):
+        return ConfigResponse(
+            classification_type=classification_result["type"],
+            steps=classification_result["steps"],
+            cisco_config=cisco_config,
+            success=True,
+            error_message=None,
+            model=current_model()
+        )
+
+
+@app.post("/sessions")
+async def create_session(
+    request: SessionRequest,
+    x_request_deadline_ms: Optional[float] = Header(None),
+    x_request_priority: Optional[int] = Header(None)
+):
+    """
+    Sube la topología una vez y retorna un session_id para /generate-config.
+
+    Ollama evalúa el network_state aquí (prime_prompt_eval_count) y el context
+    resultante se reenvía en cada fase 2 de la sesión, de modo que esas
+    llamadas solo evalúan el requerimiento y los pasos. GET /sessions/{id}
+    muestra el prompt_eval_count de las llamadas posteriores para comparar.
+    """
+    if not request.network_state.strip():
+        raise HTTPException(status_code=422, detail="network_state must not be empty")
+    set_request_budget(x_request_deadline_ms, x_request_priority)
+    session = await create_topology_session(request.network_state)
+    return session.stats()
+
+
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    """Estado de la sesión, con prompt_eval_count al subirla y en las llamadas que la usaron"""
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session_id")
+    return session.stats()
+
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session_id")
+    return {"deleted": session_id}
+
+
+def require_job_queue() -> JobQueue:
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Job queue is disabled (JOBS_ENABLED=0)")
+    return job_queue
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    request: ConfigRequest,
+    mode: Optional[str] = None,
+    x_request_priority: Optional[int] = Header(None)
+):
+    """
+    Encola la generación y retorna de inmediato el id del trabajo.
+
+    El trabajo se guarda en SQLite y lo ejecuta un worker del servidor; si el
+    servidor se reinicia a mitad se vuelve a ejecutar (al menos una vez). Un
+    trabajo idéntico pendiente o ya completado se reutiliza (deduplicated=true).
+
+    Args:
+        mode: "two_phase" o "fused", igual que en /generate-config
+        X-Request-Priority: prioridad de admisión (por defecto JOB_PRIORITY)
+    """
+    queue = require_job_queue()
+    mode = resolve_pipeline_mode(mode)
+    priority = JOB_PRIORITY if x_request_priority is None else x_request_priority
+    request = job_request(request)
+    job, deduplicated = await asyncio.to_thread(
+        queue.submit, request.model_dump(), mode, job_dedup_key(request, mode), priority
+    )
+    if not deduplicated:
+        job_wakeup.set()
+    return {"id": job["id"], "status": job["status"], "deduplicated": deduplicated}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Estado del trabajo; `result` es el ConfigResponse cuando status es succeeded"""
+    job = require_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job
+
+
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    """Trabajos más recientes primero, opcionalmente filtrados por estado"""
+    if status is not None and status not in JOB_STATUSES:
+        raise HTTPException(status_code=422, detail=f"status must be one of {list(JOB_STATUSES)}")
+    queue = require_job_queue()
+    return {"jobs": queue.list(status, limit), "counts": queue.counts()}
+
+
+@app.post("/generate-config", response_model=ConfigResponse)
+async def generate_config(
+    request: ConfigRequest,
+    mode: Optional[str] = None,
+    x_request_deadline_ms: Optional[float] = Header(None),
+    x_request_priority: Optional[int] = Header(None)
+):
+    """
+    Generate Cisco IOS configuration based on requirement and network state
+    
+    Args:
+        requirement: The user's network requirement in natural language
+        network_state: Optional topology/network state information (IPs, interfaces, hostnames, etc.)
+        session_id: Optional id from POST /sessions; its topology replaces network_state
+        mode: "two_phase" (default, PIPELINE_MODE) or "fused" for a single structured generation
+        X-Request-Deadline-Ms: Optional time budget for both phases; 429 if it cannot be met
+        X-Request-Priority: Optional integer, higher values are scheduled first
+    
+    Returns:
+        ConfigResponse with classification, steps, and generated Cisco commands
+    """
+    set_request_budget(x_request_deadline_ms, x_request_priority)
+    return await run_pipeline(request, mode)
+
+
+async def stream_batch_results(requests: list, concurrency: int, mode: str,
+                               deadline_ms: Optional[float] = None, priority: Optional[int] = None):
+    """
+    Ejecuta el pipeline para cada request con a lo sumo `concurrency` en paralelo
+    y emite una línea NDJSON por item en orden de finalización.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_item(index: int, request: ConfigRequest) -> dict:
+        queued = time.perf_counter()
+        async with semaphore:
+            QUEUE_WAIT.observe(time.perf_counter() - queued, stage="batch")
+            # El deadline cuenta desde que el item empieza, no desde que llegó el lote
+            # (cada tarea tiene su copia del contexto)
+            set_request_budget(deadline_ms, priority)
+            try:
+                response = await run_pipeline(request, mode)
+                return {"index": index, "success": True, "result": response.model_dump()}
+            except HTTPException as e:
+                return {"index": index, "success": False, "status_code": e.status_code, "error": e.detail}
+            except Exception as e:
+                return {"index": index, "success": False, "status_code": 500, "error": str(e)}
+
+    tasks = [asyncio.ensure_future(run_item(i, r)) for i, r in enumerate(requests)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+    finally:
+        # Si el cliente se desconecta no seguir generando para nadie
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/generate-config/batch")
+async def generate_config_batch(
+    requests: list[ConfigRequest],
+    concurrency: Optional[int] = None,
+    mode: Optional[str] = None,
+    x_request_deadline_ms: Optional[float] = Header(None),
+    x_request_priority: Optional[int] = Header(None)
+):
+    """
+    Procesa una lista de ConfigRequest y devuelve NDJSON (una línea por item,
+    en orden de finalización, con su índice original). Los fallos se reportan
+    por item sin abortar el resto del lote.
+
+    Args:
+        concurrency: máximo de pipelines simultáneos (por defecto BATCH_CONCURRENCY,
+                     acotado a BATCH_MAX_CONCURRENCY)
+        mode: "two_phase" o "fused", igual que en /generate-config
+        X-Request-Deadline-Ms / X-Request-Priority: se aplican a cada item
+    """
+    if concurrency is None:
+        concurrency = BATCH_CONCURRENCY
+    if concurrency < 1:
+        raise HTTPException(status_code=422, detail="concurrency must be >= 1")
+    concurrency = min(concurrency, BATCH_MAX_CONCURRENCY)
+    mode = resolve_pipeline_mode(mode)
+
+    return StreamingResponse(
+        stream_batch_results(requests, concurrency, mode, x_request_deadline_ms, x_request_priority),
+        media_type="application/x-ndjson"
+    )
+
+
+@app.post("/generate-config/stream")
+async def generate_config_stream(
+    request: ConfigRequest,
+    x_request_deadline_ms: Optional[float] = Header(None),
+    x_request_priority: Optional[int] = Header(None)
+):
+    """
+    Versión streaming de /generate-config (Server-Sent Events).
+
+    Eventos emitidos, en orden:
+        classification: {"type": ...} en cuanto el modelo lo escribe
+        step:           {"index": i, "step": ...} por cada paso completo
+        config:         {"token": ...} por cada token de la configuración Cisco
+        device:         {"index": i, "device": ..., "commands": [...]} por cada bloque
+                        ~~~<device>~~~ en cuanto queda cerrado (siguiente separador o fin)
+        done:           ConfigResponse completo
+        error:          {"detail": ..., "status_code": ...} si alguna fase falla
+
+    Acepta las mismas cabeceras X-Request-Deadline-Ms / X-Request-Priority que
+    /generate-config; el 429 por sobrecarga se devuelve antes de abrir el stream.
+    """
+    set_request_budget(x_request_deadline_ms, x_request_priority)
+    precheck_admission(("classification", "config"))
+    return StreamingResponse(
+        stream_config_events(request, x_request_deadline_ms, x_request_priority),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 
@@ -0,0 +1,116 @@
+"""
+Balanceo entre varias instancias de Ollama (una por GPU/host).
+
+Cada llamada de fase va al backend con menos requests pendientes
+(least-outstanding-requests). Los backends que fallan se expulsan durante
+un backoff exponencial y se readmiten cuando vuelven a pasar el health check.
+"""
+
+import asyncio
+import itertools
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import aiohttp
+
+
+class Backend:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.backoff = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+
+    @property
+    def generate_url(self) -> str:
+        return f"{self.url}/api/generate"
+
+    def available(self, now: float) -> bool:
+        return self.healthy or now >= self.ejected_until
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.consecutive_failures,
+            "ejected_for_s": round(max(0.0, self.ejected_until - time.monotonic()), 1) if not self.healthy else 0,
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures,
+        }
+
+
+class BackendPool:
+    def __init__(self, urls: list, base_backoff: float = 5.0, max_backoff: float = 300.0):
+        if not urls:
+            raise ValueError("Se necesita al menos un backend de Ollama")
+        self.backends = [Backend(url) for url in urls]
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._tiebreak = itertools.count()
+
+    def pick(self, exclude: tuple = (), prefer: Optional[Backend] = None) -> Backend:
+        """
+        Backend disponible con menos requests pendientes. Si todos están
+        expulsados se usa igualmente el de menor carga: mejor intentar que
+        devolver 503 sin haber probado.
+
+        `prefer` fija la afinidad (p. ej. el backend con la KV-cache de una
+        sesión) mientras esté disponible.
+        """
+        now = time.monotonic()
+        if prefer is not None and prefer not in exclude and prefer.available(now):
+            return prefer
+        candidates = [b for b in self.backends if b not in exclude and b.available(now)]
+        if not candidates:
+            candidates = [b for b in self.backends if b not in exclude] or self.backends
+        least = min(b.outstanding for b in candidates)
+        tied = [b for b in candidates if b.outstanding == least]
+        return tied[next(self._tiebreak) % len(tied)]
+
+    @contextmanager
+    def track(self, backend: Backend):
+        backend.outstanding += 1
+        backend.total_requests += 1
+        try:
+            yield backend
+        finally:
+            backend.outstanding -= 1
+
+    def mark_failure(self, backend: Backend):
+        """Expulsa el backend con backoff exponencial"""
+        backend.total_failures += 1
+        backend.consecutive_failures += 1
+        backend.backoff = min(
+            self.max_backoff, self.base_backoff * (2 ** (backend.consecutive_failures - 1))
+        )
+        backend.healthy = False
+        backend.ejected_until = time.monotonic() + backend.backoff
+
+    def mark_success(self, backend: Backend):
+        backend.healthy = True
+        backend.consecutive_failures = 0
+        backend.backoff = 0.0
+        backend.ejected_until = 0.0
+
+    async def probe(self, session: aiohttp.ClientSession, backend: Backend) -> bool:
+        try:
+            async with session.get(
+                f"{backend.url}/api/tags", timeout=aiohttp.ClientTimeout(total=5)
+            ) as response:
+                ok = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            ok = False
+        if ok:
+            self.mark_success(backend)
+        elif backend.healthy or time.monotonic() >= backend.ejected_until:
+            self.mark_failure(backend)
+        return ok
+
+    def stats(self) -> list:
+        return [b.stats() for b in self.backends]
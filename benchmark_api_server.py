@@ -0,0 +1,191 @@
+"""
+Benchmark de throughput de api_server.py contra un Ollama simulado.
+
+Compara el handler síncrono original (requests.post bloqueante dentro de un
+`def`, que ocupa un worker del threadpool de Starlette por llamada) con el
+servidor actual (handlers async + aiohttp.ClientSession con pool keep-alive).
+
+No requiere GPU: fake_ollama.py responde /api/generate con una latencia fija.
+
+Uso:
+    python benchmark_api_server.py
+    python benchmark_api_server.py --latency 0.5 --concurrency 8 32 128
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import requests
+import uvicorn
+from fastapi import FastAPI
+
+from fake_ollama import FakeOllamaConfig, build_fake_ollama
+
+
+STUB_PORT = 11500
+LEGACY_PORT = 8100
+ASYNC_PORT = 8101
+
+
+# ---------------------------------------------------------------------------
+# Servidores
+# ---------------------------------------------------------------------------
+
+def build_stub_ollama(latency: float) -> FastAPI:
+    """Ollama falso: responde tras `latency` segundos sin bloquear el event loop."""
+    return build_fake_ollama(FakeOllamaConfig(call_latency=latency))
+
+
+def build_legacy_app(ollama_url: str) -> FastAPI:
+    """Réplica del servidor original: handler `def` con requests.post bloqueante."""
+    legacy = FastAPI()
+
+    @legacy.post("/generate-config")
+    def generate_config(payload: dict):
+        r1 = requests.post(
+            ollama_url,
+            json={"model": "stub", "prompt": f"TASK 1\n{payload['requirement']}", "stream": False},
+            timeout=300,
+        )
+        steps = json.loads(r1.json()["response"])
+        r2 = requests.post(
+            ollama_url,
+            json={"model": "stub", "prompt": "\n".join(steps["steps"]), "stream": False},
+            timeout=300,
+        )
+        return {
+            "classification_type": steps["type"],
+            "steps": steps["steps"],
+            "cisco_config": r2.json()["response"],
+            "success": True,
+        }
+
+    return legacy
+
+
+def serve_in_thread(app: FastAPI, port: int) -> uvicorn.Server:
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+# ---------------------------------------------------------------------------
+# Cliente de carga
+# ---------------------------------------------------------------------------
+
+async def drive(url: str, concurrency: int, total: int) -> dict:
+    """Lanza `total` requests con `concurrency` clientes simultáneos."""
+    import aiohttp
+
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal errors
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            t0 = time.perf_counter()
+            try:
+                payload = {"requirement": f"Configure OSPF between R1 and R2 #{i}"}
+                async with session.post(url, json=payload) as r:
+                    await r.read()
+                    if r.status != 200:
+                        errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=600)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "req_per_s": round(total / elapsed, 2),
+        "p50_s": round(latencies[len(latencies) // 2], 3),
+        "p95_s": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compara req/s del servidor síncrono original vs el servidor async con pool."
+    )
+    parser.add_argument("--latency", type=float, default=0.5, help="Latencia simulada por llamada a Ollama (s)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    args = parser.parse_args()
+
+    ollama_base = f"http://127.0.0.1:{STUB_PORT}"
+    os.environ["OLLAMA_BASE_URL"] = ollama_base
+    os.environ.setdefault("OLLAMA_MAX_CONNECTIONS", str(max(args.concurrency) * 2))
+    # El benchmark mide el pool, no la admisión: sin límite de generaciones ni de cola
+    os.environ.setdefault("ADMISSION_MAX_INFLIGHT", "0")
+    os.environ.setdefault("ADMISSION_MAX_QUEUE", "0")
+    # Cada concurrencia repite los requirements "#0".."#N": con caché el async respondería de SQLite
+    os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+    os.environ["SEMANTIC_CACHE_ENABLED"] = "0"
+    os.environ["JOBS_ENABLED"] = "0"
+    import api_server
+
+    stub = serve_in_thread(build_stub_ollama(args.latency), STUB_PORT)
+    legacy = serve_in_thread(build_legacy_app(f"{ollama_base}/api/generate"), LEGACY_PORT)
+    current = serve_in_thread(api_server.app, ASYNC_PORT)
+
+    targets = {
+        "sync_requests": f"http://127.0.0.1:{LEGACY_PORT}/generate-config",
+        "async_pool": f"http://127.0.0.1:{ASYNC_PORT}/generate-config",
+    }
+
+    print("=" * 80)
+    print("BENCHMARK api_server.py (Ollama simulado)")
+    print(f"Latencia por fase: {args.latency}s  |  Concurrencias: {args.concurrency}")
+    print("=" * 80)
+
+    results = []
+    for concurrency in args.concurrency:
+        total = concurrency * args.requests_per_client
+        row = {"concurrency": concurrency}
+        for name, url in targets.items():
+            r = asyncio.run(drive(url, concurrency, total))
+            row[name] = r
+            print(f"  [{name:>13}] c={concurrency:<4} {r['req_per_s']:>8} req/s  "
+                  f"p50={r['p50_s']}s  p95={r['p95_s']}s  errores={r['errors']}")
+        row["speedup"] = round(row["async_pool"]["req_per_s"] / row["sync_requests"]["req_per_s"], 2)
+        print(f"  -> speedup x{row['speedup']}\n")
+        results.append(row)
+
+    for server in (current, legacy, stub):
+        server.should_exit = True
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    out_file = f"benchmark_api_server_{timestamp}.json"
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": timestamp, "latency_s": args.latency, "results": results}, f, indent=2)
+    print(f"Reporte JSON: {out_file}")
+
+
+if __name__ == "__main__":
+    main()
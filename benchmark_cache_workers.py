@@ -0,0 +1,192 @@
+"""
+Benchmark de la caché de respuestas con varios workers de uvicorn.
+
+Levanta api_server.py con `uvicorn --workers N` contra fake_ollama.py y
+repite un conjunto de requerimientos en orden aleatorio. Compara:
+    shared:      RESPONSE_CACHE_PATH en disco (SQLite WAL compartido)
+    per_process: RESPONSE_CACHE_PATH=":memory:" (cada worker con su caché)
+
+La tasa de acierto se calcula con las llamadas que llegaron al Ollama falso
+(dos por request sin caché), así cuenta igual los aciertos de cualquier
+worker. El óptimo es 1 - únicos / total.
+
+Uso:
+    python benchmark_cache_workers.py
+    python benchmark_cache_workers.py --workers 1 4 8 --unique 50 --repeats 8 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import aiohttp
+import requests
+
+from benchmark_api_server import serve_in_thread
+from fake_ollama import FakeOllamaConfig, build_fake_ollama
+from load_test import percentile
+
+
+FAKE_OLLAMA_PORT = 11620
+API_PORT = 8620
+CACHE_MODES = ("shared", "per_process")
+
+
+def start_api(workers: int, cache_path: str, ollama_url: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "OLLAMA_BASE_URL": ollama_url,
+        "RESPONSE_CACHE_ENABLED": "1",
+        "RESPONSE_CACHE_PATH": cache_path,
+        "JOBS_ENABLED": "0",
+        "SEMANTIC_CACHE_ENABLED": "0",
+        "TRACE_SAMPLE_RATE": "0",
+        "MODEL_WARMUP_ON_STARTUP": "0",
+        "MODEL_RESIDENCY_CHECK_INTERVAL": "0",
+        "ADMISSION_MAX_INFLIGHT": os.environ.get("ADMISSION_MAX_INFLIGHT", "64"),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_server:app", "--host", "127.0.0.1",
+         "--port", str(API_PORT), "--workers", str(workers), "--log-level", "warning"],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn terminó con código {process.returncode}")
+        try:
+            if requests.get(f"http://127.0.0.1:{API_PORT}/", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("uvicorn no arrancó en 60 s")
+
+
+def stop_api(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def fake_generate_calls(ollama_url: str) -> int:
+    return requests.get(f"{ollama_url}/fake/stats", timeout=5).json()["requests"]
+
+
+async def drive(url: str, payloads: list, concurrency: int) -> tuple:
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+
+    async def client(session: aiohttp.ClientSession):
+        nonlocal errors
+        while not queue.empty():
+            payload = queue.get_nowait()
+            t0 = time.perf_counter()
+            try:
+                async with session.post(url, json=payload) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as session:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - t0
+
+
+def run_case(mode: str, workers: int, payloads: list, args, ollama_url: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, "cache.sqlite3") if mode == "shared" else ":memory:"
+        process = start_api(workers, cache_path, ollama_url)
+        try:
+            calls_before = fake_generate_calls(ollama_url)
+            latencies, errors, elapsed = asyncio.run(
+                drive(f"http://127.0.0.1:{API_PORT}/generate-config", payloads, args.concurrency)
+            )
+            calls = fake_generate_calls(ollama_url) - calls_before
+        finally:
+            stop_api(process)
+
+    total = len(payloads)
+    latencies.sort()
+    return {
+        "mode": mode,
+        "workers": workers,
+        "requests": total,
+        "errors": errors,
+        "ollama_calls": calls,
+        # Cada request sin caché hace dos llamadas (fase 1 y fase 2)
+        "hit_rate": round(1 - calls / (2 * total), 4),
+        "elapsed_s": round(elapsed, 3),
+        "req_per_s": round(total / elapsed, 2),
+        "p50_s": round(percentile(latencies, 50), 4),
+        "p95_s": round(percentile(latencies, 95), 4),
+        "p99_s": round(percentile(latencies, 99), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tasa de acierto y latencia de la caché con 1, 4 y 8 workers de uvicorn."
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--modes", nargs="+", choices=CACHE_MODES, default=list(CACHE_MODES))
+    parser.add_argument("--unique", type=int, default=50, help="Requerimientos distintos")
+    parser.add_argument("--repeats", type=int, default=8, help="Veces que se envía cada uno")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.2, help="Latencia simulada por llamada a Ollama (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    ollama_url = f"http://127.0.0.1:{FAKE_OLLAMA_PORT}"
+    serve_in_thread(build_fake_ollama(FakeOllamaConfig(call_latency=args.latency)), FAKE_OLLAMA_PORT)
+
+    payloads = [
+        {"requirement": f"Configure OSPF area {i} between R1 and R2", "network_state": ""}
+        for i in range(args.unique)
+        for _ in range(args.repeats)
+    ]
+    random.Random(args.seed).shuffle(payloads)
+    ideal = round(1 - args.unique / len(payloads), 4)
+
+    print("=" * 80)
+    print(f"CACHÉ CON VARIOS WORKERS  |  {args.unique} únicos x {args.repeats}  |  "
+          f"concurrencia {args.concurrency}  |  óptimo {ideal}")
+    print("=" * 80)
+
+    results = []
+    for workers in args.workers:
+        for mode in args.modes:
+            r = run_case(mode, workers, payloads, args, ollama_url)
+            results.append(r)
+            print(f"  workers={workers:<3} {mode:<12} hit_rate={r['hit_rate']:<7} {r['req_per_s']:>8} req/s  "
+                  f"p50={r['p50_s']}s  p95={r['p95_s']}s  llamadas={r['ollama_calls']}  errores={r['errors']}")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    out_file = f"benchmark_cache_workers_{timestamp}.json"
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": timestamp, "args": vars(args), "ideal_hit_rate": ideal, "results": results},
+                  f, indent=2)
+    print(f"Reporte JSON: {out_file}")
+
+
+if __name__ == "__main__":
+    main()
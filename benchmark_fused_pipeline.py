@@ -0,0 +1,196 @@
+"""
+Comparativa lado a lado: pipeline de dos fases vs modo fusionado.
+
+Para cada requerimiento del dataset ejecuta ambos modos de api_server.py
+contra Ollama (en proceso, sin caché) y mide:
+    - latencia end-to-end
+    - llamadas a Ollama y tokens (prompt evaluado + generados)
+    - equivalencia de la salida: tipo, equipos y comandos por equipo
+
+Uso:
+    python benchmark_fused_pipeline.py --sample 20
+    python benchmark_fused_pipeline.py --dataset dataset.csv --network-state-dir snapshot/configs
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Sin caché ni tareas de fondo: cada modo tiene que pagar su generación completa
+os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+os.environ.setdefault("MODEL_RESIDENCY_CHECK_INTERVAL", "0")
+os.environ.setdefault("BACKEND_HEALTH_INTERVAL", "0")
+
+import api_server
+from fastapi import HTTPException
+
+
+MODES = ("two_phase", "fused")
+
+
+def load_requirements(dataset: str, sample: int, seed: int) -> list:
+    with open(dataset, encoding="utf-8", errors="replace") as f:
+        rows = [r["requirement"] for r in csv.DictReader(f) if r.get("requirement")]
+    if sample and sample < len(rows):
+        rows = random.Random(seed).sample(rows, sample)
+    return rows
+
+
+def load_network_state(directory: str) -> str:
+    if not directory:
+        return ""
+    parts = []
+    for path in sorted(Path(directory).glob("*.cfg")):
+        parts.append(f"# {path.stem}\n{path.read_text(encoding='utf-8').strip()}")
+    return "\n\n".join(parts)
+
+
+def parse_device_blocks(config: str) -> dict:
+    """~~~R1~~~ ... -> {"R1": ["cmd", ...]} con líneas normalizadas"""
+    devices = {}
+    current = None
+    for line in config.splitlines():
+        line = " ".join(line.split()).lower()
+        if not line:
+            continue
+        if line.startswith("~~~") and line.endswith("~~~"):
+            current = line.strip("~").strip()
+            devices.setdefault(current, [])
+        elif current is not None:
+            devices[current].append(line)
+    return devices
+
+
+def compare_outputs(a: api_server.ConfigResponse, b: api_server.ConfigResponse) -> dict:
+    blocks_a = parse_device_blocks(a.cisco_config)
+    blocks_b = parse_device_blocks(b.cisco_config)
+    similarities = []
+    for device in set(blocks_a) | set(blocks_b):
+        cmds_a, cmds_b = set(blocks_a.get(device, [])), set(blocks_b.get(device, []))
+        union = cmds_a | cmds_b
+        similarities.append(len(cmds_a & cmds_b) / len(union) if union else 1.0)
+    return {
+        "same_type": a.classification_type == b.classification_type,
+        "same_devices": set(blocks_a) == set(blocks_b),
+        "exact_config": blocks_a == blocks_b,
+        "command_jaccard": round(statistics.mean(similarities), 4) if similarities else 1.0,
+    }
+
+
+async def run_one(requirement: str, network_state: str, mode: str) -> dict:
+    usage = api_server.start_usage_tracking()
+    t0 = time.perf_counter()
+    try:
+        response = await api_server.run_pipeline(
+            api_server.ConfigRequest(requirement=requirement, network_state=network_state), mode
+        )
+        error = None
+    except HTTPException as e:
+        response, error = None, e.detail
+    return {
+        "latency_s": round(time.perf_counter() - t0, 3),
+        "calls": usage["calls"],
+        "prompt_tokens": usage["prompt_tokens"],
+        "eval_tokens": usage["eval_tokens"],
+        "total_tokens": usage["prompt_tokens"] + usage["eval_tokens"],
+        "error": error,
+        "response": response,
+    }
+
+
+def summarize(rows: list, mode: str) -> dict:
+    ok = [r[mode] for r in rows if r[mode]["error"] is None]
+    if not ok:
+        return {"ok": 0, "errors": len(rows)}
+    latencies = sorted(r["latency_s"] for r in ok)
+    return {
+        "ok": len(ok),
+        "errors": len(rows) - len(ok),
+        "latency_mean_s": round(statistics.mean(latencies), 3),
+        "latency_p50_s": latencies[len(latencies) // 2],
+        "latency_max_s": latencies[-1],
+        "prompt_tokens_mean": round(statistics.mean(r["prompt_tokens"] for r in ok), 1),
+        "eval_tokens_mean": round(statistics.mean(r["eval_tokens"] for r in ok), 1),
+        "total_tokens_mean": round(statistics.mean(r["total_tokens"] for r in ok), 1),
+        "calls_mean": round(statistics.mean(r["calls"] for r in ok), 2),
+    }
+
+
+async def run_benchmark(requirements: list, network_state: str) -> list:
+    rows = []
+    async with api_server.lifespan(api_server.app):
+        for i, requirement in enumerate(requirements):
+            # Alternar el orden para no favorecer a un modo con el estado de la KV-cache
+            order = MODES if i % 2 == 0 else tuple(reversed(MODES))
+            row = {"requirement": requirement}
+            for mode in order:
+                row[mode] = await run_one(requirement, network_state, mode)
+            if row["two_phase"]["response"] and row["fused"]["response"]:
+                row["equivalence"] = compare_outputs(row["two_phase"]["response"], row["fused"]["response"])
+            else:
+                row["equivalence"] = None
+
+            tp, fu = row["two_phase"], row["fused"]
+            print(f"[{i + 1}/{len(requirements)}] two_phase {tp['latency_s']}s/{tp['total_tokens']} tok  |  "
+                  f"fused {fu['latency_s']}s/{fu['total_tokens']} tok  |  {row['equivalence']}")
+            rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compara latencia, tokens y equivalencia de salida: dos fases vs modo fusionado."
+    )
+    parser.add_argument("--dataset", default="dataset_v2.csv", help="CSV con columna 'requirement'")
+    parser.add_argument("--sample", type=int, default=20, help="Requerimientos a evaluar (0 = todos)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--network-state-dir", default="", help="Directorio con *.cfg a enviar como network_state")
+    args = parser.parse_args()
+
+    requirements = load_requirements(args.dataset, args.sample, args.seed)
+    network_state = load_network_state(args.network_state_dir)
+
+    print("=" * 80)
+    print("BENCHMARK two_phase vs fused")
+    print(f"Modelo: {api_server.MODEL_ID}  |  Backends: {api_server.OLLAMA_BACKENDS}")
+    print(f"Requerimientos: {len(requirements)}  |  network_state: {len(network_state)} chars")
+    print("=" * 80)
+
+    rows = asyncio.run(run_benchmark(requirements, network_state))
+
+    compared = [r["equivalence"] for r in rows if r["equivalence"]]
+    summary = {mode: summarize(rows, mode) for mode in MODES}
+    if compared:
+        summary["equivalence"] = {
+            "compared": len(compared),
+            "same_type_rate": round(sum(c["same_type"] for c in compared) / len(compared), 4),
+            "same_devices_rate": round(sum(c["same_devices"] for c in compared) / len(compared), 4),
+            "exact_config_rate": round(sum(c["exact_config"] for c in compared) / len(compared), 4),
+            "command_jaccard_mean": round(statistics.mean(c["command_jaccard"] for c in compared), 4),
+        }
+
+    print("\n" + "=" * 80)
+    print(json.dumps(summary, indent=2))
+
+    for row in rows:
+        for mode in MODES:
+            response = row[mode].pop("response")
+            row[mode]["output"] = response.model_dump() if response else None
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    out_file = f"benchmark_fused_pipeline_{timestamp}.json"
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": timestamp, "model": api_server.MODEL_ID, "summary": summary, "rows": rows},
+                  f, indent=2, ensure_ascii=False)
+    print(f"Reporte JSON: {out_file}")
+
+
+if __name__ == "__main__":
+    main()
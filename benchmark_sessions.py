@@ -0,0 +1,119 @@
+"""
+Sesiones de topología: prompt_eval_count de la fase 2 con y sin sesión.
+
+Para cada requerimiento del dataset obtiene los pasos (fase 1) y genera la
+configuración dos veces contra Ollama (en proceso, sin caché):
+    - sin sesión: la topología va dentro del prompt en cada llamada
+    - con sesión: la topología se evaluó una vez en POST /sessions y la
+      llamada solo reenvía el context de Ollama
+
+Uso:
+    python benchmark_sessions.py --network-state-dir snapshot/configs --sample 10
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime
+
+from benchmark_fused_pipeline import load_network_state, load_requirements
+
+import api_server
+
+
+async def run_phase2(requirement: str, steps: list, network_state: str, session=None) -> dict:
+    usage = api_server.start_usage_tracking()
+    t0 = time.perf_counter()
+    config = await api_server.generate_cisco_config(requirement, steps, network_state, session)
+    return {
+        "latency_s": round(time.perf_counter() - t0, 3),
+        "prompt_eval_count": usage["prompt_tokens"],
+        "eval_count": usage["eval_tokens"],
+        "ok": bool(config),
+    }
+
+
+async def run_benchmark(requirements: list, network_state: str) -> dict:
+    rows = []
+    async with api_server.lifespan(api_server.app):
+        t0 = time.perf_counter()
+        session = await api_server.create_topology_session(network_state)
+        session_setup_s = round(time.perf_counter() - t0, 3)
+        print(f"Sesión {session.session_id}: topología evaluada una vez "
+              f"({session.prime_prompt_eval_count} tokens, {session_setup_s}s)")
+
+        for i, requirement in enumerate(requirements):
+            classification = await api_server.run_inference(requirement)
+            if not api_server.is_valid_classification(classification):
+                print(f"[{i + 1}/{len(requirements)}] fase 1 sin JSON válido, se omite")
+                continue
+            steps = classification["steps"]
+            row = {
+                "requirement": requirement,
+                "without_session": await run_phase2(requirement, steps, network_state),
+                "with_session": await run_phase2(requirement, steps, "", session),
+            }
+            print(f"[{i + 1}/{len(requirements)}] prompt_eval_count "
+                  f"sin sesión {row['without_session']['prompt_eval_count']}  |  "
+                  f"con sesión {row['with_session']['prompt_eval_count']}")
+            rows.append(row)
+    return {"session": session.stats(), "session_setup_s": session_setup_s, "rows": rows}
+
+
+def summarize(rows: list, variant: str) -> dict:
+    values = [r[variant] for r in rows]
+    if not values:
+        return {}
+    return {
+        "prompt_eval_count_mean": round(statistics.mean(v["prompt_eval_count"] for v in values), 1),
+        "latency_mean_s": round(statistics.mean(v["latency_s"] for v in values), 3),
+        "ok": sum(v["ok"] for v in values),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compara el prompt_eval_count de la fase 2 con y sin sesión de topología."
+    )
+    parser.add_argument("--dataset", default="dataset_v2.csv", help="CSV con columna 'requirement'")
+    parser.add_argument("--sample", type=int, default=10, help="Requerimientos a evaluar (0 = todos)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--network-state-dir", default="snapshot/configs",
+                        help="Directorio con *.cfg que forman la topología de la sesión")
+    args = parser.parse_args()
+
+    requirements = load_requirements(args.dataset, args.sample, args.seed)
+    network_state = load_network_state(args.network_state_dir)
+    if not network_state:
+        parser.error("--network-state-dir no contiene archivos *.cfg")
+
+    print("=" * 80)
+    print("BENCHMARK sesiones de topología")
+    print(f"Modelo: {api_server.MODEL_ID}  |  Backends: {api_server.OLLAMA_BACKENDS}")
+    print(f"Requerimientos: {len(requirements)}  |  network_state: {len(network_state)} chars")
+    print("=" * 80)
+
+    result = asyncio.run(run_benchmark(requirements, network_state))
+    rows = result["rows"]
+    summary = {
+        "session_prime_prompt_eval_count": result["session"]["prime_prompt_eval_count"],
+        "session_setup_s": result["session_setup_s"],
+        "without_session": summarize(rows, "without_session"),
+        "with_session": summarize(rows, "with_session"),
+    }
+
+    print("\n" + "=" * 80)
+    print(json.dumps(summary, indent=2))
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    out_file = f"benchmark_sessions_{timestamp}.json"
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": timestamp, "model": api_server.MODEL_ID, "summary": summary, "rows": rows},
+                  f, indent=2, ensure_ascii=False)
+    print(f"Reporte JSON: {out_file}")
+
+
+if __name__ == "__main__":
+    main()
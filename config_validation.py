@@ -0,0 +1,125 @@
+"""
+Validación estática de los bloques ~~~Device~~~ de la fase 2.
+
+Chequeos baratos, sin ejecutar nada contra los equipos:
+    - el equipo existe en network_state
+    - las interfaces físicas que se configuran existen en ese equipo
+    - cada 'configure terminal' se cierra con 'end'
+    - no hay show/debug dentro del modo de configuración
+
+network_state puede ser la running-config de cada equipo (hostname +
+interface ...) o texto libre. Lo que no se puede saber a partir de él no
+se chequea: sin topología no se valida el equipo, y sin las interfaces de
+un equipo no se validan sus interfaces. En texto libre un equipo solo se
+rechaza si la topología nombra equipos (R1, SW2, ...) y él no aparece en
+ningún lado. Las interfaces lógicas (Loopback,
+Tunnel, Vlan, ...) se crean al configurarlas y tampoco se validan.
+"""
+
+import re
+from typing import Optional
+
+from device_blocks import DEVICE_NAME
+
+
+PHYSICAL_INTERFACES = ("ethernet", "fastethernet", "gigabitethernet", "tengigabitethernet", "serial")
+VIRTUAL_INTERFACES = ("loopback", "tunnel", "vlan", "port-channel", "bvi", "dialer", "virtual-template", "null")
+
+HOSTNAME = re.compile(r"^hostname\s+(\S+)", re.IGNORECASE)
+INTERFACE = re.compile(r"^interface\s+([A-Za-z-]+)\s*(\d[\d/:.]*)", re.IGNORECASE)
+CONFIGURE_TERMINAL = re.compile(r"^conf\w*\s+t\w*$", re.IGNORECASE)
+EXEC_ONLY = re.compile(r"^(?:show|sh|debug|undebug)\s", re.IGNORECASE)
+
+
+def canonical_interface(kind: str, number: str) -> Optional[str]:
+    """
+    "Gi0/1" -> "gigabitethernet0/1". None si no es una interfaz física o el
+    tipo es ambiguo. Las subinterfaces se validan por su interfaz padre.
+    """
+    kind = kind.lower()
+    candidates = [name for name in PHYSICAL_INTERFACES + VIRTUAL_INTERFACES if name.startswith(kind)]
+    if len(candidates) != 1 or candidates[0] not in PHYSICAL_INTERFACES:
+        return None
+    return f"{candidates[0]}{number.split('.')[0]}"
+
+
+class NetworkInventory:
+    """Equipos e interfaces que se conocen a partir de network_state"""
+
+    def __init__(self, network_state: str = ""):
+        # hostname en minúsculas -> interfaces canónicas (vacío = no se conocen)
+        self.devices = {}
+        self.text = network_state or ""
+        current = None
+        for line in self.text.splitlines():
+            line = line.strip()
+            if line.startswith("#"):
+                # Encabezado de archivo (load_network_state): el siguiente hostname dirá de quién es
+                current = None
+                continue
+            match = HOSTNAME.match(line)
+            if match:
+                current = self.devices.setdefault(match.group(1).lower(), set())
+                continue
+            match = INTERFACE.match(line)
+            if match and current is not None:
+                name = canonical_interface(*match.groups())
+                if name is not None:
+                    current.add(name)
+
+    def has_device(self, device: str) -> Optional[bool]:
+        """
+        True/False si network_state permite saberlo; None si no (sin topología,
+        o texto libre que no nombra equipos)
+        """
+        if self.devices:
+            return device.lower() in self.devices
+        if re.search(rf"(?<![\w-]){re.escape(device)}(?![\w-])", self.text, re.IGNORECASE):
+            return True
+        return False if DEVICE_NAME.search(self.text) else None
+
+    def interfaces(self, device: str) -> set:
+        return self.devices.get(device.lower(), set())
+
+
+def validate_block(block: dict, inventory: NetworkInventory) -> list:
+    """Problemas del bloque {"device", "commands"}; lista vacía si pasa todos los chequeos"""
+    device = block["device"]
+    issues = []
+    if inventory.has_device(device) is False:
+        issues.append(f"device {device} does not exist in the network state")
+    known_interfaces = inventory.interfaces(device)
+
+    in_config = False
+    for command in block["commands"]:
+        command = " ".join(command.split())
+        if CONFIGURE_TERMINAL.match(command):
+            if in_config:
+                issues.append("'configure terminal' repeated before 'end'")
+            in_config = True
+        elif command.lower() == "end":
+            if not in_config:
+                issues.append("'end' without a matching 'configure terminal'")
+            in_config = False
+        elif EXEC_ONLY.match(command):
+            if in_config:
+                issues.append(f"'{command}' inside configuration mode (show/debug must run outside it)")
+        else:
+            match = INTERFACE.match(command)
+            if match and known_interfaces:
+                name = canonical_interface(*match.groups())
+                if name is not None and name not in known_interfaces:
+                    issues.append(f"interface {match.group(1)}{match.group(2)} does not exist on {device}")
+    if in_config:
+        issues.append("'configure terminal' without a closing 'end'")
+    return issues
+
+
+def validate_config(blocks: list, inventory: NetworkInventory) -> dict:
+    """{índice del bloque: problemas} solo para los bloques inválidos"""
+    invalid = {}
+    for block in blocks:
+        issues = validate_block(block, inventory)
+        if issues:
+            invalid[block["index"]] = issues
+    return invalid
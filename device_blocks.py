@@ -0,0 +1,125 @@
+"""
+Parser incremental de la configuración Cisco agrupada por dispositivo.
+
+generate_cisco_config devuelve un solo texto con separadores ~~~<device>~~~.
+DeviceBlockParser recibe los tokens a medida que Ollama los produce y
+entrega cada bloque {"device": ..., "commands": [...]} en cuanto queda
+cerrado, es decir, cuando aparece el siguiente separador o termina el
+stream. Así la automatización puede aplicar la config de R1 mientras la de
+R2 todavía se está generando.
+
+Uso:
+    parser = DeviceBlockParser()
+    for token in tokens:
+        for block in parser.feed(token):
+            ...
+    for block in parser.finish():
+        ...
+"""
+
+import re
+from typing import Optional
+
+
+DEVICE_SEPARATOR = re.compile(r"^~~~\s*(.+?)\s*~~~$")
+
+# Sin topología, solo cuentan los nombres con forma de equipo: prefijo de router,
+# switch, firewall o rol de red seguido de un número (R1, SW2, ASA-1, Core3, PE10).
+# Tokens como IKEv2, AES256 o Group14 no tienen esa forma.
+DEVICE_NAME = re.compile(
+    r"\b((?:R|RT|Router|S|SW|Switch|MLS|L3SW|FW|Firewall|ASA|Core|Dist|Access|Edge|"
+    r"PE|CE|ISP|Hub|Spoke|Branch|HQ|BR|WLC|AP|Server|Host|PC)-?\d{1,3})\b(?![/.:\d])",
+    re.IGNORECASE
+)
+HOSTNAME = re.compile(r"^\s*hostname\s+(\S+)", re.IGNORECASE | re.MULTILINE)
+WORD = re.compile(r"\b[A-Za-z][\w-]*\b")
+
+
+class DeviceBlockParser:
+    def __init__(self):
+        self._pending = ""
+        self._device: Optional[str] = None
+        self._commands = []
+        self.blocks_emitted = 0
+        # Texto fuera de cualquier bloque (<INSUFFICIENT_DATA ...>, <No Configuration Requirements>)
+        self.preamble = []
+
+    def feed(self, token: str) -> list:
+        """Agrega un token; retorna los bloques que quedaron completos con él"""
+        self._pending += token
+        *lines, self._pending = self._pending.split("\n")
+        completed = []
+        for line in lines:
+            block = self._consume_line(line)
+            if block is not None:
+                completed.append(block)
+        return completed
+
+    def finish(self) -> list:
+        """Fin del stream: procesa la última línea y cierra el bloque abierto"""
+        completed = []
+        if self._pending:
+            block = self._consume_line(self._pending)
+            self._pending = ""
+            if block is not None:
+                completed.append(block)
+        block = self._close_block()
+        if block is not None:
+            completed.append(block)
+        return completed
+
+    def _consume_line(self, line: str) -> Optional[dict]:
+        line = line.strip()
+        if not line or line.startswith("```"):
+            return None
+        match = DEVICE_SEPARATOR.match(line)
+        if match:
+            block = self._close_block()
+            self._device = match.group(1)
+            return block
+        if self._device is None:
+            self.preamble.append(line)
+        else:
+            self._commands.append(line)
+        return None
+
+    def _close_block(self) -> Optional[dict]:
+        if self._device is None:
+            return None
+        block = {"index": self.blocks_emitted, "device": self._device, "commands": self._commands}
+        self._device = None
+        self._commands = []
+        self.blocks_emitted += 1
+        return block
+
+
+def known_devices(network_state: str) -> set:
+    """Equipos de network_state según sus líneas hostname (en minúsculas); vacío si es texto libre"""
+    return {name.lower() for name in HOSTNAME.findall(network_state or "")}
+
+
+def devices_in_steps(steps: list, known: frozenset = frozenset()) -> list:
+    """
+    Equipos nombrados en los pasos, en orden de aparición y sin repetir
+    (R1 y r1 son el mismo; queda la primera grafía). Con `known` (equipos
+    de la topología) solo cuentan esos, tengan la forma que tengan; sin
+    ella, los nombres con forma de equipo.
+    """
+    devices = []
+    seen = set()
+    for step in steps:
+        if known:
+            names = [w for w in WORD.findall(str(step)) if w.lower() in known]
+        else:
+            names = DEVICE_NAME.findall(str(step))
+        for name in names:
+            if name.casefold() not in seen:
+                seen.add(name.casefold())
+                devices.append(name)
+    return devices
+
+
+def parse_device_blocks(config: str) -> list:
+    """Config completa -> [{"index", "device", "commands"}, ...] (inverso de format_device_blocks)"""
+    parser = DeviceBlockParser()
+    return parser.feed(config) + parser.finish()
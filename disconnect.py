@@ -0,0 +1,115 @@
+"""
+Cancelación de requests cuyo cliente se desconectó (middleware ASGI).
+
+FastAPI no cancela un handler normal cuando el cliente cierra la conexión:
+el pipeline seguiría esperando a Ollama y generando hasta dos respuestas
+que nadie va a leer. Este middleware lee el cuerpo del request, corre la
+aplicación en una tarea aparte y escucha http.disconnect; si llega antes
+de empezar la respuesta, cancela la tarea. La cancelación se propaga hasta
+ollama_post, que cierra la conexión con Ollama y así deja de generar.
+
+Con la respuesta ya empezada (SSE, NDJSON) el disconnect se entrega a la
+aplicación por receive(), como sin middleware, y StreamingResponse cancela
+el generador.
+"""
+
+import asyncio
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+
+_client_gone: ContextVar[Optional[asyncio.Event]] = ContextVar("client_gone", default=None)
+
+
+class ClientDisconnected(Exception):
+    """El cliente ya no espera la respuesta: no tiene sentido seguir"""
+
+
+def client_disconnected() -> bool:
+    event = _client_gone.get()
+    return event is not None and event.is_set()
+
+
+def raise_if_client_gone():
+    """Punto de control entre fases: corta antes de lanzar otra generación"""
+    if client_disconnected():
+        raise ClientDisconnected()
+
+
+class CancelOnDisconnectMiddleware:
+    def __init__(self, app, on_disconnect: Optional[Callable[[str, str], None]] = None):
+        """
+        Args:
+            on_disconnect: callback(path, stage) con stage "before_response"
+                           (handler cancelado) o "streaming" (respuesta a medias)
+        """
+        self.app = app
+        self.on_disconnect = on_disconnect
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Se lee el cuerpo completo para que después receive() solo espere el disconnect
+        body_messages = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                self._notify(scope, "before_response")
+                return
+            body_messages.append(message)
+            if not message.get("more_body", False):
+                break
+
+        gone = asyncio.Event()
+        state = {"started": False, "finished": False}
+
+        async def replay_receive():
+            if body_messages:
+                return body_messages.pop(0)
+            await gone.wait()
+            return {"type": "http.disconnect"}
+
+        async def tracked_send(message):
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["finished"] = True
+            await send(message)
+
+        token = _client_gone.set(gone)
+        try:
+            app_task = asyncio.ensure_future(self.app(scope, replay_receive, tracked_send))
+        finally:
+            _client_gone.reset(token)
+        watcher = asyncio.ensure_future(self._watch(receive, gone))
+        try:
+            await asyncio.wait({app_task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if gone.is_set() and not state["finished"]:
+                if not state["started"]:
+                    app_task.cancel()
+                    self._notify(scope, "before_response")
+                else:
+                    self._notify(scope, "streaming")
+            try:
+                await app_task
+            except asyncio.CancelledError:
+                if not gone.is_set():
+                    raise
+        finally:
+            watcher.cancel()
+            if not app_task.done():
+                app_task.cancel()
+
+    @staticmethod
+    async def _watch(receive, gone: asyncio.Event):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                gone.set()
+                return
+
+    def _notify(self, scope, stage: str):
+        if self.on_disconnect is not None:
+            self.on_disconnect(scope.get("path", ""), stage)
@@ -0,0 +1,299 @@
+"""
+Ollama falso y determinista para pruebas de carga sin GPU.
+
+Implementa /api/generate (streaming y no streaming), /api/embed, /api/tags y /api/ps con:
+    - latencia de evaluación del prompt por token y latencia por token generado
+    - capacidad limitada como la de OLLAMA_NUM_PARALLEL (--parallel)
+    - respuestas fijas para la fase 1, la fase 2 y el modo fusionado
+    - inyección de errores (status HTTP o corte del stream) con semilla fija
+
+Uso:
+    python fake_ollama.py --port 11434 --prompt-eval-ms 0.2 --token-ms 20 --parallel 4
+    python fake_ollama.py --error-rate 0.05 --disconnect-rate 0.02 --seed 7
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import zlib
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from device_blocks import parse_device_blocks
+
+
+# Caracteres por token simulado (aproximación habitual para texto en inglés)
+CHARS_PER_TOKEN = 4
+# Dimensión de los embeddings de /api/embed
+EMBEDDING_DIM = 256
+
+DEFAULT_CLASSIFICATION = {
+    "type": "RP",
+    "steps": [
+        "Enable OSPF process on R1",
+        "Enable OSPF process on R2",
+        "Verify OSPF neighbor adjacency between R1 and R2",
+    ],
+}
+DEFAULT_CONFIG = "~~~R1~~~\nconfigure terminal\nrouter ospf 1\nend\n~~~R2~~~\nconfigure terminal\nrouter ospf 1\nend\n"
+DEFAULT_FUSED = {
+    **DEFAULT_CLASSIFICATION,
+    "config": [
+        {"device": "R1", "commands": ["configure terminal", "router ospf 1", "end"]},
+        {"device": "R2", "commands": ["configure terminal", "router ospf 1", "end"]},
+    ],
+    "note": "",
+}
+
+
+class FakeOllamaConfig:
+    def __init__(self, call_latency: float = 0.0, prompt_eval_latency: float = 0.0,
+                 token_latency: float = 0.0, load_latency: float = 0.0, parallel: int = 0,
+                 error_rate: float = 0.0, error_status: int = 500, disconnect_rate: float = 0.0,
+                 trailing_tokens: int = 0, seed: int = 0,
+                 classification: Optional[dict] = None, config: Optional[str] = None,
+                 fused: Optional[dict] = None, repair: Optional[str] = None):
+        """
+        Args:
+            call_latency: segundos fijos por llamada (repartidos entre los tokens al hacer streaming)
+            prompt_eval_latency: segundos por token de prompt evaluado
+            token_latency: segundos por token generado
+            load_latency: segundos de la primera carga de cada modelo
+            parallel: generaciones simultáneas (0 = sin límite); el resto espera turno
+            error_rate: fracción de llamadas que responden `error_status`
+            disconnect_rate: fracción de streams que se cortan a mitad
+            trailing_tokens: tokens de espacios tras el JSON de la fase 1 (salida descontrolada de format=json)
+            seed: semilla de la inyección de errores
+            repair: config para los prompts de reparación de un bloque (por defecto `config`)
+        """
+        self.call_latency = call_latency
+        self.prompt_eval_latency = prompt_eval_latency
+        self.token_latency = token_latency
+        self.load_latency = load_latency
+        self.parallel = parallel
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.disconnect_rate = disconnect_rate
+        self.trailing_tokens = trailing_tokens
+        self.seed = seed
+        self.classification = classification or DEFAULT_CLASSIFICATION
+        self.config = config or DEFAULT_CONFIG
+        self.fused = fused or DEFAULT_FUSED
+        self.repair = repair or self.config
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def split_tokens(text: str) -> list:
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)] or [""]
+
+
+def canned_response(config: FakeOllamaConfig, prompt: str) -> str:
+    """Respuesta según la fase que reconoce el prompt de api_server.py"""
+    if "TASK 3" in prompt:
+        return json.dumps(config.fused)
+    if "has already been classified as" in prompt:
+        # Fase 1 con el tipo resuelto por el clasificador local: solo los pasos
+        return json.dumps({"steps": config.classification.get("steps", [])}) + " \n" * config.trailing_tokens
+    if "TASK 1" in prompt:
+        return json.dumps(config.classification) + " \n" * config.trailing_tokens
+    target = re.search(r"^TARGET DEVICE: (\S+)$", prompt, re.MULTILINE)
+    if target:
+        # Fase 2 por equipo o reparación de un bloque: solo el bloque pedido
+        source = config.repair if "were rejected" in prompt else config.config
+        blocks = [b for b in parse_device_blocks(source) if b["device"] == target.group(1)]
+        return "\n".join(f"~~~{b['device']}~~~\n" + "\n".join(b["commands"]) for b in blocks) + "\n"
+    return config.config
+
+
+def bag_of_words_embedding(text: str, dim: int = EMBEDDING_DIM) -> list:
+    vector = [0.0] * dim
+    for word in text.lower().split():
+        word = word.strip(".,;:'\"()")
+        if word:
+            vector[zlib.crc32(word.encode("utf-8")) % dim] += 1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def build_fake_ollama(config: FakeOllamaConfig) -> FastAPI:
+    fake = FastAPI(title="Fake Ollama")
+    rng = random.Random(config.seed)
+    capacity = asyncio.Semaphore(config.parallel) if config.parallel > 0 else None
+    loaded = set()
+    stats = {"requests": 0, "errors": 0, "disconnects": 0, "cancelled": 0}
+
+    async def ensure_loaded(model: str) -> float:
+        if model in loaded:
+            return 0.0
+        loaded.add(model)
+        await asyncio.sleep(config.load_latency)
+        return config.load_latency
+
+    def timings(prompt_tokens: int, eval_tokens: int, load_s: float, wait_s: float) -> dict:
+        prompt_s = config.prompt_eval_latency * prompt_tokens
+        eval_s = config.token_latency * eval_tokens + config.call_latency
+        return {
+            "total_duration": int((load_s + wait_s + prompt_s + eval_s) * 1e9),
+            "load_duration": int(load_s * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_s * 1e9),
+            "eval_count": eval_tokens,
+            "eval_duration": int(eval_s * 1e9),
+        }
+
+    async def acquire_capacity() -> float:
+        loop = asyncio.get_running_loop()
+        queued = loop.time()
+        if capacity is not None:
+            await capacity.acquire()
+        return loop.time() - queued
+
+    def release_capacity():
+        if capacity is not None:
+            capacity.release()
+
+    @fake.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        model = body.get("model")
+        stats["requests"] += 1
+        if rng.random() < config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": "injected failure"}, status_code=config.error_status)
+
+        if "prompt" not in body:
+            # Request sin prompt: Ollama solo carga el modelo
+            load_s = await ensure_loaded(model)
+            return {"model": model, "response": "", "done": True, "load_duration": int(load_s * 1e9)}
+
+        prompt = body["prompt"]
+        text = canned_response(config, prompt)
+        tokens = split_tokens(text)
+        prompt_tokens = count_tokens(prompt)
+        options = body.get("options") or {}
+        if options.get("num_predict"):
+            tokens = tokens[:options["num_predict"]]
+        # context: tokens previos + prompt + respuesta, como lo devuelve Ollama
+        context = list(body.get("context") or []) + list(range(prompt_tokens + len(tokens)))
+        disconnect_at = rng.randrange(len(tokens)) if rng.random() < config.disconnect_rate else None
+
+        if not body.get("stream", True):
+            wait_s = await acquire_capacity()
+            try:
+                load_s = await ensure_loaded(model)
+                await asyncio.sleep(config.prompt_eval_latency * prompt_tokens
+                                    + config.token_latency * len(tokens) + config.call_latency)
+            finally:
+                release_capacity()
+            return {"model": model, "response": "".join(tokens), "done": True, "context": context,
+                    **timings(prompt_tokens, len(tokens), load_s, wait_s)}
+
+        async def chunks():
+            wait_s = await acquire_capacity()
+            try:
+                load_s = await ensure_loaded(model)
+                await asyncio.sleep(config.prompt_eval_latency * prompt_tokens)
+                per_token = config.token_latency + config.call_latency / len(tokens)
+                for i, token in enumerate(tokens):
+                    await asyncio.sleep(per_token)
+                    if i == disconnect_at:
+                        stats["disconnects"] += 1
+                        raise ConnectionResetError("injected disconnect")
+                    yield json.dumps({"model": model, "response": token, "done": False}) + "\n"
+                final = {"model": model, "response": "", "done": True, "context": context}
+                final.update(timings(prompt_tokens, len(tokens), load_s, wait_s))
+                yield json.dumps(final) + "\n"
+            except asyncio.CancelledError:
+                # El cliente cerró la conexión: como Ollama, se deja de generar
+                stats["cancelled"] += 1
+                raise
+            finally:
+                release_capacity()
+
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    @fake.post("/api/embed")
+    async def embed(request: Request):
+        # Bolsa de palabras con hashing: las paráfrasis que comparten palabras quedan cerca
+        body = await request.json()
+        inputs = body.get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        stats["requests"] += 1
+        await asyncio.sleep(config.call_latency)
+        return {"model": body.get("model"), "embeddings": [bag_of_words_embedding(text) for text in inputs]}
+
+    @fake.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": m, "model": m} for m in sorted(loaded)]}
+
+    @fake.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": m, "model": m} for m in sorted(loaded)]}
+
+    @fake.get("/fake/stats")
+    async def fake_stats():
+        return dict(stats)
+
+    return fake
+
+
+def load_responses(path: str) -> dict:
+    """JSON con claves opcionales classification, config, fused y repair"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {k: data[k] for k in ("classification", "config", "fused", "repair") if k in data}
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--call-latency", type=float, default=0.0, help="Segundos fijos por llamada")
+    parser.add_argument("--prompt-eval-ms", type=float, default=0.0, help="ms por token de prompt")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="ms por token generado")
+    parser.add_argument("--load-latency", type=float, default=0.0, help="Segundos de la primera carga del modelo")
+    parser.add_argument("--parallel", type=int, default=0, help="Generaciones simultáneas (0 = sin límite)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0)
+    parser.add_argument("--trailing-tokens", type=int, default=0,
+                        help="Tokens de espacios tras el JSON de la fase 1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--responses", default="", help="JSON con classification/config/fused/repair a devolver")
+
+
+def config_from_args(args) -> FakeOllamaConfig:
+    return FakeOllamaConfig(
+        call_latency=args.call_latency,
+        prompt_eval_latency=args.prompt_eval_ms / 1000,
+        token_latency=args.token_ms / 1000,
+        load_latency=args.load_latency,
+        parallel=args.parallel,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        disconnect_rate=args.disconnect_rate,
+        trailing_tokens=args.trailing_tokens,
+        seed=args.seed,
+        **(load_responses(args.responses) if args.responses else {}),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama falso para pruebas de carga de api_server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    import uvicorn
+    print(f"🧪 Ollama falso en http://{args.host}:{args.port}")
+    uvicorn.run(build_fake_ollama(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Clasificador local de la fase 1 (TASK 1) para api_server.py.
+
+Predice CP/RP/ACL/TN en el proceso, en menos de un milisegundo, con un
+modelo de centroides sobre n-gramas de caracteres (hashing, sin
+vocabulario). Cuando la predicción es confiable la llamada a Ollama solo
+genera los pasos; si no, se usa el prompt completo y la etiqueta que
+devuelve el LLM entrena el modelo.
+
+Las etiquetas de los CSV del repo (ROUTING, SECURITY, ...) son otra
+taxonomía, así que el historial etiquetado es el del propio LLM. La
+confianza no se da por buena: antes de aprender cada etiqueta del LLM se
+predice en sombra y solo se atajan requests mientras la precisión de las
+predicciones por encima del umbral se mantiene. Una fracción de los
+requests confiables se sigue auditando con el LLM para que esa medida no
+quede congelada.
+"""
+
+import csv
+import json
+import math
+import os
+import random
+import threading
+import zlib
+from collections import deque
+from typing import Optional
+
+
+class FastClassifier:
+    def __init__(self, path: str, labels: tuple = ("CP", "RP", "ACL", "TN"), threshold: float = 0.8,
+                 min_examples: int = 50, min_accuracy: float = 0.95, min_shadow: int = 50,
+                 audit_rate: float = 0.05, max_examples: int = 5000, shadow_window: int = 500,
+                 ngram_range: tuple = (3, 5), dim: int = 1 << 18, temperature: float = 0.02,
+                 save_every: int = 20):
+        """
+        Args:
+            path: archivo JSON con ejemplos y resultados en sombra ("" = solo en memoria)
+            threshold: confianza mínima para saltarse la clasificación del LLM
+            min_examples: ejemplos antes de empezar a predecir
+            min_accuracy: precisión en sombra exigida a las predicciones sobre el umbral
+            min_shadow: predicciones en sombra sobre el umbral antes de confiar
+            audit_rate: fracción de predicciones confiables que igual pasan por el LLM
+            max_examples: al superarlo se olvidan los ejemplos más viejos
+            temperature: softmax de las similitudes coseno (menor = más contraste)
+        """
+        self.path = path
+        self.labels = tuple(labels)
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.min_accuracy = min_accuracy
+        self.min_shadow = min_shadow
+        self.audit_rate = audit_rate
+        self.max_examples = max_examples
+        self.ngram_range = ngram_range
+        self.dim = dim
+        self.temperature = temperature
+        self.save_every = save_every
+
+        self._examples = deque()
+        # Suma de vectores por etiqueta y su norma al cuadrado (coseno contra el centroide)
+        self._sums = {label: {} for label in self.labels}
+        self._sq_norms = {label: 0.0 for label in self.labels}
+        self._counts = {label: 0 for label in self.labels}
+        # (confianza, acierto) de las predicciones en sombra sobre el umbral
+        self._shadow = deque(maxlen=shadow_window)
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self.stats_counters = {"predictions": 0, "used": 0, "audited": 0, "learned": 0}
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._examples)
+
+    def features(self, text: str) -> dict:
+        """n-gramas de caracteres del texto normalizado -> peso (vector unitario)"""
+        text = f" {' '.join(text.lower().split())} "
+        counts = {}
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                f = zlib.crc32(text[i:i + n].encode("utf-8")) % self.dim
+                counts[f] = counts.get(f, 0) + 1
+        norm = math.sqrt(sum(c * c for c in counts.values()))
+        return {f: c / norm for f, c in counts.items()} if norm else {}
+
+    def _update(self, label: str, vector: dict, sign: int):
+        sums = self._sums[label]
+        dot = sum(sums.get(f, 0.0) * w for f, w in vector.items())
+        # |S ± v|² = |S|² ± 2 S·v + |v|²  (|v| = 1)
+        self._sq_norms[label] = max(0.0, self._sq_norms[label] + sign * 2 * dot + 1.0)
+        for f, w in vector.items():
+            value = sums.get(f, 0.0) + sign * w
+            if abs(value) < 1e-9:
+                sums.pop(f, None)
+            else:
+                sums[f] = value
+        self._counts[label] += sign
+
+    def _predict(self, vector: dict) -> tuple:
+        scores = {}
+        for label in self.labels:
+            if not self._counts[label] or self._sq_norms[label] <= 0:
+                continue
+            sums = self._sums[label]
+            scores[label] = sum(sums.get(f, 0.0) * w for f, w in vector.items()) / math.sqrt(self._sq_norms[label])
+        if not scores:
+            return None, 0.0
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        total = sum(math.exp((s - top) / self.temperature) for s in scores.values())
+        return best, 1.0 / total
+
+    def predict(self, text: str) -> tuple:
+        """(etiqueta, confianza); (None, 0.0) si todavía no hay ejemplos suficientes"""
+        vector = self.features(text)
+        with self._lock:
+            self.stats_counters["predictions"] += 1
+            if len(self._examples) < self.min_examples or not vector:
+                return None, 0.0
+            return self._predict(vector)
+
+    def trusted(self, confidence: float) -> bool:
+        """La predicción puede reemplazar a la clasificación del LLM"""
+        if confidence < self.threshold:
+            return False
+        with self._lock:
+            if len(self._shadow) < self.min_shadow:
+                return False
+            accuracy = sum(correct for _, correct in self._shadow) / len(self._shadow)
+        return accuracy >= self.min_accuracy
+
+    def should_audit(self) -> bool:
+        """Una predicción confiable igual pasa por el LLM para seguir midiendo la precisión"""
+        audit = random.random() < self.audit_rate
+        if audit:
+            with self._lock:
+                self.stats_counters["audited"] += 1
+        return audit
+
+    def record_used(self):
+        with self._lock:
+            self.stats_counters["used"] += 1
+
+    def learn(self, text: str, label: str) -> Optional[bool]:
+        """
+        Aprende la etiqueta del LLM. Antes la predice en sombra; retorna si
+        acertó (None si no había predicción o quedó bajo el umbral).
+        """
+        if label not in self.labels:
+            return None
+        vector = self.features(text)
+        if not vector:
+            return None
+        with self._lock:
+            correct = None
+            if len(self._examples) >= self.min_examples:
+                predicted, confidence = self._predict(vector)
+                if predicted is not None and confidence >= self.threshold:
+                    correct = predicted == label
+                    self._shadow.append((round(confidence, 4), correct))
+            self._add(text, label, vector)
+            self.stats_counters["learned"] += 1
+            self._dirty += 1
+            save = self.path and self._dirty >= self.save_every
+        if save:
+            self.save()
+        return correct
+
+    def _add(self, text: str, label: str, vector: dict):
+        self._examples.append((text, label))
+        self._update(label, vector, +1)
+        while len(self._examples) > self.max_examples:
+            old_text, old_label = self._examples.popleft()
+            self._update(old_label, self.features(old_text), -1)
+
+    def seed_csv(self, path: str, text_column: str = "requirement", label_column: str = "type") -> int:
+        """Ejemplos iniciales de un CSV ya etiquetado en CP/RP/ACL/TN (no cuentan para la sombra)"""
+        added = 0
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                text = (row.get(text_column) or "").strip()
+                label = (row.get(label_column) or "").strip().upper()
+                if text and label in self.labels:
+                    vector = self.features(text)
+                    if vector:
+                        with self._lock:
+                            self._add(text, label, vector)
+                        added += 1
+        return added
+
+    def save(self):
+        """Reescribe el archivo de respaldo (tmp + rename, nunca queda a medias)"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                "examples": [list(e) for e in self._examples],
+                "shadow": [list(s) for s in self._shadow],
+            }
+            self._dirty = 0
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            for text, label in data.get("examples", []):
+                if label in self.labels:
+                    vector = self.features(text)
+                    if vector:
+                        self._add(text, label, vector)
+            self._shadow.extend((confidence, bool(correct)) for confidence, correct in data.get("shadow", []))
+
+    def close(self):
+        if self._dirty:
+            self.save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            shadow = len(self._shadow)
+            correct = sum(c for _, c in self._shadow)
+            return {
+                "examples": len(self._examples),
+                "per_label": dict(self._counts),
+                "threshold": self.threshold,
+                "min_accuracy": self.min_accuracy,
+                "shadow_samples": shadow,
+                "shadow_accuracy": round(correct / shadow, 4) if shadow else None,
+                "trusted": bool(shadow) and shadow >= self.min_shadow and correct / shadow >= self.min_accuracy,
+                **self.stats_counters,
+            }
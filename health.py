@@ -0,0 +1,204 @@
+"""
+Sondeo de salud en segundo plano para api_server.py.
+
+Cada `interval` segundos HealthProber consulta en cada backend de Ollama:
+  - /api/tags: Ollama responde (también expulsa/readmite el backend del pool)
+  - /api/ps: el modelo actual está cargado en memoria
+  - opcionalmente un canary: generación de 1 token con un prompt mínimo,
+    para medir la latencia real de extremo a extremo
+
+/health responde con el último estado guardado, sin salir del proceso, así
+los load balancers pueden consultarlo seguido sin añadir carga a Ollama.
+"""
+
+import asyncio
+import time
+from typing import Callable, Optional
+
+import aiohttp
+
+from backends import Backend, BackendPool
+
+
+class BackendHealth:
+    def __init__(self, url: str):
+        self.url = url
+        self.reachable: Optional[bool] = None
+        self.model: Optional[str] = None
+        self.model_loaded: Optional[bool] = None
+        self.loaded_models = []
+        self.canary_ok: Optional[bool] = None
+        self.canary_latency_s: Optional[float] = None
+        self.last_canary = 0.0
+        self.last_probe = 0.0
+        self.last_probe_at: Optional[float] = None
+        self.probe_duration_s: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def stats(self, now: float) -> dict:
+        return {
+            "url": self.url,
+            "reachable": self.reachable,
+            "model": self.model,
+            "model_loaded": self.model_loaded,
+            "loaded_models": self.loaded_models,
+            "canary_ok": self.canary_ok,
+            "canary_latency_ms": round(self.canary_latency_s * 1000, 1) if self.canary_latency_s is not None else None,
+            "last_probe_age_s": round(now - self.last_probe, 3) if self.last_probe else None,
+            "probe_duration_ms": round(self.probe_duration_s * 1000, 1) if self.probe_duration_s is not None else None,
+            "error": self.error,
+        }
+
+
+class HealthProber:
+    def __init__(self, pool: BackendPool, interval: float = 10.0, canary_interval: float = 0.0,
+                 canary_prompt: str = "ping", timeout: float = 5.0, canary_timeout: float = 30.0,
+                 keep_alive: Optional[str] = None):
+        """
+        Args:
+            interval: segundos entre sondeos de /api/tags y /api/ps
+            canary_interval: segundos entre canaries (0 = sin canary)
+            keep_alive: keep_alive del canary, para no acortar la residencia del modelo
+        """
+        self.pool = pool
+        self.interval = interval
+        self.canary_interval = canary_interval
+        self.canary_prompt = canary_prompt
+        self.timeout = timeout
+        self.canary_timeout = canary_timeout
+        self.keep_alive = keep_alive
+        # Pasado este tiempo sin sondeo el estado se considera viejo; sin sondeo
+        # en segundo plano (interval=0) siempre lo es y /health sondea en línea
+        self.stale_after = 3 * interval if interval > 0 else 0.0
+        self.states = {b.url: BackendHealth(b.url) for b in pool.backends}
+        self.probes = 0
+
+    @property
+    def last_probe(self) -> float:
+        return min(s.last_probe for s in self.states.values())
+
+    def stale(self, now: Optional[float] = None) -> bool:
+        """Nunca se sondeó, no hay sondeo de fondo o el último es más viejo que stale_after"""
+        now = now if now is not None else time.monotonic()
+        if not self.last_probe or self.stale_after <= 0:
+            return True
+        return now - self.last_probe > self.stale_after
+
+    async def _loaded_models(self, session: aiohttp.ClientSession, backend: Backend) -> Optional[list]:
+        async with session.get(
+            f"{backend.url}/api/ps", timeout=aiohttp.ClientTimeout(total=self.timeout)
+        ) as response:
+            if response.status != 200:
+                return None
+            data = await response.json()
+        names = []
+        for m in data.get("models", []):
+            for name in (m.get("name"), m.get("model")):
+                if name and name not in names:
+                    names.append(name)
+        return names
+
+    async def _canary(self, session: aiohttp.ClientSession, backend: Backend, model: str) -> float:
+        payload = {"model": model, "prompt": self.canary_prompt, "stream": False, "options": {"num_predict": 1}}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        started = time.perf_counter()
+        async with session.post(
+            backend.generate_url, json=payload, timeout=aiohttp.ClientTimeout(total=self.canary_timeout)
+        ) as response:
+            await response.read()
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=response.status,
+                    message="canary falló"
+                )
+        return time.perf_counter() - started
+
+    async def probe_backend(self, session: aiohttp.ClientSession, backend: Backend, model: str):
+        state = self.states[backend.url]
+        started = time.perf_counter()
+        state.model = model
+        state.error = None
+        # pool.probe hace el GET a /api/tags y expulsa o readmite el backend
+        state.reachable = await self.pool.probe(session, backend)
+        if not state.reachable:
+            state.model_loaded = None
+            state.loaded_models = []
+            state.error = "/api/tags no respondió"
+        else:
+            try:
+                loaded = await self._loaded_models(session, backend)
+                state.loaded_models = loaded or []
+                state.model_loaded = model in loaded if loaded is not None else None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                state.model_loaded = None
+                state.error = f"/api/ps: {type(e).__name__}"
+
+            now = time.monotonic()
+            if self.canary_interval > 0 and now - state.last_canary >= self.canary_interval:
+                state.last_canary = now
+                try:
+                    state.canary_latency_s = await self._canary(session, backend, model)
+                    state.canary_ok = True
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    state.canary_ok = False
+                    state.error = f"canary: {type(e).__name__}"
+        state.probe_duration_s = time.perf_counter() - started
+        state.last_probe = time.monotonic()
+        state.last_probe_at = time.time()
+
+    async def probe_all(self, session: aiohttp.ClientSession, model: str):
+        """
+        Sondea los backends sanos y, una vez vencido su backoff, los expulsados
+        para readmitirlos
+        """
+        now = time.monotonic()
+        due = [b for b in self.pool.backends if b.healthy or now >= b.ejected_until]
+        await asyncio.gather(*(self.probe_backend(session, b, model) for b in due))
+        # Los expulsados que aún no toca sondear siguen caídos hasta que venza su backoff
+        for b in self.pool.backends:
+            if b not in due:
+                state = self.states[b.url]
+                state.reachable = False
+                state.model_loaded = None
+                state.loaded_models = []
+                state.error = "expulsado del pool"
+                state.last_probe = time.monotonic()
+        self.probes += 1
+
+    async def run(self, session: aiohttp.ClientSession, current_model: Callable[[], str],
+                  on_probe: Optional[Callable[["HealthProber"], None]] = None):
+        """Tarea de fondo: sondea cada `interval` segundos"""
+        while True:
+            try:
+                await self.probe_all(session, current_model())
+                if on_probe is not None:
+                    on_probe(self)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  Sondeo de salud falló: {e}")
+            await asyncio.sleep(self.interval)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        states = [self.states[b.url] for b in self.pool.backends]
+        reachable = [s.reachable for s in states]
+        if all(reachable):
+            status = {"status": "healthy", "ollama": "connected"}
+        elif any(reachable):
+            status = {"status": "degraded", "ollama": "partially connected"}
+        else:
+            status = {"status": "unhealthy", "ollama": "disconnected"}
+        loaded = [s.model_loaded for s in states if s.reachable]
+        latencies = [s.canary_latency_s for s in states
+                     if s.reachable and s.canary_ok and s.canary_latency_s is not None]
+        return {
+            **status,
+            "model_loaded": all(loaded) if loaded and None not in loaded else None,
+            "canary_latency_ms": round(min(latencies) * 1000, 1) if latencies else None,
+            "last_probe_age_s": round(now - self.last_probe, 3) if self.last_probe else None,
+            "stale": self.stale(now),
+            "probes": self.probes,
+            "probe_backends": [s.stats(now) for s in states],
+        }
@@ -0,0 +1,128 @@
+"""
+Requests cubiertos (hedged requests) para las llamadas de fase a Ollama.
+
+Si la llamada primaria no produjo su primer token dentro del p95 reciente
+del TTFT de esa fase, se lanza un duplicado a otro backend; gana el que
+termine primero y el otro se cancela (al cerrar su conexión Ollama deja de
+generar). Un presupuesto limita los duplicados a una fracción de las
+llamadas recientes, para que un backend lento no duplique todo el tráfico.
+"""
+
+import asyncio
+import math
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+
+class HedgePolicy:
+    def __init__(self, budget: float = 0.05, min_samples: int = 50, window: int = 1000,
+                 min_delay_s: float = 0.05):
+        """
+        Args:
+            budget: fracción máxima de llamadas recientes que pueden cubrirse (0..1)
+            min_samples: TTFT observados por fase antes de empezar a cubrir
+            window: llamadas (y TTFT por fase) que se recuerdan
+            min_delay_s: espera mínima antes de cubrir, aunque el p95 sea menor
+        """
+        self.budget = budget
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay_s = min_delay_s
+        self._ttft = {}
+        # Una entrada por llamada primaria: True si se cubrió
+        self._calls = deque(maxlen=window)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.skipped_budget = 0
+
+    def observe_ttft(self, phase: str, seconds: float):
+        self._ttft.setdefault(phase, deque(maxlen=self.window)).append(seconds)
+
+    def delay(self, phase: str) -> Optional[float]:
+        """p95 reciente del TTFT de la fase; None si aún no hay muestras suficientes"""
+        samples = self._ttft.get(phase)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        values = sorted(samples)
+        p95 = values[max(1, math.ceil(0.95 * len(values))) - 1]
+        return max(self.min_delay_s, p95)
+
+    def start_call(self):
+        self._calls.append(False)
+
+    def acquire(self) -> bool:
+        """Reserva un duplicado si el presupuesto lo permite"""
+        if sum(self._calls) + 1 > self.budget * len(self._calls):
+            self.skipped_budget += 1
+            return False
+        for i in range(len(self._calls) - 1, -1, -1):
+            if not self._calls[i]:
+                self._calls[i] = True
+                break
+        self.hedges += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "budget": self.budget,
+            "recent_calls": len(self._calls),
+            "recent_hedged": sum(self._calls),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "skipped_budget": self.skipped_budget,
+            "delay_s": {phase: self.delay(phase) for phase in self._ttft},
+        }
+
+
+async def _cancel(task: Optional[asyncio.Task]):
+    if task is None or task.done():
+        return
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+
+
+def _succeeded(task: asyncio.Task) -> bool:
+    return not task.cancelled() and task.exception() is None and task.result() is not None
+
+
+async def hedged_call(primary: Callable[[], Awaitable], hedge: Callable[[], Awaitable],
+                      first_token: asyncio.Event, delay: Optional[float],
+                      allow_hedge: Callable[[], bool]) -> tuple:
+    """
+    Corre `primary()`; si `first_token` no se marcó en `delay` segundos y
+    `allow_hedge()` lo permite, corre también `hedge()`. Un resultado None
+    o una excepción no gana mientras el otro siga en curso.
+
+    Retorna (resultado, "primary" | "hedge", hubo_duplicado).
+    """
+    primary_task = asyncio.create_task(primary())
+    hedge_task = None
+    try:
+        if delay is not None:
+            token_wait = asyncio.create_task(first_token.wait())
+            try:
+                await asyncio.wait({primary_task, token_wait}, timeout=delay,
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                token_wait.cancel()
+            if not primary_task.done() and not first_token.is_set() and allow_hedge():
+                hedge_task = asyncio.create_task(hedge())
+
+        if hedge_task is None:
+            return await primary_task, "primary", False
+
+        pending = {primary_task, hedge_task}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if _succeeded(task):
+                    winner = "primary" if task is primary_task else "hedge"
+                    return task.result(), winner, True
+        # Ninguno tuvo éxito: se comporta como la primaria sola
+        return await primary_task, "primary", True
+    finally:
+        await _cancel(primary_task)
+        await _cancel(hedge_task)
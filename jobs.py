@@ -0,0 +1,267 @@
+"""
+Cola de trabajos persistente (SQLite) para el API asíncrono /jobs.
+
+Cada trabajo pasa por queued -> running -> succeeded | failed. Un worker lo
+reclama con una concesión (lease) a nombre de su instancia (una por
+proceso). Mientras el proceso vive, heartbeat() renueva las concesiones de
+sus trabajos, así que un trabajo largo no se reclama dos veces; al cerrar,
+los trabajos en curso vuelven a la cola. Si el proceso muere, el trabajo
+queda disponible cuando vence la concesión, así que la ejecución es al
+menos una vez (at-least-once).
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+from response_cache import connect_shared
+
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+
+class JobQueue:
+    def __init__(self, db_path: str, lease_seconds: float = 600, max_attempts: int = 3,
+                 dedup_ttl_seconds: float = 86400, retention_seconds: float = 7 * 86400):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.dedup_ttl_seconds = dedup_ttl_seconds
+        self.retention_seconds = retention_seconds
+
+        self._lock = threading.Lock()
+        # Las escrituras de la cola no se pueden omitir: se espera más, fuera del
+        # event loop (api_server llama a submit/claim/complete/fail con asyncio.to_thread)
+        self._db = connect_shared(db_path, busy_timeout=5.0)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " request TEXT NOT NULL,"
+            " dedup_key TEXT NOT NULL,"
+            " priority INTEGER NOT NULL DEFAULT 0,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " result TEXT,"
+            " error TEXT,"
+            " status_code INTEGER,"
+            " created_at REAL NOT NULL,"
+            " available_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " lease_until REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, available_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs(dedup_key, status)")
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        # Último latido de cada proceso con trabajos en curso
+        self._db.execute("CREATE TABLE IF NOT EXISTS job_instances (id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)")
+        self.instance_id = uuid.uuid4().hex
+        self._db.execute(
+            "INSERT INTO job_instances (id, heartbeat_at) VALUES (?, ?)", (self.instance_id, time.time())
+        )
+        self._db.commit()
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row, include_result: bool = True) -> dict:
+        job = {
+            "id": row["id"],
+            "status": row["status"],
+            "mode": row["mode"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+        if include_result:
+            job["request"] = json.loads(row["request"])
+            job["result"] = json.loads(row["result"]) if row["result"] is not None else None
+            job["error"] = row["error"]
+            job["status_code"] = row["status_code"]
+        return job
+
+    def submit(self, request: dict, mode: str, dedup_key: str, priority: int = 0) -> tuple:
+        """
+        Encola un trabajo y retorna (job, deduplicated). Si ya hay uno igual
+        pendiente, en curso o terminado con éxito dentro del TTL, retorna ese.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE dedup_key = ? AND ("
+                " status IN ('queued', 'running') OR (status = 'succeeded' AND finished_at >= ?))"
+                " ORDER BY created_at DESC LIMIT 1",
+                (dedup_key, now - self.dedup_ttl_seconds)
+            ).fetchone()
+            if row is not None:
+                return self._to_dict(row), True
+
+            job_id = uuid.uuid4().hex
+            self._db.execute(
+                "INSERT INTO jobs (id, status, mode, request, dedup_key, priority, created_at, available_at)"
+                " VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, mode, json.dumps(request, ensure_ascii=False), dedup_key, priority, now, now)
+            )
+            self._purge(now)
+            self._db.commit()
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._to_dict(row), False
+
+    def claim(self) -> Optional[dict]:
+        """
+        Reclama el siguiente trabajo disponible (mayor prioridad, luego el más
+        antiguo), incluidos los 'running' cuya concesión venció.
+        """
+        now = time.time()
+        available = "((status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_until < ?))"
+        with self._lock:
+            while True:
+                row = self._db.execute(
+                    f"SELECT * FROM jobs WHERE {available}"
+                    " ORDER BY priority DESC, created_at ASC LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                # La condición se repite en el UPDATE: con varios procesos
+                # (uvicorn --workers) solo uno gana el trabajo
+                cursor = self._db.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?,"
+                    f" started_at = ?, lease_until = ? WHERE id = ? AND {available}",
+                    (self.instance_id, now, now + self.lease_seconds, row["id"], now, now)
+                )
+                self._db.commit()
+                if cursor.rowcount == 1:
+                    break
+            job = self._to_dict(row)
+            job["status"] = "running"
+            job["attempts"] += 1
+            job["priority"] = row["priority"]
+            return job
+
+    def complete(self, job_id: str, result: dict):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'succeeded', result = ?, error = NULL, status_code = NULL,"
+                " finished_at = ?, lease_until = NULL WHERE id = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id)
+            )
+            self._db.commit()
+
+    def fail(self, job_id: str, error: str, status_code: int, retry_after: Optional[float] = None) -> str:
+        """
+        Registra un fallo. Con `retry_after` y quedando intentos, el trabajo
+        vuelve a la cola tras ese retraso. Retorna el estado resultante.
+        """
+        now = time.time()
+        with self._lock:
+            (attempts,) = self._db.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if retry_after is not None and attempts < self.max_attempts:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, status_code = ?,"
+                    " available_at = ?, lease_until = NULL WHERE id = ?",
+                    (error, status_code, now + retry_after, job_id)
+                )
+                status = "queued"
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, status_code = ?,"
+                    " finished_at = ?, lease_until = NULL WHERE id = ?",
+                    (error, status_code, now, job_id)
+                )
+                status = "failed"
+            self._db.commit()
+            return status
+
+    def heartbeat(self) -> int:
+        """
+        Renueva las concesiones de los trabajos en curso de esta instancia
+        (llamar cada fracción de lease_seconds). Retorna cuántos renovó.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO job_instances (id, heartbeat_at) VALUES (?, ?)", (self.instance_id, now)
+            )
+            cursor = self._db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE status = 'running' AND owner = ?",
+                (now + self.lease_seconds, self.instance_id)
+            )
+            self._db.commit()
+            return cursor.rowcount
+
+    def recover(self) -> int:
+        """
+        Al arrancar: los trabajos 'running' de instancias que ya no dan
+        latidos vuelven a la cola. Los de una instancia viva (otro proceso de
+        uvicorn --workers N) se dejan. Retorna cuántos se recuperaron.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM job_instances WHERE heartbeat_at < ?", (now - self.lease_seconds,))
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, lease_until = NULL, owner = NULL"
+                " WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?"
+                " OR owner IS NULL OR owner NOT IN (SELECT id FROM job_instances))",
+                (now, now)
+            )
+            self._purge(now)
+            self._db.commit()
+            return cursor.rowcount
+
+    def release(self) -> int:
+        """
+        Al cerrar: los trabajos en curso de esta instancia vuelven a la cola
+        de inmediato, sin gastar el intento. Retorna cuántos liberó.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, lease_until = NULL, owner = NULL,"
+                " attempts = MAX(attempts - 1, 0) WHERE status = 'running' AND owner = ?",
+                (now, self.instance_id)
+            )
+            self._db.execute("DELETE FROM job_instances WHERE id = ?", (self.instance_id,))
+            self._db.commit()
+            return cursor.rowcount
+
+    def _purge(self, now: float):
+        self._db.execute(
+            "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+            (now - self.retention_seconds,)
+        )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._to_dict(row) if row is not None else None
+
+    def list(self, status: Optional[str] = None, limit: int = 100) -> list:
+        with self._lock:
+            if status is None:
+                rows = self._db.execute(
+                    "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit)
+                ).fetchall()
+            return [self._to_dict(row, include_result=False) for row in rows]
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+            counts = {status: 0 for status in JOB_STATUSES}
+            counts.update({status: count for status, count in rows})
+            return counts
+
+    def close(self):
+        self.release()
+        with self._lock:
+            self._db.close()
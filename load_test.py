@@ -0,0 +1,281 @@
+"""
+Generador de carga para api_server.py.
+
+Lanza requests a /generate-config con concurrencia fija (lazo cerrado) o con
+una tasa de llegadas Poisson (lazo abierto) y reporta latencia p50/p95/p99,
+throughput y tasa de error. Con --start-stack levanta en el propio proceso
+fake_ollama.py y api_server.py, así que corre en cualquier máquina Linux sin
+GPU y sirve para detectar regresiones del lado del servidor. Con --backends N
+levanta N instancias de fake_ollama (OLLAMA_BACKENDS) para reproducir el
+balanceo por menos pendientes (--slow-backends) y la expulsión de backends
+caídos (--down-backends: puertos sin nadie escuchando).
+
+Uso:
+    python load_test.py --start-stack --concurrency 32 --requests 500
+    python load_test.py --start-stack --rate 50 --duration 30 --token-ms 5 --parallel 4
+    python load_test.py --url http://gpu-box:8000 --concurrency 8 --duration 60 --dataset dataset_v2.csv
+    python load_test.py --start-stack --concurrency 16 --max-p95 1.5 --max-error-rate 0.01
+    python load_test.py --start-stack --backends 3 --down-backends 1 --slow-backends 1 --token-ms 5
+"""
+
+import argparse
+import asyncio
+import copy
+import csv
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+import aiohttp
+
+import fake_ollama
+
+
+FAKE_OLLAMA_PORT = 11600
+API_PORT = 8600
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def load_requirements(dataset: str) -> list:
+    if not dataset:
+        return []
+    with open(dataset, encoding="utf-8", errors="replace") as f:
+        return [r["requirement"] for r in csv.DictReader(f) if r.get("requirement")]
+
+
+def start_stack(args) -> str:
+    """Levanta fake_ollama y api_server en hilos de este proceso; retorna la URL base del API"""
+    from benchmark_api_server import serve_in_thread
+
+    # Puertos consecutivos; los últimos --down-backends quedan sin servidor
+    urls = [f"http://127.0.0.1:{FAKE_OLLAMA_PORT + i}" for i in range(args.backends)]
+    os.environ["OLLAMA_BASE_URL"] = urls[0]
+    os.environ["OLLAMA_BACKENDS"] = ",".join(urls)
+    # Cada request tiene que llegar al Ollama falso: sin caché ni trabajos en segundo plano
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "1" if args.cache else "0")
+    os.environ.setdefault("JOBS_ENABLED", "0")
+    os.environ.setdefault("OLLAMA_MAX_CONNECTIONS", str(max(64, args.concurrency * 2)))
+    import api_server
+
+    config = fake_ollama.config_from_args(args)
+    for i in range(args.backends - args.down_backends):
+        backend_config = config
+        if i < args.slow_backends:
+            backend_config = copy.copy(config)
+            backend_config.call_latency *= args.slow_factor
+            backend_config.prompt_eval_latency *= args.slow_factor
+            backend_config.token_latency *= args.slow_factor
+        serve_in_thread(fake_ollama.build_fake_ollama(backend_config), FAKE_OLLAMA_PORT + i)
+    serve_in_thread(api_server.app, API_PORT)
+    return f"http://127.0.0.1:{API_PORT}"
+
+
+async def fetch_backends(base_url: str) -> list:
+    """Estado por backend según /health (reparto de requests, fallos, expulsiones); vacío si no responde"""
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            async with session.get(f"{base_url}/health") as response:
+                if response.status != 200:
+                    return []
+                return (await response.json()).get("backends", [])
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return []
+
+
+class LoadResult:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = Counter()
+
+    def record(self, latency: float, status: int, error: str = None):
+        self.latencies.append(latency)
+        self.statuses[status] += 1
+        if error is not None:
+            self.errors[error] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        total = len(self.latencies)
+        ok = self.statuses.get(200, 0)
+        latencies = sorted(self.latencies)
+        return {
+            "requests": total,
+            "ok": ok,
+            "errors": total - ok,
+            "error_rate": round((total - ok) / total, 4) if total else 0.0,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(ok / elapsed, 2) if elapsed else 0.0,
+            "latency_mean_s": round(sum(latencies) / total, 4) if total else 0.0,
+            "latency_p50_s": round(percentile(latencies, 50), 4),
+            "latency_p95_s": round(percentile(latencies, 95), 4),
+            "latency_p99_s": round(percentile(latencies, 99), 4),
+            "latency_max_s": round(latencies[-1], 4) if latencies else 0.0,
+            "status_codes": {str(k): v for k, v in sorted(self.statuses.items())},
+            "error_kinds": dict(self.errors),
+        }
+
+
+async def send_one(session: aiohttp.ClientSession, url: str, payload: dict, result: LoadResult):
+    t0 = time.perf_counter()
+    try:
+        async with session.post(url, json=payload) as response:
+            await response.read()
+            error = None if response.status == 200 else f"http_{response.status}"
+            result.record(time.perf_counter() - t0, response.status, error)
+    except asyncio.TimeoutError:
+        result.record(time.perf_counter() - t0, 0, "timeout")
+    except aiohttp.ClientError as e:
+        result.record(time.perf_counter() - t0, 0, type(e).__name__)
+
+
+def make_payload(i: int, requirements: list, network_state: str, unique: bool) -> dict:
+    requirement = requirements[i % len(requirements)] if requirements else "Configure OSPF between R1 and R2"
+    if unique:
+        # Evita que caché y single-flight colapsen los requests repetidos
+        requirement = f"{requirement} #{i}"
+    return {"requirement": requirement, "network_state": network_state}
+
+
+async def closed_loop(url: str, args, requirements: list, network_state: str) -> tuple:
+    """`concurrency` clientes que lanzan el siguiente request al terminar el anterior"""
+    result = LoadResult()
+    counter = iter(range(sys.maxsize))
+    stop_at = time.perf_counter() + args.duration if args.duration else None
+
+    async def client(session: aiohttp.ClientSession):
+        while True:
+            i = next(counter)
+            if args.requests and i >= args.requests:
+                return
+            if stop_at is not None and time.perf_counter() >= stop_at:
+                return
+            await send_one(session, url, make_payload(i, requirements, network_state, not args.repeat), result)
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(args.concurrency)))
+        return result, time.perf_counter() - t0
+
+
+async def open_loop(url: str, args, requirements: list, network_state: str) -> tuple:
+    """Llegadas Poisson a `rate` req/s, independientes de cuánto tarde el servidor"""
+    result = LoadResult()
+    rng = random.Random(args.seed)
+    tasks = []
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        t0 = time.perf_counter()
+        next_arrival = t0
+        i = 0
+        while True:
+            if args.requests and i >= args.requests:
+                break
+            if args.duration and next_arrival - t0 >= args.duration:
+                break
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            payload = make_payload(i, requirements, network_state, not args.repeat)
+            tasks.append(asyncio.create_task(send_one(session, url, payload, result)))
+            i += 1
+            next_arrival += rng.expovariate(args.rate)
+        await asyncio.gather(*tasks)
+        return result, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prueba de carga de /generate-config: latencia p50/p95/p99, throughput y tasa de error."
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="URL base de api_server")
+    parser.add_argument("--endpoint", default="/generate-config")
+    parser.add_argument("--mode", default="", help="two_phase o fused (por defecto el del servidor)")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=8, help="Clientes simultáneos (lazo cerrado)")
+    load.add_argument("--rate", type=float, default=0.0, help="Llegadas por segundo (lazo abierto, Poisson)")
+    parser.add_argument("--requests", type=int, default=0, help="Total de requests (0 = según --duration)")
+    parser.add_argument("--duration", type=float, default=0.0, help="Segundos de carga (0 = según --requests)")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--dataset", default="", help="CSV con columna 'requirement' para variar los payloads")
+    parser.add_argument("--network-state-file", default="", help="Archivo enviado como network_state")
+    parser.add_argument("--repeat", action="store_true",
+                        help="Repetir los requerimientos tal cual (mide caché y single-flight)")
+    parser.add_argument("--max-p95", type=float, default=0.0, help="Falla (exit 1) si p95 supera estos segundos")
+    parser.add_argument("--max-error-rate", type=float, default=-1.0, help="Falla (exit 1) si se supera")
+    parser.add_argument("--output", default="", help="Ruta del reporte JSON (por defecto load_test_<ts>.json)")
+
+    stack = parser.add_argument_group("stack local (--start-stack)")
+    stack.add_argument("--start-stack", action="store_true", help="Levantar fake_ollama y api_server en proceso")
+    stack.add_argument("--cache", action="store_true", help="Dejar activa la caché de respuestas")
+    stack.add_argument("--backends", type=int, default=1, help="Instancias de fake_ollama (OLLAMA_BACKENDS)")
+    stack.add_argument("--down-backends", type=int, default=0,
+                       help="De ellas, cuántas quedan caídas (puerto sin servidor) para probar la expulsión")
+    stack.add_argument("--slow-backends", type=int, default=0,
+                       help="De las levantadas, cuántas son --slow-factor veces más lentas")
+    stack.add_argument("--slow-factor", type=float, default=4.0)
+    fake_ollama.add_arguments(stack)
+    args = parser.parse_args()
+
+    if not args.requests and not args.duration:
+        args.requests = 200
+    if args.rate < 0 or args.concurrency < 1:
+        parser.error("--rate debe ser > 0 y --concurrency >= 1")
+    if args.backends < 1 or not 0 <= args.down_backends < args.backends:
+        parser.error("--backends debe ser >= 1 y --down-backends dejar al menos uno levantado")
+    if not 0 <= args.slow_backends <= args.backends - args.down_backends:
+        parser.error("--slow-backends no puede superar los backends levantados")
+
+    base_url = start_stack(args) if args.start_stack else args.url.rstrip("/")
+    url = base_url + args.endpoint + (f"?mode={args.mode}" if args.mode else "")
+    requirements = load_requirements(args.dataset)
+    network_state = ""
+    if args.network_state_file:
+        with open(args.network_state_file, encoding="utf-8") as f:
+            network_state = f.read()
+
+    shape = f"rate={args.rate}/s" if args.rate else f"concurrency={args.concurrency}"
+    print("=" * 80)
+    print(f"LOAD TEST {url}  |  {shape}  |  requests={args.requests or '-'} duration={args.duration or '-'}s")
+    print("=" * 80)
+
+    runner = open_loop if args.rate else closed_loop
+    result, elapsed = asyncio.run(runner(url, args, requirements, network_state))
+    summary = result.summary(elapsed)
+    backends = asyncio.run(fetch_backends(base_url))
+    if backends:
+        summary["backends"] = backends
+    print(json.dumps(summary, indent=2))
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    out_file = args.output or f"load_test_{timestamp}.json"
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": timestamp, "url": url, "args": vars(args), "summary": summary}, f, indent=2)
+    print(f"Reporte JSON: {out_file}")
+
+    failures = []
+    if args.max_p95 and summary["latency_p95_s"] > args.max_p95:
+        failures.append(f"p95 {summary['latency_p95_s']}s > {args.max_p95}s")
+    if args.max_error_rate >= 0 and summary["error_rate"] > args.max_error_rate:
+        failures.append(f"error_rate {summary['error_rate']} > {args.max_error_rate}")
+    if failures:
+        print("❌ " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
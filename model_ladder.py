@@ -0,0 +1,135 @@
+"""
+Escalera de modelos para degradar bajo carga.
+
+Los modelos van del preferido al más barato. Si el p95 de la espera en cola
+(de admisión o en el scheduler de Ollama) o de la latencia del request en la
+ventana reciente supera su umbral, se baja un peldaño; cuando ambos vuelven
+por debajo de umbral * recover_ratio se sube uno. Entre cambios se respeta
+un cooldown y las ventanas se vacían para medir solo al modelo nuevo.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+
+def _p95(samples) -> Optional[float]:
+    values = sorted(v for _, v in samples)
+    if not values:
+        return None
+    return values[max(1, math.ceil(0.95 * len(values))) - 1]
+
+
+class ModelLadder:
+    def __init__(self, models: list, queue_wait_threshold_s: float = 0.0, p95_threshold_s: float = 0.0,
+                 window_s: float = 60.0, cooldown_s: float = 30.0, recover_ratio: float = 0.5,
+                 min_samples: int = 20):
+        """
+        Args:
+            models: tags de Ollama, del preferido al más barato
+            queue_wait_threshold_s: p95 de espera en cola que dispara la degradación (0 = no se mira)
+            p95_threshold_s: p95 de latencia del request que dispara la degradación (0 = no se mira)
+            window_s: antigüedad máxima de las muestras consideradas
+            cooldown_s: tiempo mínimo entre dos cambios de peldaño
+            recover_ratio: fracción de los umbrales por debajo de la cual se sube
+            min_samples: muestras necesarias para cambiar de peldaño
+        """
+        if not models:
+            raise ValueError("La escalera necesita al menos un modelo")
+        self.models = list(models)
+        self.queue_wait_threshold_s = queue_wait_threshold_s
+        self.p95_threshold_s = p95_threshold_s
+        self.window_s = window_s
+        self.cooldown_s = cooldown_s
+        self.recover_ratio = recover_ratio
+        self.min_samples = min_samples
+
+        self.level = 0
+        self.last_change = time.monotonic()
+        self.switches = []
+        self._queue_wait = deque(maxlen=2000)
+        self._latency = deque(maxlen=2000)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.models) > 1 and (self.queue_wait_threshold_s > 0 or self.p95_threshold_s > 0)
+
+    def current(self) -> str:
+        return self.models[self.level]
+
+    def observe_queue_wait(self, seconds: float) -> Optional[tuple]:
+        return self._observe(self._queue_wait, seconds)
+
+    def observe_latency(self, seconds: float) -> Optional[tuple]:
+        return self._observe(self._latency, seconds)
+
+    def _observe(self, samples: deque, value: float) -> Optional[tuple]:
+        """Registra la muestra y retorna (modelo_anterior, modelo_nuevo) si cambió de peldaño"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            samples.append((now, value))
+            return self._evaluate(now)
+
+    def _signals(self, now: float) -> list:
+        """(p95, umbral, número de muestras) de cada señal activa"""
+        signals = []
+        for samples, threshold in ((self._queue_wait, self.queue_wait_threshold_s),
+                                   (self._latency, self.p95_threshold_s)):
+            while samples and now - samples[0][0] > self.window_s:
+                samples.popleft()
+            if threshold > 0:
+                signals.append((_p95(samples), threshold, len(samples)))
+        return signals
+
+    def _evaluate(self, now: float) -> Optional[tuple]:
+        signals = self._signals(now)
+        if now - self.last_change < self.cooldown_s:
+            return None
+
+        overloaded = any(
+            count >= self.min_samples and p95 > threshold for p95, threshold, count in signals
+        )
+        if overloaded and self.level < len(self.models) - 1:
+            return self._switch(self.level + 1, now)
+
+        # Para subir también hacen falta min_samples: una ventana recién vaciada no prueba nada
+        relaxed = all(
+            count >= self.min_samples and p95 < threshold * self.recover_ratio
+            for p95, threshold, count in signals
+        )
+        if relaxed and self.level > 0:
+            return self._switch(self.level - 1, now)
+        return None
+
+    def _switch(self, level: int, now: float) -> tuple:
+        previous = self.current()
+        self.level = level
+        self.last_change = now
+        self._queue_wait.clear()
+        self._latency.clear()
+        self.switches.append({"at": time.time(), "from": previous, "to": self.current()})
+        del self.switches[:-20]
+        return previous, self.current()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            queue_wait_p95 = _p95(self._queue_wait)
+            latency_p95 = _p95(self._latency)
+            return {
+                "models": self.models,
+                "current": self.current(),
+                "level": self.level,
+                "enabled": self.enabled,
+                "queue_wait_p95_s": round(queue_wait_p95, 3) if queue_wait_p95 is not None else None,
+                "latency_p95_s": round(latency_p95, 3) if latency_p95 is not None else None,
+                "queue_wait_threshold_s": self.queue_wait_threshold_s,
+                "p95_threshold_s": self.p95_threshold_s,
+                "since_last_change_s": round(now - self.last_change, 1),
+                "recent_switches": list(self.switches),
+            }
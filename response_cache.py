@@ -0,0 +1,199 @@
+"""
+Caché de respuestas de dos niveles para api_server.py.
+
+Nivel 1: LRU en memoria del proceso (OrderedDict).
+Nivel 2: SQLite en disco, sobrevive a reinicios del servidor y se comparte
+entre procesos (uvicorn --workers N) en modo WAL: lo que genera un worker
+lo aprovechan los demás. ":memory:" deja la caché solo dentro del proceso.
+
+Ambos niveles aplican TTL y un máximo de entradas; las claves se construyen
+con make_key() a partir de todo lo que influye en la salida del modelo.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_requirement(requirement: str) -> str:
+    """
+    Colapsa espacios para que variaciones triviales compartan entrada. Las
+    mayúsculas se respetan: hostnames, comunidades SNMP, nombres de ACL o
+    descripciones distinguen mayúsculas y cambian la configuración generada.
+    """
+    return " ".join(requirement.split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def make_key(*parts) -> str:
+    """Clave estable a partir de cualquier combinación de valores serializables en JSON"""
+    return text_hash(json.dumps(parts, ensure_ascii=False, sort_keys=True))
+
+
+def connect_shared(db_path: str, busy_timeout: float = 0.1) -> sqlite3.Connection:
+    """
+    Conexión SQLite apta para varios procesos: WAL (los lectores no bloquean
+    al escritor) y espera de hasta `busy_timeout` s si otro proceso escribe.
+    La caché se consulta desde el event loop: la espera es corta y, si vence,
+    la operación cuenta como miss (get) o se omite (set)
+    """
+    db = sqlite3.connect(db_path, check_same_thread=False, timeout=busy_timeout)
+    db.execute("PRAGMA journal_mode=WAL")
+    # Con WAL, NORMAL solo arriesga la última transacción ante un corte de luz
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class ResponseCache:
+    def __init__(self, db_path: str, ttl_seconds: float = 86400,
+                 max_memory_entries: int = 1024, max_disk_entries: int = 100000,
+                 touch_interval: float = 60.0, evict_every: int = 0):
+        """
+        Args:
+            touch_interval: last_access en disco se actualiza como mucho una vez
+                            por este intervalo, para no escribir en cada hit
+            evict_every: escrituras entre dos pasadas de expiración/recorte en
+                         disco (0 = 1 % de max_disk_entries); entre pasadas el
+                         disco puede superar el máximo en hasta ese número
+        """
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.touch_interval = touch_interval
+        self.evict_every = evict_every or max(1, max_disk_entries // 100)
+        self._sets_since_evict = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.disk_errors = 0
+
+        self._db = connect_shared(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " namespace TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache(last_access)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_created_at ON cache(created_at)")
+        self._db.commit()
+
+    def _count(self, namespace: str, field: str):
+        counters = self._stats.setdefault(namespace, {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0})
+        counters[field] += 1
+
+    def _remember(self, key: str, value, created_at: float):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, namespace: str, key: str):
+        """Retorna el valor cacheado o None (memoria primero, luego disco)"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._count(namespace, "memory_hits")
+                    return value
+                del self._memory[key]
+
+            try:
+                row = self._db.execute(
+                    "SELECT value, created_at, last_access FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self._count(namespace, "misses")
+                    return None
+
+                value_json, created_at, last_access = row
+                if now - created_at > self.ttl_seconds:
+                    self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    self._count(namespace, "misses")
+                    return None
+
+                if now - last_access > self.touch_interval:
+                    self._db.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+            except sqlite3.OperationalError:
+                # Disco ocupado por otro proceso más allá del timeout: se trata como miss
+                self._db.rollback()
+                self.disk_errors += 1
+                self._count(namespace, "misses")
+                return None
+            value = json.loads(value_json)
+            self._remember(key, value, created_at)
+            self._count(namespace, "disk_hits")
+            return value
+
+    def set(self, namespace: str, key: str, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, namespace, value, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, namespace, json.dumps(value, ensure_ascii=False), now, now)
+                )
+                self._sets_since_evict += 1
+                if self._sets_since_evict >= self.evict_every:
+                    # Expirar y contar recorre el índice: se hace cada evict_every escrituras, no en cada una
+                    self._evict_disk(now)
+                    self._sets_since_evict = 0
+                self._db.commit()
+            except sqlite3.OperationalError:
+                self._db.rollback()
+                self.disk_errors += 1
+            self._count(namespace, "sets")
+
+    def _evict_disk(self, now: float):
+        self._db.execute("DELETE FROM cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        (total,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+        overflow = total - self.max_disk_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            (disk_entries,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+            namespaces = {}
+            for namespace, counters in self._stats.items():
+                hits = counters["memory_hits"] + counters["disk_hits"]
+                lookups = hits + counters["misses"]
+                namespaces[namespace] = {
+                    **counters,
+                    "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                }
+            return {
+                # Los contadores son de este proceso; el disco es compartido
+                "pid": os.getpid(),
+                "disk_errors": self.disk_errors,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "namespaces": namespaces,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,257 @@
+"""
+Caché semántica de la fase 1 para api_server.py.
+
+La caché exacta (response_cache.py) falla con paráfrasis: "Enable the
+interface on R1 that connects to R4" y "Bring up R1's link to R4" dan la
+misma clasificación y pasos. Aquí cada requerimiento se guarda con su
+embedding normalizado; una consulta devuelve el valor de la entrada más
+parecida si la similitud coseno supera el umbral.
+
+El índice es una matriz en memoria (búsqueda exacta por producto punto,
+suficiente para decenas de miles de entradas) respaldada por un archivo
+.npz que se reescribe de forma atómica; save() es bloqueante (cientos de
+ms con decenas de miles de entradas), así que el servidor lo llama fuera
+del event loop cuando save_due() lo indica. Las últimas coincidencias quedan
+registradas para que se pueda revisar su calidad y eliminar las malas.
+
+La similitud no distingue entidades: "OSPF entre R1 y R2" y "OSPF entre R1
+y R3" quedan casi idénticos para cualquier modelo de embeddings, y reusar
+los pasos configuraría el equipo equivocado. Por eso una coincidencia solo
+vale si los dos requerimientos nombran exactamente las mismas entidades
+(equipos, interfaces, IPs/prefijos, números y nombres propios).
+"""
+
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+
+
+# Tokens con dígitos (R1, Gi0/1, 10.0.0.0/24, area 0, AS 65001) o con mayúsculas
+# internas (CoreA, PublicRO): equipos, interfaces, direcciones, números y nombres
+ENTITY_TOKEN = re.compile(r"[\w./:-]*\d[\w./:-]*|\b[A-Za-z]+[a-z][A-Z]\w*")
+
+
+def entity_tokens(text: str) -> frozenset:
+    """Entidades que nombra el requerimiento; dos requerimientos equivalentes nombran las mismas"""
+    return frozenset(token.strip(".:-/").casefold() for token in ENTITY_TOKEN.findall(text))
+
+
+class SemanticCache:
+    def __init__(self, path: str, threshold: float = 0.92, max_entries: int = 10000,
+                 ttl_seconds: float = 86400, save_every: int = 20, recent_hits: int = 200):
+        """
+        Args:
+            path: archivo .npz de respaldo ("" = solo en memoria)
+            threshold: similitud coseno mínima para devolver una entrada
+            max_entries: al superarlo se descartan las entradas menos usadas
+            save_every: escrituras entre dos guardados en disco
+            recent_hits: coincidencias recientes guardadas para inspección
+        """
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.save_every = save_every
+
+        self._vectors = None
+        self._entries = []
+        self._dirty = 0
+        self._lock = threading.Lock()
+        # Dos guardados a la vez compartirían el archivo temporal
+        self._save_lock = threading.Lock()
+        self.recent_hits = deque(maxlen=recent_hits)
+        self.stats_counters = {"hits": 0, "misses": 0, "entity_mismatches": 0, "sets": 0, "evictions": 0}
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm > 0 else v
+
+    def _candidates(self, scope: str, dim: int, now: float) -> np.ndarray:
+        """Índices de las entradas vigentes del mismo scope y dimensión"""
+        return np.array([
+            i for i, e in enumerate(self._entries)
+            if e["scope"] == scope and e["dim"] == dim and now - e["created_at"] <= self.ttl_seconds
+        ], dtype=np.int64)
+
+    def lookup(self, query: str, vector, scope: str = "") -> tuple:
+        """
+        Retorna (entrada o None, mejor similitud o None). La entrada incluye
+        value, requirement original y similarity. Una entrada sobre el umbral
+        que nombra otras entidades cuenta como fallo (entity_mismatches).
+        """
+        v = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None or not self._entries:
+                self.stats_counters["misses"] += 1
+                return None, None
+            candidates = self._candidates(scope, v.shape[0], now)
+            if candidates.size == 0:
+                self.stats_counters["misses"] += 1
+                return None, None
+            similarities = self._vectors[candidates] @ v
+            best_similarity = float(similarities.max())
+            above = np.flatnonzero(similarities >= self.threshold)
+            # De la más parecida a la menos: la primera que nombre las mismas entidades
+            wanted = entity_tokens(query)
+            entry = None
+            for position in above[np.argsort(-similarities[above])]:
+                candidate = self._entries[int(candidates[position])]
+                if entity_tokens(candidate["requirement"]) == wanted:
+                    entry, similarity = candidate, float(similarities[position])
+                    break
+            if entry is None:
+                self.stats_counters["misses"] += 1
+                if above.size:
+                    self.stats_counters["entity_mismatches"] += 1
+                return None, best_similarity
+            entry["hits"] += 1
+            entry["last_hit"] = now
+            self.stats_counters["hits"] += 1
+            self.recent_hits.append({
+                "at": now,
+                "query": query,
+                "matched": entry["requirement"],
+                "entry_id": entry["id"],
+                "similarity": round(similarity, 4),
+            })
+            return {**entry, "similarity": similarity}, similarity
+
+    def add(self, requirement: str, vector, value, scope: str = "") -> str:
+        """
+        Guarda el valor y retorna el id de la entrada. El mismo requerimiento
+        en el mismo scope reemplaza a su entrada en lugar de duplicarla, así
+        remove() basta para retirarlo.
+        """
+        v = self._normalize(vector)
+        entry = {
+            "id": uuid.uuid4().hex[:12],
+            "requirement": requirement,
+            "value": value,
+            "scope": scope,
+            "dim": int(v.shape[0]),
+            "created_at": time.time(),
+            "hits": 0,
+            "last_hit": None,
+        }
+        with self._lock:
+            self.stats_counters["sets"] += 1
+            self._dirty += 1
+            for i, e in enumerate(self._entries):
+                if e["scope"] == scope and e["requirement"] == requirement and e["dim"] == entry["dim"]:
+                    e.update(value=value, created_at=entry["created_at"])
+                    self._vectors[i] = v
+                    return e["id"]
+            self._append(entry, v)
+        return entry["id"]
+
+    def save_due(self) -> bool:
+        """Hay save_every escrituras sin guardar en disco"""
+        return bool(self.path) and self._dirty >= self.save_every
+
+    def _append(self, entry: dict, v: np.ndarray):
+        if self._vectors is not None and self._vectors.shape[1] != v.shape[0]:
+            # Cambió el modelo de embeddings: las entradas anteriores ya no son comparables
+            self._vectors, self._entries = None, []
+        size = len(self._entries)
+        if self._vectors is None:
+            self._vectors = np.empty((16, v.shape[0]), dtype=np.float32)
+        elif size == self._vectors.shape[0]:
+            # Capacidad doble: agregar no copia la matriz completa en cada escritura
+            grown = np.empty((size * 2, v.shape[0]), dtype=np.float32)
+            grown[:size] = self._vectors
+            self._vectors = grown
+        self._vectors[size] = v
+        self._entries.append(entry)
+        if len(self._entries) > self.max_entries:
+            self._evict(len(self._entries) - self.max_entries)
+
+    def _evict(self, count: int):
+        now = time.time()
+        # Primero las vencidas, luego las de menos hits y más viejas
+        order = sorted(
+            range(len(self._entries)),
+            key=lambda i: (now - self._entries[i]["created_at"] <= self.ttl_seconds,
+                           self._entries[i]["hits"], self._entries[i]["created_at"])
+        )
+        drop = set(order[:count])
+        keep = [i for i in range(len(self._entries)) if i not in drop]
+        self._vectors = self._vectors[keep]
+        self._entries = [self._entries[i] for i in keep]
+        self.stats_counters["evictions"] += count
+
+    def remove(self, entry_id: str) -> bool:
+        """Elimina una entrada (p. ej. una coincidencia que resultó incorrecta)"""
+        with self._lock:
+            for i, e in enumerate(self._entries):
+                if e["id"] == entry_id:
+                    keep = [j for j in range(len(self._entries)) if j != i]
+                    self._vectors = self._vectors[keep] if keep else None
+                    del self._entries[i]
+                    self._dirty += 1
+                    return True
+        return False
+
+    def save(self):
+        """Reescribe el archivo de respaldo (tmp + rename, nunca queda a medias)"""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                size = len(self._entries)
+                vectors = self._vectors[:size].copy() if self._vectors is not None else np.zeros((0, 0), dtype=np.float32)
+                entries = json.dumps(self._entries, ensure_ascii=False)
+                self._dirty = 0
+            buffer = io.BytesIO()
+            np.savez(buffer, vectors=vectors, entries=np.array(entries))
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, self.path)
+
+    def load(self):
+        with np.load(self.path, allow_pickle=False) as data:
+            vectors = data["vectors"].astype(np.float32)
+            entries = json.loads(str(data["entries"]))
+        with self._lock:
+            self._vectors = vectors if len(entries) else None
+            self._entries = entries
+
+    def close(self):
+        if self._dirty:
+            self.save()
+
+    def entries(self, limit: int = 50) -> list:
+        """Entradas más usadas, sin el valor completo"""
+        with self._lock:
+            ranked = sorted(self._entries, key=lambda e: e["hits"], reverse=True)[:limit]
+            return [{k: e[k] for k in ("id", "requirement", "scope", "hits", "created_at", "last_hit")}
+                    for e in ranked]
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.stats_counters["hits"]
+            lookups = hits + self.stats_counters["misses"]
+            similarities = [h["similarity"] for h in self.recent_hits]
+            return {
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                **self.stats_counters,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "recent_hit_min_similarity": min(similarities) if similarities else None,
+                "recent_hit_mean_similarity": round(sum(similarities) / len(similarities), 4) if similarities else None,
+            }
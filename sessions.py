@@ -0,0 +1,120 @@
+"""
+Sesiones de topología para api_server.py.
+
+POST /sessions evalúa el network_state una sola vez en Ollama y guarda el
+array `context` que devuelve /api/generate. Las llamadas de la fase 2 que
+traen el session_id mandan ese context en lugar de volver a incluir la
+topología en el prompt, así Ollama no la re-evalúa en cada request.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+
+class TopologySession:
+    def __init__(self, topology: str, topology_hash: str, context: list, backend,
+                 prime_prompt_eval_count: int, model: Optional[str] = None):
+        self.session_id = uuid.uuid4().hex
+        self.topology = topology
+        self.topology_hash = topology_hash
+        self.context = context
+        # Backend que tiene la KV-cache de la topología: las llamadas van ahí mientras esté sano
+        self.backend = backend
+        self.prime_prompt_eval_count = prime_prompt_eval_count
+        # El context solo vale para el modelo que lo generó
+        self.model = model
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.uses = 0
+        self.prompt_eval_counts = []
+
+    def record_use(self, prompt_eval_count: int):
+        self.uses += 1
+        self.prompt_eval_counts.append(prompt_eval_count)
+        del self.prompt_eval_counts[:-100]
+
+    def stats(self) -> dict:
+        counts = self.prompt_eval_counts
+        return {
+            "session_id": self.session_id,
+            "topology_hash": self.topology_hash,
+            "topology_chars": len(self.topology),
+            "context_tokens": len(self.context),
+            "model": self.model,
+            "backend": getattr(self.backend, "url", None),
+            "created_at": self.created_at,
+            "uses": self.uses,
+            # Tokens evaluados al subir la topología (lo que pagaría cada request sin sesión)
+            "prime_prompt_eval_count": self.prime_prompt_eval_count,
+            # Tokens evaluados por las llamadas de la fase 2 que usaron la sesión
+            "last_prompt_eval_count": counts[-1] if counts else None,
+            "mean_prompt_eval_count": round(sum(counts) / len(counts), 1) if counts else None,
+        }
+
+
+class SessionStore:
+    def __init__(self, ttl_seconds: float = 3600, max_sessions: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._by_topology = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, session: TopologySession, now: float) -> bool:
+        return now - session.last_used > self.ttl_seconds
+
+    def _drop(self, session: TopologySession):
+        self._sessions.pop(session.session_id, None)
+        if self._by_topology.get(session.topology_hash) is session:
+            del self._by_topology[session.topology_hash]
+
+    def add(self, session: TopologySession) -> TopologySession:
+        now = time.monotonic()
+        with self._lock:
+            for expired in [s for s in self._sessions.values() if self._expired(s, now)]:
+                self._drop(expired)
+            # Una sesión anterior de la misma topología (p. ej. de otro modelo de la escalera)
+            # sigue valiendo para quien tenga su id hasta que expire; el índice apunta a la nueva
+            self._sessions[session.session_id] = session
+            self._by_topology[session.topology_hash] = session
+            while len(self._sessions) > self.max_sessions:
+                _, oldest = self._sessions.popitem(last=False)
+                self._drop(oldest)
+        return session
+
+    def get(self, session_id: str) -> Optional[TopologySession]:
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if self._expired(session, now):
+                self._drop(session)
+                return None
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def find_by_topology(self, topology_hash: str) -> Optional[TopologySession]:
+        """Sesión vigente para la misma topología, para no volver a evaluarla"""
+        session = self._by_topology.get(topology_hash)
+        return self.get(session.session_id) if session is not None else None
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            self._drop(session)
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+            }
@@ -0,0 +1,164 @@
+"""
+Resumen de las trazas JSONL que escribe api_server.py (tracing.py).
+
+Muestra, por nombre de span, cuántas veces aparece y su latencia
+(media/p50/p95/p99/máx), los N spans más lentos y el desglose en árbol de
+las trazas más lentas: cola de admisión, HTTP a Ollama (prompt eval y
+decode), parseo JSON, construcción de la respuesta...
+
+Uso:
+    python trace_report.py
+    python trace_report.py traces.jsonl traces.jsonl.1 --top 30 --traces 5
+    python trace_report.py --name ollama --json
+"""
+
+import argparse
+import glob
+import json
+import math
+import statistics
+import sys
+from collections import defaultdict
+
+
+# Atributos que se muestran junto a cada span en el listado de los más lentos
+SHOWN_ATTRIBUTES = (
+    "path", "mode", "phase", "backend", "status_code", "status", "hit", "coalesced",
+    "prompt_eval_count", "prompt_eval_ms", "eval_count", "eval_ms", "load_ms", "early_stop", "error",
+)
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def load_spans(paths: list) -> list:
+    spans = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Última línea a medio escribir si el servidor seguía corriendo
+                    continue
+    return spans
+
+
+def aggregate_by_name(spans: list) -> list:
+    durations = defaultdict(list)
+    for s in spans:
+        durations[s["name"]].append(s["duration_ms"])
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append({
+            "name": name,
+            "count": len(values),
+            "mean_ms": round(statistics.mean(values), 3),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+            "max_ms": values[-1],
+            "total_ms": round(sum(values), 3),
+        })
+    rows.sort(key=lambda r: r["total_ms"], reverse=True)
+    return rows
+
+
+def span_label(s: dict) -> str:
+    attributes = s.get("attributes", {})
+    shown = [f"{k}={attributes[k]}" for k in SHOWN_ATTRIBUTES if k in attributes]
+    return f"{s['name']}  {' '.join(shown)}".rstrip()
+
+
+def trace_tree(spans: list) -> list:
+    """Líneas (profundidad, span) en orden de inicio, hijos bajo su padre"""
+    children = defaultdict(list)
+    ids = {s["span_id"] for s in spans}
+    for s in spans:
+        parent = s.get("parent_span_id")
+        children[parent if parent in ids else None].append(s)
+    for items in children.values():
+        items.sort(key=lambda s: s["start_time_unix_nano"])
+
+    lines = []
+
+    def walk(parent, depth):
+        for s in children.get(parent, []):
+            lines.append((depth, s))
+            walk(s["span_id"], depth + 1)
+
+    walk(None, 0)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agrega los spans más lentos de las trazas de api_server.py")
+    parser.add_argument("paths", nargs="*", help="Archivos JSONL (por defecto traces.jsonl y sus rotaciones)")
+    parser.add_argument("--top", type=int, default=20, help="Spans más lentos a listar")
+    parser.add_argument("--traces", type=int, default=3, help="Trazas más lentas a desglosar en árbol")
+    parser.add_argument("--name", default="", help="Solo spans cuyo nombre contenga este texto")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob("traces.jsonl*"))
+    if not paths:
+        parser.error("no hay archivos de trazas (TRACE_PATH) que leer")
+    spans = load_spans(paths)
+    if not spans:
+        print("Sin spans en " + ", ".join(paths))
+        sys.exit(0)
+
+    by_trace = defaultdict(list)
+    for s in spans:
+        by_trace[s["trace_id"]].append(s)
+    roots = sorted(
+        (s for s in spans if s.get("parent_span_id") is None),
+        key=lambda s: s["duration_ms"], reverse=True
+    )
+
+    selected = [s for s in spans if args.name in s["name"]]
+    summary = aggregate_by_name(selected)
+    slowest = sorted(selected, key=lambda s: s["duration_ms"], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({
+            "traces": len(by_trace),
+            "spans": len(spans),
+            "by_name": summary,
+            "slowest": slowest,
+            "slowest_traces": [
+                {"root": root, "spans": by_trace[root["trace_id"]]} for root in roots[:args.traces]
+            ],
+        }, indent=2, ensure_ascii=False))
+        return
+
+    print(f"{len(by_trace)} trazas, {len(spans)} spans ({', '.join(paths)})\n")
+    header = f"{'span':<26}{'count':>7}{'mean ms':>11}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in summary:
+        print(f"{r['name']:<26}{r['count']:>7}{r['mean_ms']:>11.1f}{r['p50_ms']:>10.1f}"
+              f"{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}")
+
+    print(f"\nSpans más lentos (top {len(slowest)}):")
+    for s in slowest:
+        request_id = s.get("attributes", {}).get("request_id", "")
+        print(f"  {s['duration_ms']:>10.1f} ms  {request_id:<18} {span_label(s)}")
+
+    for root in roots[:args.traces]:
+        request_id = root.get("attributes", {}).get("request_id", "")
+        print(f"\nTraza {root['trace_id']} (request {request_id}), {root['duration_ms']:.1f} ms:")
+        for depth, s in trace_tree(by_trace[root["trace_id"]]):
+            print(f"  {s['duration_ms']:>10.1f} ms  {'  ' * depth}{span_label(s)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Trazas por request para api_server.py (sin dependencias).
+
+Cada request HTTP abre una traza con un request id; dentro, span("nombre")
+mide un tramo (cola de admisión, llamada a Ollama, parseo JSON, ...). Al
+terminar, la traza se escribe como JSONL (un span por línea, con los nombres
+de campo de OTLP) en un archivo con rotación, si entra en el muestreo o si
+superó el umbral de lentitud.
+
+Uso:
+    tracer = Tracer("traces.jsonl", sample_rate=0.1)
+    app.add_middleware(TracingMiddleware, tracer=tracer)
+    with span("ollama.generate", backend=url) as s:
+        ...
+        s.set(eval_count=42)
+
+trace_report.py agrega los spans más lentos de esos archivos.
+"""
+
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_span_id", "attributes",
+                 "start_ns", "started", "duration_s", "status", "_parent")
+
+    def __init__(self, trace: "Trace", name: str, parent: Optional["Span"], attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_id(8)
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.started = time.perf_counter()
+        self.duration_s = None
+        self.status = "OK"
+        self._parent = parent
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_s = time.perf_counter() - self.started
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            self.status = "ERROR"
+            self.attributes.setdefault("error", f"{exc_type.__name__}: {exc}")
+        # Se restaura el padre en lugar de usar el token del ContextVar: un span
+        # abierto dentro de un generador puede cerrarse desde otro contexto
+        _current_span.set(self._parent)
+        self.trace.spans.append(self)
+        return False
+
+    def to_dict(self) -> dict:
+        duration_ns = int((self.duration_s or 0) * 1e9)
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.start_ns + duration_ns,
+            "duration_ms": round(duration_ns / 1e6, 3),
+            "status": self.status,
+            "attributes": {"request_id": self.trace.request_id, **self.attributes},
+        }
+
+
+class _NoopSpan:
+    """Span cuando no hay traza activa: no mide ni guarda nada"""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, request_id: str):
+        self.trace_id = _new_id(16)
+        self.request_id = request_id
+        self.spans = []
+
+
+def span(name: str, **attributes):
+    """Span hijo del span actual; no-op si el request no se está trazando"""
+    trace = _current_trace.get()
+    if trace is None:
+        return NOOP_SPAN
+    return Span(trace, name, _current_span.get(), attributes)
+
+
+def current_span():
+    """Span abierto más interno (o NOOP_SPAN) para añadirle atributos"""
+    return _current_span.get() or NOOP_SPAN
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+class Tracer:
+    def __init__(self, path: str, sample_rate: float = 0.01, slow_threshold_s: float = 0.0,
+                 max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5):
+        """
+        Args:
+            sample_rate: fracción de requests que se escriben (0..1)
+            slow_threshold_s: los requests más lentos que esto se escriben siempre (0 = desactivado)
+            max_bytes / backup_count: rotación del archivo (path, path.1, ... path.N)
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_threshold_s = slow_threshold_s
+        self._rng = random.Random()
+
+        self._logger = logging.getLogger(f"tracing.{path}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+        self.written = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_threshold_s > 0
+
+    def start(self, request_id: str) -> Optional[Trace]:
+        """Activa una traza en el contexto actual (None si el tracer está apagado)"""
+        if not self.enabled:
+            return None
+        trace = Trace(request_id)
+        _current_trace.set(trace)
+        _current_span.set(None)
+        return trace
+
+    def finish(self, trace: Trace, root: Span):
+        sampled = self._rng.random() < self.sample_rate
+        slow = self.slow_threshold_s > 0 and (root.duration_s or 0) >= self.slow_threshold_s
+        if not (sampled or slow):
+            return
+        lines = [json.dumps(s.to_dict(), ensure_ascii=False) for s in trace.spans]
+        self._logger.info("\n".join(lines))
+        self.written += 1
+
+    @contextmanager
+    def trace(self, request_id: str, name: str, **attributes):
+        """Traza con un span raíz `name` alrededor del bloque (requests HTTP, trabajos)"""
+        trace = self.start(request_id)
+        if trace is None:
+            yield NOOP_SPAN
+            return
+        root = Span(trace, name, None, attributes)
+        try:
+            with root:
+                yield root
+        finally:
+            self.finish(trace, root)
+            _current_trace.set(None)
+
+    def close(self):
+        for handler in list(self._logger.handlers):
+            handler.close()
+            self._logger.removeHandler(handler)
+
+
+class TracingMiddleware:
+    """
+    Middleware ASGI: abre la traza, añade X-Request-Id a la respuesta y
+    cubre también el cuerpo en streaming (SSE, NDJSON) hasta el último byte.
+    """
+
+    def __init__(self, app, tracer: Tracer, header: str = "x-request-id"):
+        self.app = app
+        self.tracer = tracer
+        self.header = header.encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == self.header:
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or _new_id(8)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(self.header, request_id.encode("latin-1"))]
+                root.set(status_code=message["status"])
+            await send(message)
+
+        with self.tracer.trace(request_id, "http.request", method=scope["method"], path=scope["path"]) as root:
+            await self.app(scope, receive, send_with_id)